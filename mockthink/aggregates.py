@@ -0,0 +1,117 @@
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+
+from past.utils import old_div
+
+from . import util
+
+#   Running accumulators for grouped aggregations.
+#   `group(...).count()`, `group(...).sum(...)` and the like keep one of these per group
+#   rather than a list of every member, in the spirit of RethinkDB's map-reduce.
+#   Each one gives the same result as the matching ungrouped term (`Count1`, `SumByField`, etc.)
+#   would on the group's members.
+
+NOTHING = object()
+
+class CountAccumulator(object):
+    def __init__(self):
+        self.count = 0
+
+    def add(self, val, elem):
+        self.count += 1
+
+    def result(self):
+        return self.count
+
+class CountIfAccumulator(CountAccumulator):
+    """Counts the elements whose value is true, for `count(value)` and `count(func)`."""
+    def add(self, val, elem):
+        if util.is_truthy(val):
+            self.count += 1
+
+class SumAccumulator(object):
+    def __init__(self):
+        self.total = 0
+
+    def add(self, val, elem):
+        if util.is_num(val):
+            self.total += val
+
+    def result(self):
+        return self.total
+
+class AvgAccumulator(object):
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, val, elem):
+        if util.is_num(val):
+            self.total += val
+            self.count += 1
+
+    def result(self):
+        return old_div(self.total, (self.count + 0.0))
+
+class MaxAccumulator(object):
+    """Keeps the element with the greatest numeric value, like `util.max_mapped`."""
+    def __init__(self):
+        self.best = None
+
+    def better(self, val, best_val):
+        return val > best_val
+
+    def add(self, val, elem):
+        if self.best is None:
+            self.best = (val, elem)
+        elif util.is_num(val) and self.better(val, self.best[0]):
+            self.best = (val, elem)
+
+    def result(self):
+        return self.best[1]
+
+class MinAccumulator(MaxAccumulator):
+    def better(self, val, best_val):
+        return val < best_val
+
+class MaxValueAccumulator(object):
+    """Keeps the greatest value, like `max` over the group's members."""
+    def __init__(self):
+        self.best = NOTHING
+
+    def pick(self, val, best):
+        return max(val, best)
+
+    def add(self, val, elem):
+        self.best = val if self.best is NOTHING else self.pick(val, self.best)
+
+    def result(self):
+        return self.best
+
+class MinValueAccumulator(MaxValueAccumulator):
+    def pick(self, val, best):
+        return min(val, best)
+
+
+ACCUMULATORS = {
+    'count': CountAccumulator,
+    'count_if': CountIfAccumulator,
+    'sum': SumAccumulator,
+    'avg': AvgAccumulator,
+    'max': MaxAccumulator,
+    'min': MinAccumulator,
+    'max_value': MaxValueAccumulator,
+    'min_value': MinValueAccumulator
+}
+
+def group_reduce(group_func, value_func, make_accumulator, sequence):
+    """Return `{group: result}`, feeding `value_func(elem)` for each element to its group's accumulator."""
+    accumulators = OrderedDict()
+    for elem in sequence:
+        key = group_func(elem)
+        acc = accumulators.get(key)
+        if acc is None:
+            acc = accumulators[key] = make_accumulator()
+        acc.add(value_func(elem), elem)
+    return {key: acc.result() for key, acc in accumulators.items()}
@@ -1,6 +1,8 @@
 from __future__ import unicode_literals, absolute_import, print_function, division
 
 from rethinkdb import RqlRuntimeError, RqlDriverError, RqlCompileError
+import copy
+import itertools
 import operator
 import random
 import uuid
@@ -11,7 +13,7 @@ from future.utils import iteritems, text_type
 from past.utils import old_div
 from past.builtins import basestring
 
-from . import util, joins, rtime
+from . import util, indexes, joins, rtime, aggregates
 from .scope import Scope
 
 from . import ast_base
@@ -20,6 +22,29 @@ from .ast_base import LITERAL_OBJECT, LITERAL_LIST, RDatum, RFunc, MakeObj, Make
 from past.builtins import filter
 
 
+def query_stats(term):
+    """The `querystats.QueryStats` of the `MockThink` running `term`, if it collects stats.
+
+    `MockThink.restore` puts these on the `MockDb` itself, so with stats off this is
+    just two attribute lookups.
+    """
+    return getattr(getattr(term, 'mockdb_ref', None), 'query_stats', None)
+
+def table_key(table_term):
+    return '%s.%s' % (table_term.find_db_scope(), table_term.find_table_scope())
+
+def record_lookup(term, table_term, table, rows=0, lookup=True):
+    """Tell the stats that `table`, just read by `table_term`, was looked up rather than scanned.
+
+    Returns the stats and the table's key, or `(None, None)` if there's nothing to record.
+    """
+    stats = query_stats(term)
+    if stats is None or not isinstance(table_term, RTable) or not hasattr(table, 'rows_by_id'):
+        return None, None
+    key = table_key(table_term)
+    stats.record_lookup(key, len(table), rows, lookup=lookup)
+    return stats, key
+
 
 # #################
 #   Query handlers
@@ -31,6 +56,20 @@ class Literal(MonExp):
         pprint({'literal': obj})
         return LITERAL_OBJECT.from_dict(obj)
 
+class RMinVal(RBase):
+    def __init__(self, optargs={}):
+        self.optargs = optargs
+
+    def run(self, arg, scope):
+        return util.MINVAL
+
+class RMaxVal(RBase):
+    def __init__(self, optargs={}):
+        self.optargs = optargs
+
+    def run(self, arg, scope):
+        return util.MAXVAL
+
 class RError0(RBase):
     def __init__(self, *args):
         pass
@@ -82,24 +121,27 @@ class Distinct(MonExp):
     def do_run(self, table_or_seq, arg, scope):
         if 'index' in self.optargs:
             # table
-            table_or_seq = table_or_seq._index_values(self.optargs['index'])
+            table_or_seq = table_or_seq.index_values(self.optargs['index'])
         return list(util.dictable_distinct(table_or_seq))
 
 class Zip(MonExp):
     def do_run(self, sequence, arg, scope):
-        out = []
-        for elem in sequence:
-            out.append(util.extend(elem['left'], elem['right']))
-        return out
+        return util.stream_or_list(sequence, (util.extend(elem['left'], elem['right']) for elem in util.iter_once(sequence)))
 
 class IsEmpty(MonExp):
     def do_run(self, left, arg, scope):
-        return (len(left) == 0)
+        return util.is_empty(left)
 
 class RVar(MonExp):
     def do_run(self, symbol_name, arg, scope):
         return scope.get_sym(symbol_name)
 
+    def compile(self):
+        if ast_base.not_overridden(self, MonExp, 'run') and isinstance(self.left, RDatum):
+            symbol_name = self.left.val
+            return lambda arg, scope: scope.get_sym(symbol_name)
+        return super(RVar, self).compile()
+
 class Not(MonExp):
     def do_run(self, left, arg, scope):
         return (not left)
@@ -128,56 +170,54 @@ class RTable(BinExp):
         return True
 
     def do_run(self, data, table_name, arg, scope):
-        return data.get_table(table_name)
+        table = data.get_table(table_name)
+        stats = query_stats(self)
+        if stats is not None:
+            stats.record_read('%s.%s' % (self.find_db_scope(), table_name), len(table))
+        return table
 
 class Bracket(BinExp):
     def do_run(self, thing, thing_attr, arg, scope):
         return thing[thing_attr]
 
+    def compile(self):
+        if not ast_base.not_overridden(self, BinExp, 'run'):
+            return self.run
+        left = self.left.compile()
+        right = self.right.compile()
+        return lambda arg, scope: left(arg, scope)[right(arg, scope)]
+
 class Get(BinExp):
     def do_run(self, left, right, arg, scope):
+        if hasattr(left, 'get_by_id'):
+            row = left.get_by_id(right)
+            record_lookup(self, self.left, left, 0 if row is None else 1)
+            return row
         return util.find_first(util.match_attr('id', right), left)
 
 class GetAll(BinExp):
     def do_run(self, left, right, arg, scope):
         if 'index' in self.optargs and self.optargs['index'] != 'id':
-            index_func, is_multi = self.find_index_func_for_scope(
-                self.optargs['index'],
-                arg
-            )
-            if isinstance(index_func, RFunc):
-                map_fn = lambda d: index_func.run([d], scope)
-            else:
-                map_fn = index_func
-
-            result = []
-            left = list(left)
-            if is_multi:
-                seen_ids = set([])
-                for elem in left:
-                    indexed = map_fn(elem)
-                    if not isinstance(indexed, (tuple, list)):
-                        indexed = [indexed]
-                    indexed = set(indexed)
-                    for match_item in right:
-                        if match_item in indexed:
-                            if elem['id'] not in seen_ids:
-                                seen_ids.add(elem['id'])
-                                result.append(elem)
-                            break
-            else:
-                for elem in left:
-                    if map_fn(elem) in right:
-                        result.append(elem)
-            return result
-
+            rows = left.get_all_by_index(self.optargs['index'], right)
+        elif hasattr(left, 'get_all_by_id'):
+            rows = left.get_all_by_id(right)
         else:
             return filter(util.match_attr_multi('id', right), left)
+        record_lookup(self, self.left, left, len(rows))
+        return rows
 
 class BinOp(BinExp):
     def do_run(self, left, right, arg, scope):
         return self.__class__.binop(left, right)
 
+    def compile(self):
+        if not ast_base.not_overridden(self, BinExp, 'run'):
+            return self.run
+        binop = self.__class__.binop
+        left = self.left.compile()
+        right = self.right.compile()
+        return lambda arg, scope: binop(left(arg, scope), right(arg, scope))
+
 class Gt(BinOp):
     binop = operator.gt
 
@@ -299,6 +339,7 @@ class Insert(BinExp):
         return util.extend(defaults, self.optargs)
 
     def do_run(self, sequence, to_insert, arg, scope):
+        record_lookup(self, self.left, sequence, lookup=False)
         current_table = self.find_table_scope()
         current_db = self.find_db_scope()
         if isinstance(to_insert, dict):
@@ -323,20 +364,86 @@ class Insert(BinExp):
 
 class FilterWithFunc(ByFuncBase):
     def do_run(self, sequence, filt_fn, arg, scope):
-        return filter(filt_fn, sequence)
+        return util.stream_or_list(sequence, (elem for elem in util.iter_once(sequence) if filt_fn(elem)))
 
 class FilterWithObj(BinExp):
     def do_run(self, sequence, to_match, arg, scope):
-        return filter(util.match_attrs(to_match), sequence)
+        return util.maybe_filter(util.match_attrs(to_match), sequence)
 
 class MapWithRFunc(ByFuncBase):
     def do_run(self, sequence, map_fn, arg, scope):
-        try:
-            result = list(map(map_fn, sequence))
-        except KeyError as k:
-            message = "Missing field '%s'" % text_type(k)
-            self.raise_rql_runtime_error(message)
-        return result
+        def mapped():
+            try:
+                for elem in util.iter_once(sequence):
+                    yield map_fn(elem)
+            except KeyError as k:
+                message = "Missing field '%s'" % text_type(k)
+                self.raise_rql_runtime_error(message)
+        return util.stream_or_list(sequence, mapped())
+
+def with_chain_source(term, source):
+    """Copy a chain of terms down to a table (or to None), replacing the table with `source`."""
+    term = copy.copy(term)
+    if term.left is None or isinstance(term.left, RTable):
+        term.left = source
+    else:
+        term.left = with_chain_source(term.left, source)
+    return term
+
+class Sharded(RBase):
+    """A chain of `map`, `filter` and `concat_map` terms (`left`) over a table, run by a
+    `parallel.WorkerPool` on shards of the table's rows when the table is big enough.
+    """
+    def __init__(self, left, pool):
+        self.left = left
+        self.pool = pool
+
+    def __str__(self):
+        return "<Sharded: %s>" % self.left
+
+    def run(self, arg, scope):
+        table = self.left
+        while not isinstance(table, RTable):
+            table = table.left
+        self.set_mock_ref(table)
+        sequence = table.run(arg, scope)
+        if self.pool.should_split(sequence):
+            return self.pool.run_sharded(with_chain_source(self.left, None), list(sequence), scope)
+        term = with_chain_source(self.left, RDatum(sequence))
+        ast_base.bind_mock_ref(term, getattr(self, 'mockdb_ref', arg))
+        return term.run(arg, scope)
+
+class IndexedFilter(RBase):
+    """A filter over a table, narrowed down by an index lookup (see `optimize`).
+
+    `narrowed` applies the filter to the lookup's results.  Nulls aren't indexed, so if any
+    of the values looked up (`test`) is null, this falls back to the original filter, `left`.
+    """
+    def __init__(self, left, narrowed, test, note):
+        self.left = left
+        self.right = narrowed
+        self.test = test
+        self.note = note
+
+    def __str__(self):
+        return "<IndexedFilter: %s (%s)>" % (self.right, self.note['rewrite'])
+
+    def run(self, arg, scope):
+        if None in self.test.run(arg, scope):
+            return self.left.run(arg, scope)
+        return self.right.run(arg, scope)
+
+    def compile(self):
+        if not ast_base.not_overridden(self, IndexedFilter, 'run'):
+            return self.run
+        test = self.test.compile()
+        fallback = self.left.compile()
+        narrowed = self.right.compile()
+        def run_compiled(arg, scope):
+            if None in test(arg, scope):
+                return fallback(arg, scope)
+            return narrowed(arg, scope)
+        return run_compiled
 
 class WithoutPoly(BinExp):
     def do_run(self, left, attrs, arg, scope):
@@ -366,11 +473,11 @@ class HasFields(BinExp):
 
 class WithFields(BinExp):
     def do_run(self, sequence, keys, arg, scope):
-        return [elem for elem in sequence if util.has_attrs(keys, elem)]
+        return util.stream_or_list(sequence, (elem for elem in util.iter_once(sequence) if util.has_attrs(keys, elem)))
 
 class ConcatMap(ByFuncBase):
     def do_run(self, sequence, map_fn, arg, scope):
-        return util.cat(*[util.map_with(map_fn, elem) for elem in sequence])
+        return util.stream_or_list(sequence, (out for elem in util.iter_once(sequence) for out in map_fn(elem)))
 
 class Skip(BinExp):
     def do_run(self, sequence, num, arg, scope):
@@ -378,11 +485,24 @@ class Skip(BinExp):
 
 class Limit(BinExp):
     def do_run(self, sequence, num, arg, scope):
+        if num < 0:
+            self.raise_rql_runtime_error('LIMIT takes a non-negative argument (got %s)' % num)
         return util.take(num)(sequence)
 
+def slice_indices(indices, optargs):
+    """Return `slice`'s `(start, end)` as Python slice indices, applying `left_bound` and `right_bound`."""
+    start, end = (list(indices) + [None])[0:2]
+    if optargs.get('left_bound', 'closed') == 'open':
+        if start == -1:
+            return 0, 0
+        start += 1
+    if optargs.get('right_bound', 'open') == 'closed' and end is not None:
+        end = None if end == -1 else end + 1
+    return start, end
+
 class Slice(BinExp):
     def do_run(self, sequence, indices, arg, scope):
-        start, end = indices
+        start, end = slice_indices(indices, self.optargs)
         return util.slice_with(start, end)(sequence)
 
 class Nth(BinExp):
@@ -427,15 +547,17 @@ class AvgByFunc(ByFuncBase):
 
 class Count1(MonExp):
     def do_run(self, sequence, arg, scope):
-        return len(list(sequence))
+        if isinstance(sequence, util.Stream):
+            return sum(1 for _ in util.iter_once(sequence))
+        return len(sequence)
 
 class CountByEq(BinExp):
     def do_run(self, sequence, to_match, arg, scope):
-        return len([elem for elem in sequence if elem == to_match])
+        return sum(1 for elem in util.iter_once(sequence) if elem == to_match)
 
 class CountByFunc(ByFuncBase):
     def do_run(self, sequence, filter_fn, arg, scope):
-        return len(filter(filter_fn, list(sequence)))
+        return sum(1 for elem in util.iter_once(sequence) if util.is_truthy(filter_fn(elem)))
 
 class Min1(MonExp):
     def do_run(self, sequence, arg, scope):
@@ -457,6 +579,55 @@ class GroupByFunc(ByFuncBase):
     def do_run(self, sequence, map_fn, arg, scope):
         return util.group_by_func(map_fn, sequence)
 
+class GroupedAggregation(RBase):
+    """`group(...)` followed by an aggregation, run with a running accumulator per group.
+
+    `left` is the sequence, `middle` the group's field or function, and `right` the
+    aggregation's argument, if it has one.  `optargs` hold the name of the accumulator
+    (see `aggregates.ACCUMULATORS`) and how `middle` and `right` are applied to elements.
+    """
+    def __init__(self, left, middle, right, optargs={}):
+        self.left = left
+        self.middle = middle
+        self.right = right
+        self.optargs = optargs
+
+    @staticmethod
+    def elem_func(compiled, kind, arg, scope):
+        # `compiled` is the compiled `middle` or `right`
+        if kind is None:
+            return lambda elem: elem
+        if kind == 'func':
+            return lambda elem: compiled(elem, scope)
+        val = compiled(arg, scope)
+        if kind == 'field':
+            return util.getter(val)
+        return lambda elem: elem == val
+
+    def compiled_children(self):
+        right = None if self.right is None else self.right.compile()
+        return self.left.compile(), self.middle.compile(), right
+
+    def do_run(self, left, middle, right, arg, scope):
+        sequence = left(arg, scope)
+        group_func = self.elem_func(middle, self.optargs['group_by'], arg, scope)
+        value_func = self.elem_func(right, self.optargs['by'], arg, scope)
+        make_accumulator = aggregates.ACCUMULATORS[self.optargs['aggregate']]
+        return aggregates.group_reduce(group_func, value_func, make_accumulator, sequence)
+
+    def run(self, arg, scope):
+        left, middle, right = self.compiled_children()
+        return self.do_run(left, middle, right, arg, scope)
+
+    def compile(self):
+        if not ast_base.not_overridden(self, GroupedAggregation, 'run'):
+            return self.run
+        left, middle, right = self.compiled_children()
+        do_run = self.do_run
+        def run_compiled(arg, scope):
+            return do_run(left, middle, right, arg, scope)
+        return run_compiled
+
 class Append(BinExp):
     def do_run(self, sequence, value, arg, scope):
         return util.append(value, sequence)
@@ -467,14 +638,79 @@ class Prepend(BinExp):
 
 class OrderByFunc(ByFuncBase):
     def do_run(self, sequence, func, arg, scope):
-        tups = [(item, func(item)) for item in sequence]
-        tups.sort(key=lambda x: x[1])
-        return [item[0] for item in tups]
+        return util.sort_by_func(func, sequence)
 
 class OrderByKeys(BinExp):
     def do_run(self, sequence, keys, arg, scope):
         return util.sort_by_many(keys, sequence)
 
+class OrderByIndex(BinExp):
+    """`order_by(index=...)` on a table, streamed from the table's ordered index.
+
+    `right` holds any other keys, which break ties between docs with the same index value.
+    """
+    def do_run(self, table, keys, arg, scope):
+        if not hasattr(table, 'iter_index_order'):
+            self.raise_rql_runtime_error('Indexed order_by can only be performed on a TABLE or TABLE_SLICE.')
+        index_name = self.optargs['index']
+        if index_name != indexes.PRIMARY_INDEX and not table.index_exists(index_name):
+            self.raise_rql_runtime_error('Index `%s` was not found on table `%s`.' % (index_name, table.name))
+        entries = table.iter_index_order(index_name, reverse=(self.optargs['direction'] == 'DESC'))
+        if not keys:
+            return util.Stream(row for _, row in entries)
+        out = []
+        for _, group in itertools.groupby(entries, key=operator.itemgetter(0)):
+            out.extend(util.sort_by_many(keys, [row for _, row in group]))
+        return out
+
+def fits_top_k(start, end):
+    return end is not None and 0 <= start <= end
+
+class OrderByKeysTopK(Ternary):
+    """`order_by(keys)` followed by `limit` or `slice` (see `optimize`).
+
+    Only the first `end` documents are kept while sorting, in a bounded heap.
+    `right` is `[start, end]`, and `optargs` the bounds, as for `Slice`.
+    """
+    def do_run(self, sequence, keys, bounds, arg, scope):
+        start, end = slice_indices(bounds, self.optargs)
+        if not fits_top_k(start, end):
+            return util.sort_by_many(keys, sequence)[start:end]
+        key, reverse = util.order_by_key(keys)
+        return util.top_k(end, key, reverse, sequence)[start:]
+
+class OrderByFuncTopK(RBase):
+    """Like `OrderByKeysTopK`, for `order_by(func)`."""
+    def __init__(self, left, middle, right, optargs={}):
+        self.left = left
+        self.middle = middle
+        self.right = right
+        self.optargs = optargs
+
+    def do_run(self, sequence, func, bounds, arg, scope):
+        start, end = slice_indices(bounds, self.optargs)
+        if not fits_top_k(start, end):
+            return util.sort_by_func(func, sequence)[start:end]
+        return util.top_k(end, util.func_sort_key(func), False, sequence)[start:]
+
+    def run(self, arg, scope):
+        sequence = self.left.run(arg, scope)
+        func = lambda x: self.middle.run(x, scope)
+        bounds = self.right.run(arg, scope)
+        return self.do_run(sequence, func, bounds, arg, scope)
+
+    def compile(self):
+        if not ast_base.not_overridden(self, OrderByFuncTopK, 'run'):
+            return self.run
+        left = self.left.compile()
+        middle = self.middle.compile()
+        right = self.right.compile()
+        do_run = self.do_run
+        def run_compiled(arg, scope):
+            func = lambda x: middle(x, scope)
+            return do_run(left(arg, scope), func, right(arg, scope), arg, scope)
+        return run_compiled
+
 class Random0(RBase):
     def __init__(self, optargs={}):
         self.optargs = optargs
@@ -498,6 +734,8 @@ class Random2(BinExp):
 
 class Union(BinExp):
     def do_run(self, left, right, arg, scope):
+        if util.is_stream(left) or util.is_stream(right):
+            return util.Stream(itertools.chain(util.iter_once(left), util.iter_once(right)))
         return list(left) + list(right)
 
 class Sample(BinExp):
@@ -531,15 +769,16 @@ class SetDifference(BinExp):
 
 class Do(ByFuncBase):
     def do_run(self, left, func, arg, scope):
+        if isinstance(left, util.Stream):
+            left.shared = True
         return func(left)
 
 class UnGroup(MonExp):
     def do_run(self, grouped_seq, arg, scope):
-        for group_name, group_vals in iteritems(grouped_seq):
-            yield {
-                'group': group_name,
-                'reduction': group_vals
-            }
+        return [{
+            'group': group_name,
+            'reduction': group_vals
+        } for group_name, group_vals in iteritems(grouped_seq)]
 
 class Branch(RBase):
     def __init__(self, test, if_true, if_false, optargs={}):
@@ -557,14 +796,11 @@ class Branch(RBase):
 class Difference(BinExp):
     def do_run(self, sequence, to_remove, arg, scope):
         to_remove = set(to_remove)
-        for elem in sequence:
-            if elem not in to_remove:
-                yield elem
+        return util.stream_or_list(sequence, (elem for elem in util.iter_once(sequence) if elem not in to_remove))
 
 
 class ContainsElems(BinExp):
     def do_run(self, sequence, test_for, arg, scope):
-        sequence = list(sequence)
         result = True
         for elem in test_for:
             if elem not in sequence:
@@ -584,7 +820,7 @@ class ContainsFuncs(RBase):
             yield (lambda doc: pred.run([doc], scope))
 
     def run(self, arg, scope):
-        sequence = list(self.left.run(arg, scope))
+        sequence = self.left.run(arg, scope)
         result = True
         for pred in self.iter_preds(scope):
             if not util.any_passing(pred, sequence):
@@ -633,7 +869,7 @@ class DbList(RBase):
 
 class IndexCreateByField(BinExp):
     def do_run(self, sequence, field_name, arg, scope):
-        index_func = util.getter(field_name)
+        index_func = indexes.FieldIndexFunc(field_name)
         current_db = self.find_db_scope()
         current_table = self.find_table_scope()
         multi = self.optargs.get('multi', False)
@@ -791,21 +1027,15 @@ class Between(Ternary):
         }
         options = util.extend(defaults, self.optargs)
 
-        if options['index'] == 'id':
-            map_fn = util.getter('id')
-        else:
-            map_fn, _ = self.find_index_func_for_scope(
-                options['index'],
-                arg
-            )
-
-        left_test, right_test = operators_for_bounds(
-            options['left_bound'], options['right_bound']
+        rows = table.get_in_index_range(
+            options['index'], lower_key, upper_key,
+            left_bound=options['left_bound'], right_bound=options['right_bound'],
+            reverse=(options.get('order') == 'DESC')
         )
-        for document in table:
-            doc_val = map_fn(document)
-            if left_test(doc_val, lower_key) and right_test(doc_val, upper_key):
-                yield document
+        stats, key = record_lookup(self, self.left, table)
+        if stats is not None:
+            rows = stats.counted(key, rows)
+        return util.Stream(rows)
 
 class InsertAt(Ternary):
     def do_run(self, sequence, index, value, arg, scope):
@@ -830,7 +1060,27 @@ class DeleteAt(BinExp):
 
 class EqJoin(Ternary):
     def do_run(self, left, field, right, arg, scope):
-        return joins.do_eq_join(field, left, 'id', right)
+        index_name = self.optargs.get('index', indexes.PRIMARY_INDEX)
+        if not hasattr(right, 'get_all_by_index'):
+            by_val = joins.hash_by_field(index_name, right)
+            lookup = lambda val: by_val.get(util.index_key(val), [])
+        elif index_name == indexes.PRIMARY_INDEX:
+            lookup = lambda val: right.get_all_by_id([val])
+        elif right.index_exists(index_name):
+            lookup = lambda val: right.get_all_by_index(index_name, [val])
+        else:
+            self.raise_rql_runtime_error('Index `%s` was not found on table `%s`.' % (index_name, right.name))
+        stats, key = record_lookup(self, self.right, right)
+        if stats is not None:
+            lookup = counted_lookup(stats, key, lookup)
+        return util.stream_or_list(left, joins.iter_eq_join(field, util.iter_once(left), lookup))
+
+def counted_lookup(stats, key, lookup):
+    def lookup_counted(val):
+        rows = lookup(val)
+        stats.record_rows(key, len(rows))
+        return rows
+    return lookup_counted
 
 class InnerOuterJoinBase(RBase):
     def __init__(self, left, middle, right, optargs={}):
@@ -853,6 +1103,56 @@ class OuterJoin(InnerOuterJoinBase):
     def do_run(self, left, right, pred, arg, scope):
         return joins.do_outer_join(pred, left, right)
 
+class HashJoinBase(RBase):
+    """An inner or outer join whose predicate is `l[field] == r[other_field]`, maybe ANDed with more.
+
+    Pairs are matched through a hash of the `middle` sequence on `optargs['fields']`, and
+    `right`, a function of the rest of the predicate (or None), only runs on matching pairs.
+    """
+    outer = False
+
+    def __init__(self, left, middle, right, optargs={}):
+        self.left = left
+        self.middle = middle
+        self.right = right
+        self.optargs = optargs
+
+    def do_run(self, left_seq, right_seq, pred, arg, scope):
+        left_field, right_field = self.optargs['fields']
+        return util.stream_or_list(left_seq, joins.iter_hash_join(
+            operator.itemgetter(left_field), util.iter_once(left_seq),
+            operator.itemgetter(right_field), right_seq,
+            pred=pred, outer=self.outer
+        ))
+
+    def run(self, arg, scope):
+        left_seq = self.left.run(arg, scope)
+        right_seq = self.middle.run(arg, scope)
+        pred = None
+        if self.right is not None:
+            pred = lambda x, y: self.right.run([x, y], scope)
+        return self.do_run(left_seq, right_seq, pred, arg, scope)
+
+    def compile(self):
+        if not ast_base.not_overridden(self, HashJoinBase, 'run'):
+            return self.run
+        left = self.left.compile()
+        middle = self.middle.compile()
+        right = None if self.right is None else self.right.compile()
+        do_run = self.do_run
+        def run_compiled(arg, scope):
+            pred = None
+            if right is not None:
+                pred = lambda x, y: right([x, y], scope)
+            return do_run(left(arg, scope), middle(arg, scope), pred, arg, scope)
+        return run_compiled
+
+class HashInnerJoin(HashJoinBase):
+    pass
+
+class HashOuterJoin(HashJoinBase):
+    outer = True
+
 
 
 
@@ -10,10 +10,34 @@ class AttrHaving(object):
             setattr(self, k, v)
 
 
+def not_overridden(instance, base_class, method_name):
+    return getattr(type(instance), method_name) == getattr(base_class, method_name)
+
+def shallow_copy(term):
+    #   Like `copy.copy`, without going through `__getstate__`.
+    out = object.__new__(term.__class__)
+    out.__dict__.update(term.__dict__)
+    return out
+
+def bind_mock_ref(query, mockdb_ref):
+    """Set `mockdb_ref` on every term in a query.
+
+    The tree-walking `run` hands the ref down from parent to child as it goes;
+    compiled queries don't, so it has to be set on the whole tree up front.
+    """
+    to_visit = [query]
+    while to_visit:
+        node = to_visit.pop()
+        node.mockdb_ref = mockdb_ref
+        to_visit.extend(node.children())
+
+
 # #################
 #   Base classes
 # #################
 
+CHILD_ATTRS = ('left', 'middle', 'right', 'body', 'test', 'if_true', 'if_false')
+
 class RBase(object):
     def __init__(self, *args):
         pass
@@ -39,21 +63,6 @@ class RBase(object):
                     break
         return result
 
-    def find_index_func_for_scope(self, index_name, db_arg):
-        table = self.find_table_scope()
-        db = self.find_db_scope()
-        db_scope = self.find_db_scope()
-        table_scope = self.find_table_scope()
-        func = db_arg.get_index_func_in_table_in_db(
-            db_scope,
-            table_scope,
-            index_name
-        )
-        is_multi = db_arg.is_multi_index(
-            db_scope, table_scope, index_name
-        )
-        return func, is_multi
-
     def raise_rql_runtime_error(self, msg):
         from rethinkdb import RqlRuntimeError
         # temporary jankiness to get it working
@@ -74,10 +83,38 @@ class RBase(object):
         })
         raise RqlCompileError(msg, term, [])
 
+    def __getstate__(self):
+        #   Terms are pickled to run in worker processes (see `parallel`), which don't get the db.
+        state = dict(self.__dict__)
+        state.pop('mockdb_ref', None)
+        return state
+
     def set_mock_ref(self, other):
         if hasattr(self, 'mockdb_ref'):
             other.mockdb_ref = self.mockdb_ref
 
+    def children(self):
+        out = []
+        for attr in CHILD_ATTRS:
+            child = getattr(self, attr, None)
+            if isinstance(child, RBase):
+                out.append(child)
+        vals = getattr(self, 'vals', None)
+        if isinstance(vals, dict):
+            out.extend(v for v in vals.values() if isinstance(v, RBase))
+        elif isinstance(vals, list):
+            out.extend(v for v in vals if isinstance(v, RBase))
+        return out
+
+    def compile(self):
+        """Return a function of `(arg, scope)` which evaluates this term like `run` does.
+
+        Terms that know how to compile themselves return a closure over their children's
+        compiled functions, so evaluation skips `run`'s per-call bookkeeping.  Anything else
+        falls back to the tree-walking `run`.
+        """
+        return self.run
+
 class RDatum(RBase):
     def __init__(self, val, optargs={}):
         self.val = val
@@ -88,6 +125,11 @@ class RDatum(RBase):
     def run(self, arg, scope):
         return self.val
 
+    def compile(self):
+        if not_overridden(self, RDatum, 'run'):
+            return lambda arg, scope: self.val
+        return self.run
+
 class RFunc(RBase):
     def __init__(self, param_names, body, optargs={}):
         self.param_names = param_names
@@ -106,7 +148,18 @@ class RFunc(RBase):
             args = [args]
         bound = util.as_obj(zip(self.param_names, args))
         call_scope = scope.push(bound)
-        return self.body.run(None, call_scope)
+        return util.materialize(self.body.run(None, call_scope))
+
+    def compile(self):
+        if not not_overridden(self, RFunc, 'run'):
+            return self.run
+        body = self.body.compile()
+        param_names = self.param_names
+        def run_compiled(args, scope):
+            if not isinstance(args, list):
+                args = [args]
+            return util.materialize(body(None, scope.push(dict(zip(param_names, args)))))
+        return run_compiled
 
 class MonExp(RBase):
     def __init__(self, left, optargs={}):
@@ -125,6 +178,15 @@ class MonExp(RBase):
         left = self.left.run(arg, scope)
         return self.do_run(left, arg, scope)
 
+    def compile(self):
+        if not not_overridden(self, MonExp, 'run'):
+            return self.run
+        left = self.left.compile()
+        do_run = self.do_run
+        def run_compiled(arg, scope):
+            return do_run(left(arg, scope), arg, scope)
+        return run_compiled
+
 
 class BinExp(RBase):
     def __init__(self, left, right, optargs={}):
@@ -146,6 +208,16 @@ class BinExp(RBase):
         right = self.right.run(arg, scope)
         return self.do_run(left, right, arg, scope)
 
+    def compile(self):
+        if not not_overridden(self, BinExp, 'run'):
+            return self.run
+        left = self.left.compile()
+        right = self.right.compile()
+        do_run = self.do_run
+        def run_compiled(arg, scope):
+            return do_run(left(arg, scope), right(arg, scope), arg, scope)
+        return run_compiled
+
 
 class Ternary(RBase):
     def __init__(self, left, middle, right, optargs={}):
@@ -165,6 +237,17 @@ class Ternary(RBase):
         right = self.right.run(arg, scope)
         return self.do_run(left, middle, right, arg, scope)
 
+    def compile(self):
+        if not not_overridden(self, Ternary, 'run'):
+            return self.run
+        left = self.left.compile()
+        middle = self.middle.compile()
+        right = self.right.compile()
+        do_run = self.do_run
+        def run_compiled(arg, scope):
+            return do_run(left(arg, scope), middle(arg, scope), right(arg, scope), arg, scope)
+        return run_compiled
+
 class ByFuncBase(RBase):
     def __init__(self, left, right, optargs={}):
         self.left = left
@@ -181,6 +264,17 @@ class ByFuncBase(RBase):
         map_fn = lambda x: self.right.run(x, scope)
         return self.do_run(left, map_fn, arg, scope)
 
+    def compile(self):
+        if not not_overridden(self, ByFuncBase, 'run'):
+            return self.run
+        left = self.left.compile()
+        right = self.right.compile()
+        do_run = self.do_run
+        def run_compiled(arg, scope):
+            map_fn = lambda x: right(x, scope)
+            return do_run(left(arg, scope), map_fn, arg, scope)
+        return run_compiled
+
 class MakeObj(RBase):
     def __init__(self, vals, **kwargs):
         self.vals = vals
@@ -189,9 +283,17 @@ class MakeObj(RBase):
         out = {}
         for k, v in iteritems(self.vals):
             self.set_mock_ref(v)
-            out[k] = v.run(arg, scope)
+            out[k] = util.materialize(v.run(arg, scope))
         return out
 
+    def compile(self):
+        if not not_overridden(self, MakeObj, 'run'):
+            return self.run
+        compiled = [(k, v.compile()) for k, v in iteritems(self.vals)]
+        def run_compiled(arg, scope):
+            return {k: util.materialize(v(arg, scope)) for k, v in compiled}
+        return run_compiled
+
 class MakeArray(RBase):
     def __init__(self, vals):
         self.vals = vals
@@ -200,9 +302,17 @@ class MakeArray(RBase):
         out = []
         for elem in self.vals:
             self.set_mock_ref(elem)
-            out.append(elem.run(arg, scope))
+            out.append(util.materialize(elem.run(arg, scope)))
         return out
 
+    def compile(self):
+        if not not_overridden(self, MakeArray, 'run'):
+            return self.run
+        compiled = [elem.compile() for elem in self.vals]
+        def run_compiled(arg, scope):
+            return [util.materialize(elem(arg, scope)) for elem in compiled]
+        return run_compiled
+
 class LITERAL_OBJECT(dict):
     @staticmethod
     def from_dict(a_dict):
@@ -0,0 +1,168 @@
+from __future__ import absolute_import, division, print_function
+
+import platform
+import random
+import timeit
+
+import rethinkdb as r
+
+from ..db import MockThink
+from ..indexes import FieldIndexFunc
+from ..version import VERSION
+
+#   Benchmarks of common queries against synthetic tables.
+#   Run with `python -m mockthink.bench`; see `__main__` for the options.
+#
+#   `people` has `rows` rows, each one in one of `GROUPS` groups, and `groups` has a row per group.
+#   Every case is timed `repeat` times, each time inside a savepoint, so that every run
+#   starts from the same data.
+
+GROUPS = 100
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+DEFAULT_REPEAT = 5
+
+
+def make_people(count, seed=0):
+    rand = random.Random(seed)
+    return [{
+        'id': n,
+        'name': 'person-%d' % n,
+        'age': rand.randint(18, 90),
+        'score': rand.random() * 100,
+        'group': rand.randint(0, GROUPS - 1),
+        'tags': rand.sample(['red', 'green', 'blue', 'black', 'white'], 2)
+    } for n in range(0, count)]
+
+def make_groups():
+    return [{'id': n, 'name': 'group-%d' % n} for n in range(0, GROUPS)]
+
+def make_mock(rows, seed=0):
+    return MockThink({
+        'dbs': {
+            'bench': {
+                'tables': {
+                    'people': {
+                        'rows': make_people(rows, seed),
+                        'indexes': {'group': {'func': FieldIndexFunc('group'), 'multi': False}}
+                    },
+                    'groups': make_groups()
+                }
+            }
+        }
+    })
+
+
+def people():
+    return r.db('bench').table('people')
+
+def groups():
+    return r.db('bench').table('groups')
+
+def consume(result):
+    if isinstance(result, (list, dict)):
+        return result
+    return list(result)
+
+
+class Case(object):
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+def case(name):
+    def decorator(func):
+        CASES.append(Case(name, func))
+        return func
+    return decorator
+
+CASES = []
+
+@case('get')
+def bench_get(mock, conn, rows):
+    for n in range(0, 100):
+        people().get((n * 7919) % rows).run(conn)
+
+@case('get_all_by_index')
+def bench_get_all_by_index(mock, conn, rows):
+    consume(people().get_all(7, index='group').run(conn))
+
+@case('filter')
+def bench_filter(mock, conn, rows):
+    consume(people().filter(lambda p: (p['age'] > 60) & (p['score'] < 50)).run(conn))
+
+@case('map')
+def bench_map(mock, conn, rows):
+    consume(people().map(lambda p: p['score'] * 2 + p['age']).run(conn))
+
+@case('order_by_limit')
+def bench_order_by_limit(mock, conn, rows):
+    consume(people().order_by(r.desc('score')).limit(10).run(conn))
+
+@case('group_count')
+def bench_group_count(mock, conn, rows):
+    consume(people().group('group').count().run(conn))
+
+@case('eq_join')
+def bench_eq_join(mock, conn, rows):
+    consume(people().eq_join('group', groups()).run(conn))
+
+@case('inner_join')
+def bench_inner_join(mock, conn, rows):
+    consume(groups().inner_join(people(), lambda g, p: g['id'] == p['group']).run(conn))
+
+@case('insert')
+def bench_insert(mock, conn, rows):
+    people().insert([{'id': rows + n, 'name': 'new', 'group': n % GROUPS} for n in range(0, 1000)]).run(conn)
+
+@case('update')
+def bench_update(mock, conn, rows):
+    people().filter(lambda p: p['group'] == 3).update({'flagged': True}).run(conn)
+
+@case('delete')
+def bench_delete(mock, conn, rows):
+    people().filter(lambda p: p['group'] == 4).delete().run(conn)
+
+@case('reset')
+def bench_reset(mock, conn, rows):
+    mock.reset()
+
+
+def time_case(bench_case, mock, rows, repeat):
+    conn = mock.get_conn()
+    timings = []
+    for _ in range(0, repeat):
+        with mock.savepoint():
+            start = timeit.default_timer()
+            bench_case.func(mock, conn, rows)
+            timings.append(timeit.default_timer() - start)
+    timings.sort()
+    return {
+        'name': bench_case.name,
+        'rows': rows,
+        'repeat': repeat,
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'mean': sum(timings) / len(timings)
+    }
+
+def run(sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT, only=None, seed=0, log=None):
+    """Run the benchmarks, and return the results as a dict which can be dumped to JSON."""
+    results = []
+    for rows in sizes:
+        mock = make_mock(rows, seed)
+        for bench_case in CASES:
+            if only and bench_case.name not in only:
+                continue
+            result = time_case(bench_case, mock, rows, repeat)
+            if log is not None:
+                log(result)
+            results.append(result)
+    return {
+        'mockthink_version': VERSION,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'seed': seed,
+        'results': results
+    }
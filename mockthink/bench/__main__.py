@@ -0,0 +1,35 @@
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import sys
+
+from . import CASES, DEFAULT_REPEAT, DEFAULT_SIZES, run
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m mockthink.bench', description='Time common mockthink queries.')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='table sizes to run with (default: %s)' % ' '.join(map(str, DEFAULT_SIZES)))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='runs of each case (default: %d)' % DEFAULT_REPEAT)
+    parser.add_argument('--only', nargs='+', choices=[c.name for c in CASES], help='cases to run')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the generated data')
+    parser.add_argument('--output', '-o', help='file to write the JSON results to (default: stdout)')
+    return parser.parse_args(argv)
+
+def log_result(result):
+    print('%(name)20s %(rows)9d rows  min %(min).6fs  median %(median).6fs' % result, file=sys.stderr)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(sizes=args.rows, repeat=args.repeat, only=args.only, seed=args.seed, log=log_result)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+if __name__ == '__main__':
+    main()
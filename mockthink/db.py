@@ -1,15 +1,20 @@
 from __future__ import print_function
 
+import atexit
 import contextlib
-from pprint import pprint
+import json
+import threading
+import uuid
+from collections import OrderedDict, deque
 
 import rethinkdb
-from future.utils import iteritems
+from future.utils import iteritems, text_type
+from rethinkdb import RqlCursorEmpty
 
-from . import rtime, util
-from .rql_rewrite import rewrite_query
+from . import ast_base, indexes, optimize, parallel, plans, profiler, querystats, rtime, storage, util
+from .persistent import OrderedPMap
+from .rql_rewrite import DEFAULT_REWRITE_CACHE_SIZE, RewriteCache, rewrite_query
 from .scope import Scope
-from past.builtins import xrange
 
 def fill_missing_report_results(report):
     defaults = {
@@ -21,107 +26,229 @@ def fill_missing_report_results(report):
     }
     return util.extend(defaults, report)
 
-def replace_array_elems_by_id(existing, replace_with):
-    report = {
-        'replaced': 0,
-        'changes': []
-    }
-    elem_index_by_id = {}
-    for index in xrange(0, len(existing)):
-        elem = existing[index]
-        elem_index_by_id[util.getter('id')(elem)] = index
-
-    to_return = util.clone_array(existing)
-
-    for elem in replace_with:
-        index = elem_index_by_id[util.getter('id')(elem)]
-        change = {
-            'old_val': existing[index],
-            'new_val': elem
-        }
-        report['changes'].append(change)
-        report['replaced'] += 1
-        to_return[index] = elem
-
-    return to_return, fill_missing_report_results(report)
-
-def remove_array_elems_by_id(existing, to_remove):
-    report = {
-        'deleted': 0,
-        'changes': []
-    }
-    result = util.clone_array(existing)
-    for elem in to_remove:
-        if elem in result:
-            report['deleted'] += 1
-            report['changes'].append({'old_val': elem, 'new_val': None})
-            result.remove(elem)
-    return result, report
-
-def insert_into_table_with_conflict_setting(existing, to_insert, conflict):
-    assert(conflict in ('error', 'update', 'replace'))
-    existing_by_id = {row['id']: row for row in existing}
-    seen = set([])
-    result = []
-    result_report = {
-        'errors': 0,
-        'inserted': 0,
-        'replaced': 0,
-        'changes': []
-    }
-    for doc in to_insert:
-        change = {}
-        if doc['id'] in existing_by_id:
-            existing_row = existing_by_id[doc['id']]
-            change['old_val'] = existing_row
-            if conflict == 'error':
-                result_report['errors'] += 1
-                continue
-            elif conflict == 'update':
-                result_row = util.extend(existing_row, doc)
-            elif conflict == 'replace':
-                result_row = doc
-            result_report['replaced'] += 1
-            seen.add(doc['id'])
-        else:
-            change['old_val'] = None
-            result_report['inserted'] += 1
-            result_row = doc
-        result.append(result_row)
-        change['new_val'] = result_row
-        result_report['changes'].append(change)
-
-    not_updated = [row for row in existing if row['id'] not in seen]
-    result = not_updated + result
-    return result, fill_missing_report_results(result_report)
+def rows_by_id_of_list(rows):
+    return OrderedPMap.from_items((util.index_key(util.getter('id', row)), row) for row in rows)
 
 class MockTableData(object):
-    def __init__(self, name, rows, indexes):
+    def __init__(self, name, rows, indexes, rows_by_id=None, index_maps=None, ordered_indexes=None,
+                 mapped_rows=None):
         self.name = name
-        self.rows = rows
+        if rows_by_id is None and mapped_rows is None:
+            rows_by_id = rows_by_id_of_list(rows)
+        self._rows_by_id = rows_by_id
         self.indexes = indexes
 
+        # rows in a fixture file (see `storage`), which aren't decoded until they're needed.
+        self.mapped_rows = mapped_rows
+
+        # materialized secondary indexes, by index name.  Indexes created with `create_index`
+        # are materialized right away; ones passed in with the initial data are built on first use.
+        self.index_maps = dict(index_maps or {})
+
+        # ordered indexes for range queries, by index name (including the primary key).
+        # These are built the first time a range query needs them, and kept up to date from then on.
+        self.ordered_indexes = dict(ordered_indexes or {})
+
+        # Tables are shared by every query running on a snapshot, so rows are decoded, and
+        # indexes built, under this lock.  Built indexes are swapped in as new dicts, which
+        # leaves anyone iterating over the old ones alone.
+        self.lock = threading.RLock()
+
+    @property
+    def rows_by_id(self):
+        rows_by_id = self._rows_by_id
+        if rows_by_id is None:
+            with self.lock:
+                if self._rows_by_id is None:
+                    self._rows_by_id = rows_by_id_of_list(self.mapped_rows)
+                    self.mapped_rows = None
+                rows_by_id = self._rows_by_id
+        return rows_by_id
+
+    @property
+    def rows(self):
+        return list(self.rows_by_id.itervalues())
+
+    def _with_rows_by_id(self, rows_by_id, changes):
+        index_maps = {}
+        for index_name, index_map in iteritems(self.index_maps):
+            index_maps[index_name] = indexes.update_index_map(
+                index_map, self.indexes[index_name], changes
+            )
+        ordered_indexes = {}
+        for index_name, ordered in iteritems(self.ordered_indexes):
+            index_spec = self.indexes.get(index_name) if index_name != indexes.PRIMARY_INDEX else None
+            ordered_indexes[index_name] = indexes.update_ordered_index(ordered, index_spec, changes)
+        return MockTableData(
+            self.name, None, self.indexes,
+            rows_by_id=rows_by_id, index_maps=index_maps, ordered_indexes=ordered_indexes
+        )
+
+    def _with_indexes(self, new_indexes, index_maps):
+        ordered_indexes = {}
+        if indexes.PRIMARY_INDEX in self.ordered_indexes:
+            ordered_indexes[indexes.PRIMARY_INDEX] = self.ordered_indexes[indexes.PRIMARY_INDEX]
+        return MockTableData(
+            self.name, None, new_indexes,
+            rows_by_id=self.rows_by_id, index_maps=index_maps, ordered_indexes=ordered_indexes
+        )
+
+    def _index_map(self, index_name):
+        index_map = self.index_maps.get(index_name)
+        if index_map is None:
+            with self.lock:
+                index_map = self.index_maps.get(index_name)
+                if index_map is None:
+                    index_map = indexes.build_index_map(self.indexes[index_name], self.rows_by_id)
+                    self.index_maps = util.extend(self.index_maps, {index_name: index_map})
+        return index_map
+
+    def _current_row(self, changed, key):
+        if key in changed:
+            return changed[key]
+        return self.rows_by_id.get(key)
+
+    def _with_changes(self, changed, removed=None):
+        if removed is None:
+            removed = {}
+        changes = [(key, self.rows_by_id.get(key), row) for key, row in iteritems(changed)]
+        changes.extend((key, row, None) for key, row in iteritems(removed))
+        rows_by_id = self.rows_by_id.update(iteritems(changed), removed=removed)
+        return self._with_rows_by_id(rows_by_id, changes)
+
     def replace_all(self, rows, indexes):
         return MockTableData(self.name, rows, indexes)
 
+    def get_by_id(self, id):
+        rows_by_id = self._rows_by_id
+        if rows_by_id is None:
+            with self.lock:
+                rows_by_id = self._rows_by_id
+                if rows_by_id is None:
+                    return self.mapped_rows.get(id)
+        return rows_by_id.get(util.index_key(id))
+
+    def get_all_by_id(self, ids):
+        seen = set([])
+        out = []
+        for id in ids:
+            key = util.index_key(id)
+            row = self.rows_by_id.get(key)
+            if row is not None and key not in seen:
+                seen.add(key)
+                out.append(row)
+        return out
+
+    def get_all_by_index(self, index_name, values):
+        index_map = self._index_map(index_name)
+        return [self.rows_by_id.get(id_key) for id_key in indexes.id_keys_for_values(index_map, values)]
+
+    def _ordered_index(self, index_name):
+        ordered = self.ordered_indexes.get(index_name)
+        if ordered is None:
+            with self.lock:
+                ordered = self.ordered_indexes.get(index_name)
+                if ordered is None:
+                    if index_name == indexes.PRIMARY_INDEX:
+                        ordered = indexes.build_primary_ordered_index(self.rows_by_id)
+                    else:
+                        ordered = indexes.build_ordered_index(self._index_map(index_name))
+                    self.ordered_indexes = util.extend(self.ordered_indexes, {index_name: ordered})
+        return ordered
+
+    def get_in_index_range(self, index_name, lower, upper, left_bound='closed', right_bound='open', reverse=False):
+        start, stop = indexes.range_probes(lower, upper, left_bound, right_bound)
+        for _, row in self._iter_ordered_index(index_name, start, stop, reverse):
+            yield row
+
+    def iter_index_order(self, index_name, reverse=False):
+        """Yield `(sort key of index value, row)` pairs in the order of an index."""
+        return self._iter_ordered_index(index_name, None, None, reverse)
+
+    def _iter_ordered_index(self, index_name, start, stop, reverse):
+        entries = self._ordered_index(index_name).irange(start, stop, reverse=reverse)
+        if index_name == indexes.PRIMARY_INDEX or not self.is_multi_index(index_name):
+            for sort_key, _, id_key in entries:
+                yield sort_key, self.rows_by_id.get(id_key)
+            return
+        seen = set([])
+        for sort_key, _, id_key in entries:
+            if id_key not in seen:
+                seen.add(id_key)
+                yield sort_key, self.rows_by_id.get(id_key)
+
     def update_by_id(self, updated_rows):
         if not isinstance(updated_rows, list):
             updated_rows = [updated_rows]
-        new_data, report = replace_array_elems_by_id(self.rows, updated_rows)
-        return MockTableData(self.name, new_data, self.indexes), report
-
-    def insert(self, new_rows, conflict):
+        report = {
+            'replaced': 0,
+            'changes': []
+        }
+        changed = OrderedDict()
+        for elem in updated_rows:
+            key = util.index_key(elem['id'])
+            old_val = self._current_row(changed, key)
+            if old_val is None:
+                raise KeyError(elem['id'])
+            report['changes'].append({
+                'old_val': old_val,
+                'new_val': elem
+            })
+            report['replaced'] += 1
+            changed[key] = elem
+        return self._with_changes(changed), fill_missing_report_results(report)
+
+    def insert(self, new_rows, conflict, changes=True):
         assert(conflict in ('error', 'update', 'replace'))
-        if not isinstance(new_rows, list):
+        if isinstance(new_rows, dict):
             new_rows = [new_rows]
-        new_data, report = insert_into_table_with_conflict_setting(self.rows, new_rows, conflict)
-        return MockTableData(self.name, new_data, self.indexes), report
+        report = {
+            'errors': 0,
+            'inserted': 0,
+            'replaced': 0,
+            'changes': []
+        }
+        changed = OrderedDict()
+        for doc in new_rows:
+            key = util.index_key(doc['id'])
+            change = {}
+            existing_row = self._current_row(changed, key)
+            if existing_row is not None:
+                change['old_val'] = existing_row
+                if conflict == 'error':
+                    report['errors'] += 1
+                    continue
+                elif conflict == 'update':
+                    result_row = util.extend(existing_row, doc)
+                elif conflict == 'replace':
+                    result_row = doc
+                report['replaced'] += 1
+            else:
+                change['old_val'] = None
+                report['inserted'] += 1
+                result_row = doc
+            changed[key] = result_row
+            if changes:
+                change['new_val'] = result_row
+                report['changes'].append(change)
+        return self._with_changes(changed), fill_missing_report_results(report)
 
     def remove_by_id(self, to_remove):
         if not isinstance(to_remove, list):
             to_remove = [to_remove]
-        new_data, report = remove_array_elems_by_id(self.rows, to_remove)
-        return MockTableData(self.name, new_data, self.indexes), report
+        report = {
+            'deleted': 0,
+            'changes': []
+        }
+        removed = OrderedDict()
+        for elem in to_remove:
+            key = util.index_key(util.getter('id', elem))
+            old_val = self.rows_by_id.get(key)
+            if old_val is not None and key not in removed:
+                report['deleted'] += 1
+                report['changes'].append({'old_val': old_val, 'new_val': None})
+                removed[key] = old_val
+        return self._with_changes({}, removed), report
 
     def get_rows(self):
         return self.rows
@@ -131,16 +258,22 @@ class MockTableData(object):
             'func': index_func,
             'multi': multi
         }
-        return MockTableData(self.name, self.rows, util.extend(self.indexes, {index_name: to_add}))
+        index_maps = util.extend(self.index_maps, {
+            index_name: indexes.build_index_map(to_add, self.rows_by_id)
+        })
+        return self._with_indexes(util.extend(self.indexes, {index_name: to_add}), index_maps)
 
     def rename_index(self, old_name, new_name):
         new_indexes = util.without([old_name], self.indexes)
         new_indexes[new_name] = self.indexes[old_name]
-        return MockTableData(self.name, self.rows, new_indexes)
+        index_maps = util.without([old_name, new_name], self.index_maps)
+        if old_name in self.index_maps:
+            index_maps[new_name] = self.index_maps[old_name]
+        return self._with_indexes(new_indexes, index_maps)
 
     def drop_index(self, index_name):
         new_indexes = util.without([index_name], self.indexes)
-        return MockTableData(self.name, self.rows, new_indexes)
+        return self._with_indexes(new_indexes, util.without([index_name], self.index_maps))
 
     def list_indexes(self):
         return self.indexes.keys()
@@ -148,11 +281,8 @@ class MockTableData(object):
     def index_exists(self, index):
         return index in self.indexes
 
-    def _index_values(self, index_name):
-        func = self.get_index_func(index_name)
-        out = [func(elem) for elem in self.rows]
-        pprint({'func': func, 'out': out})
-        return out
+    def index_values(self, index_name):
+        return indexes.index_values(self._index_map(index_name))
 
     def get_index_func(self, index):
         return self.indexes[index].get('func')
@@ -161,11 +291,22 @@ class MockTableData(object):
         return self.indexes[index].get('multi', False)
 
     def __iter__(self):
-        for elem in self.rows:
+        for elem in self.rows_by_id.itervalues():
             yield elem
 
+    def __len__(self):
+        rows_by_id = self._rows_by_id
+        if rows_by_id is None:
+            with self.lock:
+                rows_by_id = self._rows_by_id
+                if rows_by_id is None:
+                    return len(self.mapped_rows)
+        return len(rows_by_id)
+
     def __getitem__(self, index):
-        return self.rows[index]
+        if isinstance(index, slice):
+            return self.rows[index]
+        return self.rows_by_id.nth_value(index)
 
     def __repr__(self):
         return '<MockTableData name="%s"/>' % self.name
@@ -193,6 +334,9 @@ class MockDbData(object):
         return MockDbData(tables)
 
 class MockDb(object):
+    #   Set by `MockThink.restore`, along with `mockthink`.
+    query_stats = None
+
     def __init__(self, dbs_by_name):
         self.dbs_by_name = dbs_by_name
 
@@ -289,76 +433,356 @@ def objects_from_pods(data):
             else:
                 indexes = table_data.get('indexes', {})
                 table_data = table_data.get('rows', [])
-            tables_by_name[table_name] = MockTableData(
-                table_name, table_data, indexes
-            )
+            if isinstance(table_data, storage.MappedRows):
+                table = MockTableData(table_name, None, indexes, mapped_rows=table_data)
+            else:
+                table = MockTableData(table_name, table_data, indexes)
+            tables_by_name[table_name] = table
         dbs_by_name[db_name] = MockDbData(tables_by_name)
     return MockDb(dbs_by_name)
 
+def with_id(row):
+    if 'id' not in row:
+        row['id'] = text_type(uuid.uuid4())
+    return row
+
+DEFAULT_MAX_BATCH_ROWS = 1000
+
+class MockThinkCursorEmpty(RqlCursorEmpty, StopIteration):
+    pass
+
+def approx_size_in_bytes(elem):
+    return len(json.dumps(elem, default=text_type))
+
+class MockThinkCursor(object):
+    """Stands in for the driver's `Cursor` for queries which return a stream.
+
+    Results are pulled from the stream a batch at a time.  The first batch is
+    fetched when the cursor is created, so errors in it are raised from `run()`.
+    """
+    def __init__(self, mockthink, stream, now_time,
+                 max_batch_rows=DEFAULT_MAX_BATCH_ROWS, max_batch_bytes=None, stats_entry=None):
+        self.mockthink = mockthink
+        self.source = util.iter_once(stream)
+        self.now_time = now_time
+        self.stats_entry = stats_entry
+        self.max_batch_rows = max_batch_rows or DEFAULT_MAX_BATCH_ROWS
+        self.max_batch_bytes = max_batch_bytes
+        self.items = deque()
+        self.fetch_batch()
+
+    def fetch_batch(self):
+        if self.source is None:
+            return
+        batch_bytes = 0
+        fetched = len(self.items)
+        with self.mockthink.query_now_time(self.now_time), self.mockthink.measuring_query(self.stats_entry):
+            for _ in range(0, self.max_batch_rows):
+                try:
+                    elem = next(self.source)
+                except StopIteration:
+                    self.source = None
+                    break
+                self.items.append(util.deep_clone(elem))
+                if self.max_batch_bytes is not None:
+                    batch_bytes += approx_size_in_bytes(elem)
+                    if batch_bytes >= self.max_batch_bytes:
+                        break
+        if self.stats_entry is not None:
+            self.mockthink.query_stats.add_to_entry(self.stats_entry, rows_returned=len(self.items) - fetched)
+
+    def next(self, wait=True):
+        if not self.items:
+            self.fetch_batch()
+        if not self.items:
+            raise MockThinkCursorEmpty()
+        return self.items.popleft()
+
+    __next__ = next
+
+    def __iter__(self):
+        return self
+
+    def close(self):
+        self.source = None
+        self.items.clear()
+
+    def __repr__(self):
+        state = 'done streaming' if self.source is None else 'streaming'
+        return '<MockThinkCursor (%s) buffered=%d>' % (state, len(self.items))
+
 class MockThinkConn(object):
     def __init__(self, mockthink_parent):
         self.mockthink_parent = mockthink_parent
     def reset_data(self, data):
         self.mockthink_parent._modify_initial_data(data)
     def _start(self, rql_query, **global_optargs):
-        return self.mockthink_parent.run_query(rewrite_query(rql_query))
+        query, fingerprint = self.mockthink_parent.rewrite_cache.rewrite_with_fingerprint(rql_query)
+        return self.mockthink_parent.run_query(
+            query,
+            max_batch_rows=global_optargs.get('max_batch_rows'),
+            max_batch_bytes=global_optargs.get('max_batch_bytes'),
+            profile=global_optargs.get('profile', False),
+            fingerprint=fingerprint
+        )
 
 class MockThink(object):
-    def __init__(self, initial_data):
+    def __init__(self, initial_data, rewrite_cache_size=DEFAULT_REWRITE_CACHE_SIZE,
+                 workers=None, parallel_min_rows=parallel.DEFAULT_MIN_ROWS,
+                 collect_stats=False, stats_file=None):
+        #   Queries run against whatever `self.data` was when they started, with no locking,
+        #   since `MockDb`s are never modified.  Writes are committed under `self.lock`.
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.fixed_now_time = None
+        self.query_stats = None
+        if collect_stats or stats_file is not None:
+            self.query_stats = querystats.QueryStats()
+        if stats_file is not None:
+            atexit.register(self.query_stats.dump, stats_file)
         self._modify_initial_data(initial_data)
         self.tzinfo = rethinkdb.make_timezone('00:00')
+        self.rewrite_cache = RewriteCache(rewrite_cache_size)
+        self.pool = None
+        if workers is not None and workers > 1:
+            self.pool = parallel.WorkerPool(workers, min_rows=parallel_min_rows)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Make a `MockThink` with the data in a file written by `dump`.
+
+        The file is memory-mapped, and each table's rows are only decoded once it's used.
+        """
+        mock = cls({'dbs': {}}, **kwargs)
+        mock.initial_data = None
+        mock.initial_db = objects_from_pods(storage.load(path))
+        mock.reset()
+        return mock
+
+    def dump(self, path):
+        """Write the current data to a file, for `from_file`."""
+        storage.dump(self.data, path)
+
+    def load_ndjson(self, db_name, table_name, fileobj, conflict='error'):
+        """Insert the rows from a newline-delimited JSON file into a table.
+
+        The db and table are created if they don't exist.  Rows are read one line at a time
+        and go straight into the table, and rows without an `id` get a generated one, as with `insert`.
+        Returns the number of rows `inserted` and `replaced`, and the number of `errors`.
+        """
+        with self.lock:
+            data = self.data
+            if db_name not in data.dbs_by_name:
+                data = data.create_db(db_name)
+            if table_name not in data.get_db(db_name).tables_by_name:
+                data = data.create_table_in_db(db_name, table_name)
+            table = data.get_db(db_name).get_table(table_name)
+            table, report = table.insert(
+                (with_id(row) for row in storage.iter_ndjson(fileobj)), conflict, changes=False
+            )
+            self.restore(data.replace_table_in_db(db_name, table_name, table))
+        return {key: report[key] for key in ('inserted', 'replaced', 'errors')}
+
+    def export_ndjson(self, db_name, table_name, fileobj):
+        """Write the rows of a table to a file as newline-delimited JSON, one at a time."""
+        storage.write_ndjson(self.data.get_db(db_name).get_table(table_name), fileobj)
 
     def _modify_initial_data(self, new_data):
-        self.initial_data = new_data
+        #   `MockDb`s are never modified in place, so the one built from the initial data
+        #   is kept around, and `reset` just goes back to it.  Test fixtures tend to load
+        #   the same data over and over, in which case it isn't even rebuilt.
+        if getattr(self, 'initial_data', None) != new_data:
+            self.initial_data = util.deep_clone(new_data)
+            self.initial_db = objects_from_pods(self.initial_data)
         self.reset()
 
-    def run_query(self, query):
-        temp_now_time = False
-
+    @contextlib.contextmanager
+    def query_now_time(self, now_time):
         # RethinkDB only evaluates `r.now()` once per query,
         # so it should have the same result each time within that query.
         # But we don't do anything if now_time has already been set.
+        # It's kept per thread, since other threads may be running queries of their own.
+        if getattr(self.local, 'now_time', None) is not None:
+            yield
+            return
+        self.local.now_time = now_time
+        try:
+            yield
+        finally:
+            self.local.now_time = None
 
-        if not hasattr(self, 'now_time'):
-            temp_now_time = True
-            self.now_time = self.get_now_time()
+    @contextlib.contextmanager
+    def measuring_query(self, stats_entry):
+        if stats_entry is None:
+            yield
+            return
+        with self.query_stats.measuring(stats_entry):
+            yield
+
+    def run_query(self, query, max_batch_rows=None, max_batch_bytes=None, profile=False, fingerprint=None):
+        """Run a rewritten query.  `fingerprint` is the ReQL query's `rql_rewrite.fingerprint_query`
+        fingerprint, which stats are grouped by; queries without one are grouped by their root term.
+        """
+        if self.query_stats is None:
+            return self._run_query(query, max_batch_rows, max_batch_bytes, profile, None)
+        if fingerprint is None:
+            key = description = '%s(...)' % query.__class__.__name__
+        else:
+            key, description = fingerprint, querystats.describe(fingerprint)
+        entry = self.query_stats.query_entry(key, description)
+        with self.query_stats.measuring(entry):
+            result = self._run_query(query, max_batch_rows, max_batch_bytes, profile, entry)
+        value = result['value'] if profile else result
+        returned = 0 if isinstance(value, MockThinkCursor) else profiler.cardinality(value)
+        self.query_stats.add_to_entry(entry, count=1, rows_returned=returned)
+        return result
 
-        query.mockdb_ref = self.data
-        result = query.run(self.data, Scope({}))
-        changes = None
-        if isinstance(result, tuple) and isinstance(result[0], MockDb):
-            changes = result[1]
-            result = result[0]
-        if isinstance(result, MockDb):
-            self.data = result
-            result = changes
-        elif isinstance(result, MockTableData):
-            result = result.get_rows()
-
-        if temp_now_time:
-            delattr(self, 'now_time')
+    def _run_query(self, query, max_batch_rows, max_batch_bytes, profile, stats_entry):
+        now_time = self.get_now_time()
+        with self.query_now_time(now_time):
+            snapshot = self.data
+            result, new_data, term_stats = self.evaluate(query, snapshot, profile)
+            if new_data is not None and not self.commit(snapshot, new_data):
+                #   Another write was committed since `snapshot` was taken.  Run this one again
+                #   on top of it, holding the lock so that nothing else commits in the meantime.
+                with self.lock:
+                    result, new_data, term_stats = self.evaluate(query, self.data, profile)
+                    if new_data is not None:
+                        self.restore(new_data)
+        if isinstance(result, MockTableData) or util.is_stream(result):
+            result = MockThinkCursor(
+                self, result, now_time,
+                max_batch_rows=max_batch_rows, max_batch_bytes=max_batch_bytes, stats_entry=stats_entry
+            )
+        else:
+            #   Rows are shared with the stored data (and older snapshots of it), so callers get copies.
+            result = util.deep_clone(result)
+        if profile:
+            #   The way the driver returns results for `profile=True`.
+            return {'value': result, 'profile': [term_stats.as_task()]}
         return result
 
+    def evaluate(self, query, data, profile=False):
+        """Run a rewritten query against a snapshot of the data, without committing anything.
+
+        Returns `(result, new_data, term_stats)`, where `new_data` is the `MockDb` the query
+        wrote, if any.  With `profile`, every term is timed (see `profiler`), `term_stats` holds
+        the timings, and streams are read to the end so that the timings cover all of them.
+        """
+        query, _ = optimize.optimize(query, data, pool=self.pool)
+        term_stats = None
+        if profile:
+            query, term_stats = profiler.profiled_copy(query)
+        ast_base.bind_mock_ref(query, data)
+        result = query.compile()(data, Scope({}))
+        new_data = None
+        if isinstance(result, tuple) and isinstance(result[0], MockDb):
+            new_data, result = result
+        elif isinstance(result, MockDb):
+            new_data, result = result, None
+        if profile and (isinstance(result, MockTableData) or util.is_stream(result)):
+            result = util.Stream(list(result))
+        return result, new_data, term_stats
+
+    def commit(self, snapshot, new_data):
+        """Make `new_data`, written on top of `snapshot`, the current data, unless another
+        write has been committed since `snapshot` was taken.  Returns whether it was.
+        """
+        with self.lock:
+            if self.data is not snapshot:
+                return False
+            self.restore(new_data)
+            return True
+
     def pprint_query_ast(self, query):
         query = "%s" % query
         print(query)
 
+    def explain(self, rql_query, analyze=False):
+        """Describe how a query would be run against the current data.
+
+        Returns a dict with the optimized `mt_ast` tree, rendered by `plans.describe`, under `query`, a list of the
+        optimizer rewrites which fired under `rewrites`, its plan (see `plans`) under
+        `plan`, and the strategies in the plan under `strategies`.
+
+        With `analyze`, the query is also run to fill in the plan's actual row counts.
+        Anything it writes is thrown away.
+        """
+        data = self.data
+        query, notes = optimize.optimize(rewrite_query(rql_query), data, pool=self.pool)
+        stats_by_id = None
+        if analyze:
+            query, stats = profiler.profiled_copy(query)
+            with self.query_now_time(self.get_now_time()):
+                ast_base.bind_mock_ref(query, data)
+                util.materialize(query.compile()(data, Scope({})))
+            stats_by_id = plans.stats_by_id(stats)
+        plan = plans.plan(query, data, stats_by_id)
+        return {
+            'query': plans.describe(query),
+            'rewrites': notes,
+            'plan': plan,
+            'strategies': plans.strategies(plan)
+        }
+
+    def stats(self):
+        """Return what's been collected about the queries run, if this was made with `collect_stats`.
+
+        See `querystats.QueryStats.report`.
+        """
+        if self.query_stats is None:
+            return None
+        return self.query_stats.report()
+
+    def reset_stats(self):
+        if self.query_stats is not None:
+            self.query_stats.clear()
+
+    def close(self):
+        """Shut down the worker processes, if this was made with `workers`."""
+        if self.pool is not None:
+            self.pool.close()
+
     def reset(self):
-        self.data = objects_from_pods(self.initial_data)
-        self.data.mockthink = self
+        self.restore(self.initial_db)
+
+    def snapshot(self):
+        """Return the current state of the data, for `restore`.
+
+        This doesn't copy anything: writes never modify a `MockDb`, they make a new one.
+        """
+        return self.data
+
+    def restore(self, snapshot):
+        assert(isinstance(snapshot, MockDb))
+        with self.lock:
+            snapshot.mockthink = self
+            snapshot.query_stats = self.query_stats
+            self.data = snapshot
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        """Roll back any changes made inside the `with` block when it exits.  These can be nested."""
+        snapshot = self.snapshot()
+        try:
+            yield snapshot
+        finally:
+            self.restore(snapshot)
 
     def get_conn(self):
         conn = MockThinkConn(self)
         return conn
 
     def set_now_time(self, dtime):
-        self.now_time = dtime
+        self.fixed_now_time = dtime
 
     def get_now_time(self):
-        if hasattr(self, 'now_time'):
-            return self.now_time
-        else:
-            return rtime.now()
+        now_time = getattr(self.local, 'now_time', None)
+        if now_time is not None:
+            return now_time
+        if self.fixed_now_time is not None:
+            return self.fixed_now_time
+        return rtime.now()
 
     @contextlib.contextmanager
     def connect(self):
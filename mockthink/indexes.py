@@ -0,0 +1,173 @@
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+
+from future.utils import iteritems
+from rethinkdb import RqlRuntimeError
+
+from . import util
+from .ast_base import RFunc
+from .persistent import OrderedPMap, PHashMap, PSortedList
+from .scope import Scope
+
+#   Materialized secondary indexes.
+#
+#   A materialized index is a `PHashMap` from index key (see `util.index_key`) to
+#   a `(value, ids)` pair, where `value` is the original index value and `ids` is an
+#   `OrderedPMap` whose keys are the primary keys of the rows stored under that value.
+#   Like table rows, index maps are persistent, so writes update them incrementally
+#   without disturbing the index maps of older table snapshots.
+#
+#   Ordered indexes, used for range queries, are `PSortedList`s of
+#   `(sort key of value, sort key of primary key, primary key)` entries,
+#   where sort keys follow RethinkDB's ordering (see `util.rql_sort_key`).
+#   The primary key has an ordered index too, under the name `PRIMARY_INDEX`.
+
+PRIMARY_INDEX = 'id'
+
+#   Sorts after the sort key of any primary key, so `(key, AFTER_ALL_IDS)` comes
+#   after every entry for `key` in an ordered index.
+AFTER_ALL_IDS = (11,)
+
+
+class FieldIndexFunc(object):
+    """The function of an index created on a field, i.e. `index_create('field')`."""
+    def __init__(self, field):
+        self.field = field
+
+    def __call__(self, row):
+        return util.getter(self.field, row)
+
+def run_index_func(func, row):
+    if isinstance(func, RFunc):
+        return func.run([row], Scope({}))
+    return func(row)
+
+def index_entries(index_spec, row):
+    """Return the (key, value) pairs a row is stored under in an index.
+
+    As in RethinkDB, rows for which the index function fails or returns null are left out.
+    """
+    try:
+        val = run_index_func(index_spec['func'], row)
+    except (RqlRuntimeError, KeyError, IndexError, TypeError, AttributeError):
+        return []
+    if val is None:
+        return []
+    if index_spec.get('multi', False) and isinstance(val, (list, tuple)):
+        vals = val
+    else:
+        vals = [val]
+    out = OrderedDict()
+    for one_val in vals:
+        if one_val is not None:
+            out[util.index_key(one_val)] = one_val
+    return list(out.items())
+
+def build_index_map(index_spec, rows_by_id):
+    ids_by_key = OrderedDict()
+    vals_by_key = {}
+    for id_key, row in rows_by_id.iteritems():
+        for key, val in index_entries(index_spec, row):
+            vals_by_key[key] = val
+            ids_by_key.setdefault(key, []).append((id_key, True))
+    return PHashMap.from_items(
+        (key, (vals_by_key[key], OrderedPMap.from_items(ids)))
+        for key, ids in iteritems(ids_by_key)
+    )
+
+def update_index_map(index_map, index_spec, changes):
+    """Apply row changes to an index map.
+
+    `changes` is a list of (id_key, old_row, new_row) tuples, where `old_row` is None
+    for inserted rows and `new_row` is None for deleted ones.
+    """
+    added = OrderedDict()
+    removed = OrderedDict()
+    for id_key, old_row, new_row in changes:
+        old_entries = OrderedDict(index_entries(index_spec, old_row) if old_row is not None else [])
+        new_entries = OrderedDict(index_entries(index_spec, new_row) if new_row is not None else [])
+        for key in old_entries:
+            if key not in new_entries:
+                removed.setdefault(key, []).append(id_key)
+        for key, val in iteritems(new_entries):
+            if key not in old_entries:
+                added.setdefault(key, (val, []))[1].append((id_key, True))
+
+    updated = []
+    dropped_keys = []
+    for key in util.cat(list(removed.keys()), [k for k in added if k not in removed]):
+        existing = index_map.get(key)
+        if existing is None:
+            val, ids = added[key][0], OrderedPMap()
+        else:
+            val, ids = existing
+        ids = ids.update(added.get(key, (None, []))[1], removed=removed.get(key, []))
+        if len(ids):
+            updated.append((key, (val, ids)))
+        elif existing is not None:
+            dropped_keys.append(key)
+    return index_map.update(updated, removed=dropped_keys)
+
+def id_keys_for_values(index_map, values):
+    seen = set([])
+    for val in values:
+        entry = index_map.get(util.index_key(val))
+        if entry is None:
+            continue
+        for id_key, _ in entry[1].iteritems():
+            if id_key not in seen:
+                seen.add(id_key)
+                yield id_key
+
+def index_values(index_map):
+    return [val for _, (val, _) in index_map.iteritems()]
+
+def ordered_entries(index_spec, id_key, row):
+    id_sort_key = util.rql_sort_key(id_key)
+    if index_spec is None:
+        return [(id_sort_key, id_sort_key, id_key)]
+    return [(util.rql_sort_key(val), id_sort_key, id_key) for _, val in index_entries(index_spec, row)]
+
+def build_primary_ordered_index(rows_by_id):
+    return PSortedList.from_iterable(
+        ordered_entries(None, id_key, None)[0] for id_key, _ in rows_by_id.iteritems()
+    )
+
+def build_ordered_index(index_map):
+    entries = []
+    for _, (val, ids) in index_map.iteritems():
+        sort_key = util.rql_sort_key(val)
+        for id_key, _ in ids.iteritems():
+            entries.append((sort_key, util.rql_sort_key(id_key), id_key))
+    return PSortedList.from_iterable(entries)
+
+def update_ordered_index(ordered_index, index_spec, changes):
+    """Apply row changes (as for `update_index_map`) to an ordered index.
+
+    `index_spec` is None for the primary index.
+    """
+    added = []
+    removed = []
+    for id_key, old_row, new_row in changes:
+        if index_spec is None:
+            if (old_row is None) == (new_row is None):
+                continue
+            old_entries = ordered_entries(None, id_key, None) if old_row is not None else []
+            new_entries = ordered_entries(None, id_key, None) if new_row is not None else []
+        else:
+            old_entries = ordered_entries(index_spec, id_key, old_row) if old_row is not None else []
+            new_entries = ordered_entries(index_spec, id_key, new_row) if new_row is not None else []
+        removed.extend(entry for entry in old_entries if entry not in new_entries)
+        added.extend(entry for entry in new_entries if entry not in old_entries)
+    if not (added or removed):
+        return ordered_index
+    return ordered_index.update(added, removed)
+
+def range_probes(lower, upper, left_bound='closed', right_bound='open'):
+    """Return (start, stop) probes for `PSortedList.irange` for a range of index values."""
+    lower_key = util.rql_sort_key(lower)
+    upper_key = util.rql_sort_key(upper)
+    start = (lower_key,) if left_bound == 'closed' else (lower_key, AFTER_ALL_IDS)
+    stop = (upper_key, AFTER_ALL_IDS) if right_bound == 'closed' else (upper_key,)
+    return start, stop
@@ -4,14 +4,13 @@ from . import util
 def do_outer_join(pred, left, right):
     out = []
     for left_elem in left:
-        matches = []
-        result = {'left': left_elem}
+        matched = False
         for right_elem in right:
             if pred(left_elem, right_elem):
-                matches.append(util.extend(result, {'right': right_elem}))
-        if not matches:
-            matches.append(result)
-        out = util.cat(out, matches)
+                matched = True
+                out.append({'left': left_elem, 'right': right_elem})
+        if not matched:
+            out.append({'left': left_elem})
     return out
 
 def do_inner_join(pred, left, right):
@@ -22,11 +21,41 @@ def do_inner_join(pred, left, right):
                 out.append({'left': left_elem, 'right': right_elem})
     return out
 
-def do_eq_join(left_field, left, right_field, right):
-    out = []
+def hash_by_field(field, sequence):
+    """Map the index key of each element's `field` to the elements with that value."""
+    out = {}
+    for elem in sequence:
+        val = util.getter(field, elem)
+        if val is not None:
+            out.setdefault(util.index_key(val), []).append(elem)
+    return out
+
+def iter_eq_join(left_field, left, lookup):
+    """Join each element of `left` with what `lookup` returns for its `left_field`."""
     for elem in left:
-        lval = util.getter(left_field)(elem)
-        match = util.find_first(lambda d: util.getter(right_field)(d) == lval, right)
-        if match:
-            out.append({'left': elem, 'right': match})
+        lval = util.getter(left_field, elem)
+        if lval is None:
+            continue
+        for match in lookup(lval):
+            yield {'left': elem, 'right': match}
+
+def hash_by_key(key_func, sequence):
+    out = {}
+    for elem in sequence:
+        out.setdefault(util.index_key(key_func(elem)), []).append(elem)
     return out
+
+def iter_hash_join(left_key, left, right_key, right, pred=None, outer=False):
+    """Inner (or outer) join of the elements whose keys are equal, and which pass `pred` if given.
+
+    Pairs come out in the same order as from `do_inner_join` and `do_outer_join`.
+    """
+    by_key = hash_by_key(right_key, right)
+    for left_elem in left:
+        matched = False
+        for right_elem in by_key.get(util.index_key(left_key(left_elem)), []):
+            if pred is None or pred(left_elem, right_elem):
+                matched = True
+                yield {'left': left_elem, 'right': right_elem}
+        if outer and not matched:
+            yield {'left': left_elem}
@@ -0,0 +1,378 @@
+from __future__ import absolute_import, division, print_function
+
+import copy
+
+from future.utils import iteritems
+from past.builtins import basestring
+
+from . import ast as mt_ast
+from . import indexes
+from .ast_base import CHILD_ATTRS, RBase, RDatum, RFunc, MakeArray, MakeObj
+
+#   Query optimization.
+#   `optimize` runs over a rewritten `mt_ast` tree before it's compiled, with the current
+#   `MockDb` at hand, and replaces terms with cheaper equivalents where the data allows it.
+#   Rewritten trees may be cached and reused (see `rql_rewrite.RewriteCache`), so terms are
+#   never modified in place: any term with a replaced child is shallow-copied instead.
+#
+#   Each rewrite that fires is recorded as a dict in the returned notes; `MockThink.explain`
+#   hands those back to the caller.
+
+def optimize(query, db_data, pool=None):
+    """Return `(optimized_query, notes)` for a rewritten query.
+
+    `pool` is the `parallel.WorkerPool` of the `MockThink`, if it has one.
+    """
+    notes = []
+    query = visit(query, db_data, notes)
+    if pool is not None:
+        query = shard(query, pool, notes)
+    return query, notes
+
+def visit(node, db_data, notes):
+    node = with_children_visited(node, lambda child: visit(child, db_data, notes))
+    if isinstance(node, (mt_ast.FilterWithObj, mt_ast.FilterWithFunc)):
+        node = push_down_filter(node, db_data, notes)
+    elif isinstance(node, (mt_ast.Limit, mt_ast.Slice)):
+        node = top_k_of_order_by(node, notes)
+    elif type(node) in HASH_JOIN_TERMS:
+        node = hash_join_of_equi_join(node, notes)
+    elif type(node) in GROUPED_AGGREGATIONS:
+        node = grouped_aggregation(node, notes)
+    return node
+
+def with_children_visited(node, visit_child):
+    changed = {}
+    for attr in CHILD_ATTRS:
+        child = getattr(node, attr, None)
+        if isinstance(child, RBase):
+            new_child = visit_child(child)
+            if new_child is not child:
+                changed[attr] = new_child
+    vals = getattr(node, 'vals', None)
+    if isinstance(vals, dict):
+        new_vals = {k: visit_child(v) if isinstance(v, RBase) else v for k, v in iteritems(vals)}
+        if any(new_vals[k] is not vals[k] for k in vals):
+            changed['vals'] = new_vals
+    elif isinstance(vals, list):
+        new_vals = [visit_child(v) if isinstance(v, RBase) else v for v in vals]
+        if any(new is not old for new, old in zip(new_vals, vals)):
+            changed['vals'] = new_vals
+    if not changed:
+        return node
+    node = copy.copy(node)
+    for attr, child in iteritems(changed):
+        setattr(node, attr, child)
+    return node
+
+
+#   Filter pushdown.
+#   `table.filter({'email': x})` and `table.filter(lambda d: d['owner'] == y)` scan every row.
+#   When one of the conditions a filter's predicate is ANDed from compares a field covered by
+#   the primary key or a (non-multi) secondary index with a value that doesn't depend on the row,
+#   the filter is run over a `GetAll` or `Between` on that index instead of the whole table.
+#   The full predicate is still applied to the rows the index turns up, so this only changes
+#   which rows get looked at.
+
+#   Terms a looked-up value may be built from.  These are evaluated once per query
+#   rather than once per row, so they have to be free of side effects.
+VALUE_TERMS = (RDatum, MakeArray, MakeObj, mt_ast.RVar, mt_ast.Bracket)
+
+#   For `field <op> value`: the bounds of the range of the index that can match.
+RANGE_BOUNDS = {
+    mt_ast.Gt: ('lower', 'open'),
+    mt_ast.Gte: ('lower', 'closed'),
+    mt_ast.Lt: ('upper', 'open'),
+    mt_ast.Lte: ('upper', 'closed')
+}
+
+#   For `value <op> field`.
+FLIPPED_OPS = {
+    mt_ast.Eq: mt_ast.Eq,
+    mt_ast.Gt: mt_ast.Lt,
+    mt_ast.Gte: mt_ast.Lte,
+    mt_ast.Lt: mt_ast.Gt,
+    mt_ast.Lte: mt_ast.Gte
+}
+
+def row_field(node, param):
+    """If `node` is `param[field]`, return `field`."""
+    if isinstance(node, mt_ast.Bracket) and isinstance(node.left, mt_ast.RVar) \
+            and isinstance(node.left.left, RDatum) and node.left.left.val == param \
+            and isinstance(node.right, RDatum) and isinstance(node.right.val, basestring):
+        return node.right.val
+    return None
+
+def field_of_index_func(func):
+    if isinstance(func, indexes.FieldIndexFunc):
+        return func.field
+    elif isinstance(func, RFunc) and len(func.param_names) == 1:
+        return row_field(func.body, func.param_names[0])
+    return None
+
+def is_row_independent(node, param):
+    to_visit = [node]
+    while to_visit:
+        term = to_visit.pop()
+        if not isinstance(term, VALUE_TERMS):
+            return False
+        if isinstance(term, mt_ast.RVar) and not (isinstance(term.left, RDatum) and term.left.val != param):
+            return False
+        to_visit.extend(term.children())
+    return True
+
+def conjuncts(node):
+    if isinstance(node, mt_ast.And):
+        return conjuncts(node.left) + conjuncts(node.right)
+    return [node]
+
+def comparisons_of_func(func):
+    """Return (field, op class, value term) for each `row[field] <op> value` ANDed in a predicate."""
+    if len(func.param_names) != 1:
+        return []
+    param = func.param_names[0]
+    out = []
+    for cond in conjuncts(func.body):
+        op = type(cond)
+        if op not in FLIPPED_OPS:
+            continue
+        field = row_field(cond.left, param)
+        if field is not None and is_row_independent(cond.right, param):
+            out.append((field, op, cond.right))
+            continue
+        field = row_field(cond.right, param)
+        if field is not None and is_row_independent(cond.left, param):
+            out.append((field, FLIPPED_OPS[op], cond.left))
+    return out
+
+def comparisons_of_obj(obj):
+    if not isinstance(obj, MakeObj):
+        return []
+    return [
+        (field, mt_ast.Eq, val) for field, val in sorted(iteritems(obj.vals))
+        if is_row_independent(val, None)
+    ]
+
+def indexes_by_field(table):
+    out = {indexes.PRIMARY_INDEX: indexes.PRIMARY_INDEX}
+    for index_name, spec in sorted(iteritems(table.indexes)):
+        field = field_of_index_func(spec.get('func'))
+        if field is not None and not spec.get('multi', False):
+            out.setdefault(field, index_name)
+    return out
+
+def find_table(node, db_data):
+    if not isinstance(node, mt_ast.RTable):
+        return None
+    try:
+        db_name = node.find_db_scope()
+        table_name = node.find_table_scope()
+        return db_data.get_db(db_name).get_table(table_name)
+    except (KeyError, TypeError):
+        return None
+
+def choose_lookup(comparisons, index_for_field):
+    """Pick an equality on an index if there is one, else the tightest range on one index."""
+    eqs = [(field, val) for field, op, val in comparisons if op == mt_ast.Eq and field in index_for_field]
+    if eqs:
+        eqs.sort(key=lambda pair: pair[0] != indexes.PRIMARY_INDEX)
+        field, val = eqs[0]
+        return 'get_all', index_for_field[field], {'value': val}
+
+    ranges = {}
+    for field, op, val in comparisons:
+        if op in RANGE_BOUNDS and field in index_for_field:
+            side, bound = RANGE_BOUNDS[op]
+            ranges.setdefault(field, {}).setdefault(side, (val, bound))
+    if not ranges:
+        return None
+    field = sorted(ranges, key=lambda f: (-len(ranges[f]), f != indexes.PRIMARY_INDEX, f))[0]
+    return 'between', index_for_field[field], ranges[field]
+
+def push_down_filter(node, db_data, notes):
+    table = find_table(node.left, db_data)
+    if table is None:
+        return node
+    if isinstance(node, mt_ast.FilterWithFunc):
+        if not isinstance(node.right, RFunc):
+            return node
+        comparisons = comparisons_of_func(node.right)
+    else:
+        comparisons = comparisons_of_obj(node.right)
+    lookup = choose_lookup(comparisons, indexes_by_field(table))
+    if lookup is None:
+        return node
+
+    kind, index_name, bounds = lookup
+    if kind == 'get_all':
+        probes = [bounds['value']]
+        lookup_node = mt_ast.GetAll(node.left, MakeArray(probes), optargs={'index': index_name})
+    else:
+        lower, left_bound = bounds.get('lower', (mt_ast.RMinVal(), 'closed'))
+        upper, right_bound = bounds.get('upper', (mt_ast.RMaxVal(), 'closed'))
+        probes = [val for val, _ in bounds.values()]
+        lookup_node = mt_ast.Between(node.left, lower, upper, optargs={
+            'index': index_name,
+            'left_bound': left_bound,
+            'right_bound': right_bound
+        })
+    note = {
+        'rewrite': 'filter_to_%s' % kind,
+        'table': table.name,
+        'index': index_name
+    }
+    notes.append(note)
+    narrowed = copy.copy(node)
+    narrowed.left = lookup_node
+    return mt_ast.IndexedFilter(node, narrowed, MakeArray(probes), note)
+
+
+#   Top-K.
+#   `order_by(...).limit(k)` and `order_by(...).slice(i, k)` sort the whole sequence, only to
+#   keep the first k documents.  These run as a bounded-heap top-K instead, in O(n log k).
+
+TOP_K_TERMS = {
+    mt_ast.OrderByKeys: mt_ast.OrderByKeysTopK,
+    mt_ast.OrderByFunc: mt_ast.OrderByFuncTopK
+}
+
+def top_k_of_order_by(node, notes):
+    order_by = node.left
+    if type(order_by) not in TOP_K_TERMS or 'index' in order_by.optargs:
+        return node
+    if isinstance(node, mt_ast.Limit):
+        #   Negative limits are errors, which `Limit` raises.
+        limit = node.right
+        if not (type(limit) is RDatum and isinstance(limit.val, int) and limit.val >= 0):
+            return node
+        bounds = MakeArray([RDatum(0), limit])
+    else:
+        bounds = node.right
+    notes.append({'rewrite': 'order_by_limit_to_top_k'})
+    return TOP_K_TERMS[type(order_by)](order_by.left, order_by.right, bounds, optargs=dict(node.optargs))
+
+
+#   Equi-joins.
+#   `inner_join` and `outer_join` run their predicate on every (left, right) pair.  When the
+#   predicate is `l[f] == r[g]`, maybe ANDed with other conditions, the join is run as a hash
+#   join on `f` and `g` instead, with whatever is left of the predicate only run on the pairs
+#   the hash turns up.
+
+HASH_JOIN_TERMS = {
+    mt_ast.InnerJoin: mt_ast.HashInnerJoin,
+    mt_ast.OuterJoin: mt_ast.HashOuterJoin
+}
+
+def join_fields(cond, left_param, right_param):
+    """If `cond` is `left_param[f] == right_param[g]` (either way around), return `(f, g)`."""
+    if not isinstance(cond, mt_ast.Eq):
+        return None
+    for left_side, right_side in ((cond.left, cond.right), (cond.right, cond.left)):
+        left_field = row_field(left_side, left_param)
+        right_field = row_field(right_side, right_param)
+        if left_field is not None and right_field is not None:
+            return left_field, right_field
+    return None
+
+def hash_join_of_equi_join(node, notes):
+    pred = node.right
+    if not isinstance(pred, RFunc) or len(pred.param_names) != 2:
+        return node
+    left_param, right_param = pred.param_names
+    if left_param == right_param:
+        return node
+    conds = conjuncts(pred.body)
+    for i, cond in enumerate(conds):
+        fields = join_fields(cond, left_param, right_param)
+        if fields is not None:
+            break
+    else:
+        return node
+
+    rest = conds[:i] + conds[i + 1:]
+    residual = None
+    if rest:
+        body = rest[0]
+        for cond in rest[1:]:
+            body = mt_ast.And(body, cond)
+        residual = RFunc(pred.param_names, body)
+    notes.append({'rewrite': 'equi_join_to_hash_join', 'fields': list(fields)})
+    return HASH_JOIN_TERMS[type(node)](node.left, node.middle, residual, optargs={'fields': fields})
+
+
+#   Grouped aggregations.
+#   `group(...).count()`, `group(...).sum(...)` and friends would otherwise build a list of
+#   every group's members before aggregating them.  These keep one running accumulator per
+#   group instead (see `aggregates`).
+
+GROUP_TERMS = {
+    mt_ast.GroupByField: 'field',
+    mt_ast.GroupByFunc: 'func'
+}
+
+#   Aggregation term: (accumulator, how its argument applies to each element).
+GROUPED_AGGREGATIONS = {
+    mt_ast.Count1: ('count', None),
+    mt_ast.CountByEq: ('count_if', 'eq'),
+    mt_ast.CountByFunc: ('count_if', 'func'),
+    mt_ast.Sum1: ('sum', None),
+    mt_ast.SumByField: ('sum', 'field'),
+    mt_ast.SumByFunc: ('sum', 'func'),
+    mt_ast.Avg1: ('avg', None),
+    mt_ast.AvgByField: ('avg', 'field'),
+    mt_ast.AvgByFunc: ('avg', 'func'),
+    mt_ast.Max1: ('max_value', None),
+    mt_ast.MaxByField: ('max', 'field'),
+    mt_ast.MaxByFunc: ('max', 'func'),
+    mt_ast.Min1: ('min_value', None),
+    mt_ast.MinByField: ('min', 'field'),
+    mt_ast.MinByFunc: ('min', 'func')
+}
+
+def grouped_aggregation(node, notes):
+    group = node.left
+    if type(group) not in GROUP_TERMS or group.optargs:
+        return node
+    aggregate, by = GROUPED_AGGREGATIONS[type(node)]
+    notes.append({'rewrite': 'group_to_grouped_aggregation', 'aggregate': aggregate})
+    return mt_ast.GroupedAggregation(group.left, group.right, getattr(node, 'right', None), optargs={
+        'aggregate': aggregate,
+        'group_by': GROUP_TERMS[type(group)],
+        'by': by
+    })
+
+
+#   Sharding.
+#   With a worker pool, per-row functions over a table are run on shards of the table in
+#   worker processes (see `parallel`).  The function is pickled to get it to the workers,
+#   so it can't use the database, or anything that should differ from process to process.
+
+SHARDABLE_TERMS = (mt_ast.MapWithRFunc, mt_ast.FilterWithFunc, mt_ast.ConcatMap)
+
+UNSHARDABLE_TERMS = (
+    mt_ast.RTable, mt_ast.RDb, mt_ast.Now, mt_ast.Uuid,
+    mt_ast.Random0, mt_ast.Random1, mt_ast.Random2, mt_ast.Sample
+)
+
+def is_shardable(func):
+    to_visit = [func]
+    while to_visit:
+        term = to_visit.pop()
+        if isinstance(term, UNSHARDABLE_TERMS):
+            return False
+        to_visit.extend(term.children())
+    return True
+
+def shard(node, pool, notes):
+    node = with_children_visited(node, lambda child: shard(child, pool, notes))
+    if not (isinstance(node, SHARDABLE_TERMS) and isinstance(node.right, RFunc) and is_shardable(node.right)):
+        return node
+    if isinstance(node.left, mt_ast.Sharded):
+        #   Extend the chain already being sharded.
+        node = copy.copy(node)
+        node.left = node.left.left
+        return mt_ast.Sharded(node, pool)
+    if isinstance(node.left, mt_ast.RTable):
+        notes.append({'rewrite': 'shard_over_workers', 'workers': pool.workers})
+        return mt_ast.Sharded(node, pool)
+    return node
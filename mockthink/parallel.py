@@ -0,0 +1,76 @@
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import threading
+
+from rethinkdb import RqlCompileError, RqlRuntimeError
+
+from . import ast as mt_ast
+from . import util
+from .ast_base import RBase, RDatum
+
+#   Parallel evaluation of per-row functions.
+#   With `MockThink(..., workers=N)`, `map`, `filter` and `concat_map` over a big enough table
+#   split the table's rows into contiguous shards, and run the term on each shard in a pool of
+#   worker processes.  Shard results are put back together in shard order, so the output is
+#   the same as running the term on the whole table.
+#
+#   Terms are shipped to workers by pickling them (without their `mockdb_ref`, see
+#   `RBase.__getstate__`), so only functions which don't need the database are run this way.
+
+DEFAULT_MIN_ROWS = 10000
+
+#   Shards per worker, so one slow shard doesn't hold up the whole pool.
+SHARDS_PER_WORKER = 4
+
+
+def run_shard(task):
+    term, rows, scope = task
+    term = mt_ast.with_chain_source(term, RDatum(rows))
+    try:
+        return None, util.materialize(term.compile()(None, scope))
+    except (RqlRuntimeError, RqlCompileError) as e:
+        #   These hold on to the term that raised them, which doesn't pickle,
+        #   so they're raised again from the message on the other side.
+        return type(e), e.message
+
+def reraise(error_class, message):
+    if issubclass(error_class, RqlCompileError):
+        RBase().raise_rql_compile_error(message)
+    RBase().raise_rql_runtime_error(message)
+
+def shards(rows, count):
+    size = max(1, -(-len(rows) // count))
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+class WorkerPool(object):
+    """A lazily started `multiprocessing.Pool`, shared by the queries of one `MockThink`."""
+    def __init__(self, workers, min_rows=DEFAULT_MIN_ROWS):
+        self.workers = workers
+        self.min_rows = min_rows
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def should_split(self, sequence):
+        return hasattr(sequence, 'rows_by_id') and len(sequence) >= self.min_rows
+
+    def run_sharded(self, term, rows, scope):
+        """Run a chain of terms (see `ast.with_chain_source`) on each shard of `rows`, and concatenate the results."""
+        with self.lock:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.workers)
+        tasks = [(term, shard, scope) for shard in shards(rows, self.workers * SHARDS_PER_WORKER)]
+        out = []
+        for error_class, result in self.pool.imap(run_shard, tasks):
+            if error_class is not None:
+                reraise(error_class, result)
+            out.extend(result)
+        return out
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
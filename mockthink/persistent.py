@@ -0,0 +1,397 @@
+from __future__ import absolute_import, division, print_function
+
+import bisect
+import itertools
+
+from future.utils import iteritems
+
+#   Persistent (structurally shared) collections used for table storage.
+#
+#   Every write to a `MockTableData` produces a new table, while the old one has to stay
+#   valid (it's still referenced by the previous `MockDb`, which `reset` and snapshots rely on).
+#   Copying the whole row list on each write makes a single-row insert O(n); these collections
+#   copy only the O(log n) nodes on the path to the changed elements and share everything else.
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+MIN_BUCKETS = 32
+
+CHUNK_SIZE = 512
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _iter_node(node, level):
+    if level == 0:
+        return iter(node)
+    return itertools.chain.from_iterable(_iter_node(child, level - BITS) for child in node)
+
+def _slot_of(pair):
+    return pair[0]
+
+def _assoc_many(node, level, pairs):
+    # `pairs` are (index, value) tuples sorted by index.  Each node on a path
+    # to a changed index is copied once, no matter how many changes pass through it.
+    node = list(node)
+    if level == 0:
+        for index, val in pairs:
+            slot = index & MASK
+            if slot < len(node):
+                node[slot] = val
+            else:
+                node.append(val)
+        return node
+    child_slot = lambda pair: (pair[0] >> level) & MASK
+    for slot, group in itertools.groupby(pairs, key=child_slot):
+        group = list(group)
+        if slot < len(node):
+            node[slot] = _assoc_many(node[slot], level - BITS, group)
+        else:
+            node.append(_assoc_many([], level - BITS, group))
+    return node
+
+
+class PVector(object):
+    """A persistent vector: a 32-way trie of python lists.
+
+    `set_many` returns a new vector and leaves this one untouched.
+    """
+    def __init__(self, root=None, count=0, shift=BITS):
+        self._root = root if root is not None else []
+        self._count = count
+        self._shift = shift
+
+    @classmethod
+    def from_iterable(cls, items):
+        nodes = _chunks(list(items), WIDTH)
+        count = sum(len(leaf) for leaf in nodes)
+        shift = BITS
+        nodes = _chunks(nodes, WIDTH)
+        while len(nodes) > 1:
+            nodes = _chunks(nodes, WIDTH)
+            shift += BITS
+        root = nodes[0] if nodes else []
+        return cls(root, count, shift)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return _iter_node(self._root, self._shift)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not (0 <= index < self._count):
+            raise IndexError('PVector index out of range')
+        node = self._root
+        level = self._shift
+        while level > 0:
+            node = node[(index >> level) & MASK]
+            level -= BITS
+        return node[index & MASK]
+
+    def set_many(self, updates):
+        """Return a new vector with `updates` (a dict of index -> value) applied.
+
+        Indices past the end append, so they must continue on from `len(self)` without gaps.
+        """
+        if not updates:
+            return self
+        pairs = sorted(iteritems(updates), key=_slot_of)
+        new_count = max(self._count, pairs[-1][0] + 1)
+        assert(new_count - self._count <= len(pairs))
+        root, shift = self._root, self._shift
+        while new_count > (1 << (shift + BITS)):
+            root = [root]
+            shift += BITS
+        return PVector(_assoc_many(root, shift, pairs), new_count, shift)
+
+    def set(self, index, val):
+        return self.set_many({index: val})
+
+    def append(self, val):
+        return self.set_many({self._count: val})
+
+
+class PHashMap(object):
+    """A persistent hash map: a `PVector` of buckets, each one a tuple of (key, value) pairs."""
+    def __init__(self, buckets=None, count=0):
+        if buckets is None:
+            buckets = PVector.from_iterable([()] * MIN_BUCKETS)
+        self._buckets = buckets
+        self._count = count
+
+    @classmethod
+    def from_items(cls, items):
+        as_dict = dict(items)
+        num_buckets = MIN_BUCKETS
+        while num_buckets < len(as_dict):
+            num_buckets *= 2
+        buckets = [[] for _ in range(num_buckets)]
+        for k, v in iteritems(as_dict):
+            buckets[hash(k) % num_buckets].append((k, v))
+        return cls(PVector.from_iterable(tuple(b) for b in buckets), len(as_dict))
+
+    def _bucket_index(self, key):
+        return hash(key) % len(self._buckets)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        for k, _ in self._buckets[self._bucket_index(key)]:
+            if k == key:
+                return True
+        return False
+
+    def get(self, key, default=None):
+        if not self._count:
+            return default
+        for k, v in self._buckets[self._bucket_index(key)]:
+            if k == key:
+                return v
+        return default
+
+    def iteritems(self):
+        for bucket in self._buckets:
+            for pair in bucket:
+                yield pair
+
+    def update(self, items=(), removed=()):
+        """Return a new map with `items` set and the keys in `removed` deleted."""
+        changed = {}
+        count = self._count
+
+        def pairs_of(bucket_index):
+            if bucket_index not in changed:
+                changed[bucket_index] = list(self._buckets[bucket_index])
+            return changed[bucket_index]
+
+        for key in removed:
+            pairs = pairs_of(self._bucket_index(key))
+            for position, (k, _) in enumerate(pairs):
+                if k == key:
+                    del pairs[position]
+                    count -= 1
+                    break
+        for key, val in items:
+            pairs = pairs_of(self._bucket_index(key))
+            for position, (k, _) in enumerate(pairs):
+                if k == key:
+                    pairs[position] = (key, val)
+                    break
+            else:
+                pairs.append((key, val))
+                count += 1
+        if not changed:
+            return self
+        buckets = self._buckets.set_many({i: tuple(pairs) for i, pairs in iteritems(changed)})
+        result = PHashMap(buckets, count)
+        if count > 2 * len(buckets):
+            result = PHashMap.from_items(result.iteritems())
+        return result
+
+
+class OrderedPMap(object):
+    """A persistent map which iterates in insertion order.
+
+    Values live in a `PVector` of (key, value) slots; a `PHashMap` maps each key to its slot.
+    Updating an existing key keeps its position, removing a key leaves an empty slot behind,
+    and the slots are compacted once more than half of them are empty.
+    """
+    def __init__(self, slots=None, slot_by_key=None, removed_count=0):
+        self._slots = slots if slots is not None else PVector()
+        self._slot_by_key = slot_by_key if slot_by_key is not None else PHashMap()
+        self._removed_count = removed_count
+
+    @classmethod
+    def from_items(cls, items):
+        slots = []
+        slot_by_key = {}
+        for key, val in items:
+            if key in slot_by_key:
+                slots[slot_by_key[key]] = (key, val)
+            else:
+                slot_by_key[key] = len(slots)
+                slots.append((key, val))
+        return cls(PVector.from_iterable(slots), PHashMap.from_items(iteritems(slot_by_key)))
+
+    def __len__(self):
+        return len(self._slots) - self._removed_count
+
+    def __contains__(self, key):
+        return key in self._slot_by_key
+
+    def get(self, key, default=None):
+        slot = self._slot_by_key.get(key)
+        if slot is None:
+            return default
+        return self._slots[slot][1]
+
+    def iteritems(self):
+        for pair in self._slots:
+            if pair is not None:
+                yield pair
+
+    def itervalues(self):
+        for pair in self._slots:
+            if pair is not None:
+                yield pair[1]
+
+    def nth_value(self, n):
+        if not self._removed_count:
+            return self._slots[n][1]
+        if n < 0:
+            n += len(self)
+        if n < 0:
+            raise IndexError('OrderedPMap index out of range')
+        for val in itertools.islice(self.itervalues(), n, None):
+            return val
+        raise IndexError('OrderedPMap index out of range')
+
+    def update(self, items=(), removed=()):
+        """Return a new map with the keys in `removed` deleted, then `items` (key, value pairs) set."""
+        if not len(self._slots):
+            return OrderedPMap.from_items(items)
+        slot_changes = {}
+        new_slots = {}
+        next_slot = len(self._slots)
+        removed_count = self._removed_count
+        dropped_keys = set([])
+        for key in removed:
+            slot = self._slot_by_key.get(key)
+            if slot is not None and slot not in slot_changes:
+                slot_changes[slot] = None
+                dropped_keys.add(key)
+                removed_count += 1
+        for key, val in items:
+            slot = new_slots.get(key)
+            if slot is None and key not in dropped_keys:
+                slot = self._slot_by_key.get(key)
+            if slot is None:
+                slot = next_slot
+                next_slot += 1
+                new_slots[key] = slot
+            slot_changes[slot] = (key, val)
+        if not slot_changes:
+            return self
+        result = OrderedPMap(
+            self._slots.set_many(slot_changes),
+            self._slot_by_key.update(iteritems(new_slots), removed=dropped_keys),
+            removed_count
+        )
+        if result._removed_count > max(WIDTH, len(result)):
+            result = OrderedPMap.from_items(result.iteritems())
+        return result
+
+
+class PSortedList(object):
+    """A persistent sorted list, stored as a list of sorted chunks.
+
+    Updates copy the outer list of chunks (about n / CHUNK_SIZE pointers) plus the
+    chunks they touch, and share the rest with the list they were made from.
+    """
+    def __init__(self, chunks=None, maxes=None, count=0):
+        self._chunks = chunks if chunks is not None else []
+        self._maxes = maxes if maxes is not None else []
+        self._count = count
+
+    @classmethod
+    def from_iterable(cls, items):
+        items = sorted(items)
+        chunks = _chunks(items, CHUNK_SIZE)
+        return cls(chunks, [chunk[-1] for chunk in chunks], len(items))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def _position(self, val):
+        # (chunk index, offset) of the first item >= val
+        if val is None:
+            return (len(self._chunks), 0)
+        chunk_index = bisect.bisect_left(self._maxes, val)
+        if chunk_index == len(self._chunks):
+            return (chunk_index, 0)
+        return (chunk_index, bisect.bisect_left(self._chunks[chunk_index], val))
+
+    def irange(self, start=None, stop=None, reverse=False):
+        """Iterate over the items `x` with `start <= x < stop`; None leaves that end open."""
+        start_chunk, start_offset = self._position(start) if start is not None else (0, 0)
+        stop_chunk, stop_offset = self._position(stop)
+        if reverse:
+            return self._irange_reversed(start_chunk, start_offset, stop_chunk, stop_offset)
+        return self._irange(start_chunk, start_offset, stop_chunk, stop_offset)
+
+    def _irange(self, start_chunk, start_offset, stop_chunk, stop_offset):
+        for chunk_index in range(start_chunk, min(stop_chunk + 1, len(self._chunks))):
+            chunk = self._chunks[chunk_index]
+            begin = start_offset if chunk_index == start_chunk else 0
+            end = stop_offset if chunk_index == stop_chunk else len(chunk)
+            for index in range(begin, end):
+                yield chunk[index]
+
+    def _irange_reversed(self, start_chunk, start_offset, stop_chunk, stop_offset):
+        for chunk_index in range(min(stop_chunk, len(self._chunks) - 1), start_chunk - 1, -1):
+            chunk = self._chunks[chunk_index]
+            begin = start_offset if chunk_index == start_chunk else 0
+            end = stop_offset if chunk_index == stop_chunk else len(chunk)
+            for index in range(end - 1, begin - 1, -1):
+                yield chunk[index]
+
+    def update(self, added=(), removed=()):
+        """Return a new list with the items in `removed` taken out and those in `added` put in."""
+        chunks = list(self._chunks)
+        maxes = list(self._maxes)
+        count = self._count
+        owned = set([])
+
+        def own(chunk_index):
+            chunk = chunks[chunk_index]
+            if id(chunk) not in owned:
+                chunk = list(chunk)
+                chunks[chunk_index] = chunk
+                owned.add(id(chunk))
+            return chunk
+
+        for val in removed:
+            chunk_index = bisect.bisect_left(maxes, val)
+            if chunk_index == len(chunks):
+                continue
+            offset = bisect.bisect_left(chunks[chunk_index], val)
+            if offset == len(chunks[chunk_index]) or chunks[chunk_index][offset] != val:
+                continue
+            chunk = own(chunk_index)
+            del chunk[offset]
+            count -= 1
+            if chunk:
+                maxes[chunk_index] = chunk[-1]
+            else:
+                del chunks[chunk_index]
+                del maxes[chunk_index]
+
+        for val in added:
+            count += 1
+            if not chunks:
+                chunk = [val]
+                chunks.append(chunk)
+                maxes.append(val)
+                owned.add(id(chunk))
+                continue
+            chunk_index = min(bisect.bisect_left(maxes, val), len(chunks) - 1)
+            chunk = own(chunk_index)
+            bisect.insort(chunk, val)
+            maxes[chunk_index] = chunk[-1]
+            if len(chunk) > 2 * CHUNK_SIZE:
+                left, right = chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]
+                chunks[chunk_index:chunk_index + 1] = [left, right]
+                maxes[chunk_index:chunk_index + 1] = [left[-1], right[-1]]
+                owned.update([id(left), id(right)])
+
+        return PSortedList(chunks, maxes, count)
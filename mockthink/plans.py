@@ -0,0 +1,196 @@
+from __future__ import absolute_import, division, print_function
+
+from . import ast as mt_ast
+from . import indexes
+from .ast_base import MakeArray, MakeObj, RDatum, RFunc
+from .optimize import find_table
+
+#   Query plans, for `MockThink.explain`.
+#   A plan is a tree of dicts, one per term of the optimized query, each with the term's class
+#   (`term`), how it gets at its rows (`strategy`, or None for terms where that doesn't apply),
+#   an estimate of how many rows it returns (`estimated_rows`, or None if there's no telling)
+#   and its `children`.  Plans of analyzed queries also have `actual_rows`, from the profiler.
+#
+#   Estimates are rough, from table sizes and fixed selectivities in the manner of a
+#   textbook cost-based planner; they're meant for telling scans from lookups, not for tuning.
+
+EQ_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 1 / 3
+FILTER_SELECTIVITY = 1 / 3
+
+STRATEGIES = {
+    mt_ast.Get: 'primary_lookup',
+    mt_ast.IndexedFilter: 'filter_on_lookup',
+    mt_ast.FilterWithFunc: 'filter',
+    mt_ast.FilterWithObj: 'filter',
+    mt_ast.OrderByKeys: 'sort',
+    mt_ast.OrderByFunc: 'sort',
+    mt_ast.OrderByKeysTopK: 'top_k',
+    mt_ast.OrderByFuncTopK: 'top_k',
+    mt_ast.InnerJoin: 'nested_loop_join',
+    mt_ast.OuterJoin: 'nested_loop_join',
+    mt_ast.HashInnerJoin: 'hash_join',
+    mt_ast.HashOuterJoin: 'hash_join',
+    mt_ast.GroupByField: 'group',
+    mt_ast.GroupByFunc: 'group',
+    mt_ast.GroupedAggregation: 'grouped_aggregation',
+    mt_ast.Sharded: 'sharded'
+}
+
+#   Terms which take a table's rows through one of its indexes, as (primary, secondary) strategies.
+INDEXED_STRATEGIES = {
+    mt_ast.GetAll: ('primary_lookup', 'index_lookup'),
+    mt_ast.Between: ('primary_range', 'index_range'),
+    mt_ast.OrderByIndex: ('primary_order', 'index_order'),
+    mt_ast.EqJoin: ('primary_lookup_join', 'index_lookup_join')
+}
+
+#   Terms which return one value, whatever they're given.
+SINGLE_ROW_TERMS = (
+    mt_ast.Get, mt_ast.Nth, mt_ast.Count1, mt_ast.CountByEq, mt_ast.CountByFunc,
+    mt_ast.Sum1, mt_ast.SumByField, mt_ast.SumByFunc, mt_ast.Avg1, mt_ast.AvgByField, mt_ast.AvgByFunc,
+    mt_ast.Max1, mt_ast.MaxByField, mt_ast.MaxByFunc, mt_ast.Min1, mt_ast.MinByField, mt_ast.MinByFunc,
+    mt_ast.Reduce, mt_ast.IsEmpty
+)
+
+#   Terms which return about as many rows as they're given.
+ROW_PRESERVING_TERMS = (
+    mt_ast.MapWithRFunc, mt_ast.OrderByKeys, mt_ast.OrderByFunc, mt_ast.OrderByIndex,
+    mt_ast.PluckPoly, mt_ast.WithoutPoly, mt_ast.MergePoly, mt_ast.Distinct, mt_ast.Skip,
+    mt_ast.IndexedFilter, mt_ast.Sharded, mt_ast.EqJoin
+)
+
+
+def index_of(node):
+    return node.optargs.get('index', indexes.PRIMARY_INDEX)
+
+def strategy_of(node, looked_up):
+    if isinstance(node, mt_ast.RTable):
+        #   A table whose rows are got at through an index isn't scanned.
+        return None if looked_up else 'full_scan'
+    if type(node) in INDEXED_STRATEGIES:
+        primary, secondary = INDEXED_STRATEGIES[type(node)]
+        return primary if index_of(node) == indexes.PRIMARY_INDEX else secondary
+    return STRATEGIES.get(type(node))
+
+def looked_up_child(node):
+    if isinstance(node, mt_ast.EqJoin):
+        return node.right
+    if isinstance(node, (mt_ast.Get, mt_ast.GetAll, mt_ast.Between, mt_ast.OrderByIndex)):
+        return node.left
+    return None
+
+def children_of(node):
+    if isinstance(node, mt_ast.IndexedFilter):
+        #   Only the narrowed filter; the original one is a fallback for null lookups.
+        return [node.right]
+    return node.children()
+
+def int_datum(node):
+    if isinstance(node, RDatum) and isinstance(node.val, int):
+        return node.val
+    return None
+
+def scaled(rows, selectivity):
+    if rows is None:
+        return None
+    return int(round(rows * selectivity))
+
+def estimate(node, child_plans, db_data):
+    rows_of = [child['estimated_rows'] for child in child_plans]
+    rows = rows_of[0] if rows_of else None
+    if isinstance(node, mt_ast.RTable):
+        table = find_table(node, db_data)
+        return None if table is None else len(table)
+    if isinstance(node, SINGLE_ROW_TERMS):
+        return 1
+    if isinstance(node, mt_ast.GetAll):
+        keys = len(node.right.vals) if isinstance(node.right, MakeArray) else 1
+        if index_of(node) == indexes.PRIMARY_INDEX:
+            return keys if rows is None else min(keys, rows)
+        return scaled(rows, EQ_SELECTIVITY * keys)
+    if isinstance(node, mt_ast.Between):
+        return scaled(rows, RANGE_SELECTIVITY)
+    if isinstance(node, (mt_ast.FilterWithFunc, mt_ast.FilterWithObj)):
+        return scaled(rows, FILTER_SELECTIVITY)
+    if isinstance(node, mt_ast.Limit):
+        limit = int_datum(node.right)
+        if limit is None or rows is None:
+            return limit
+        return min(limit, rows)
+    if isinstance(node, (mt_ast.OrderByKeysTopK, mt_ast.OrderByFuncTopK)):
+        bounds = node.right.vals if isinstance(node.right, MakeArray) else []
+        ends = [int_datum(bound) for bound in bounds]
+        if len(ends) != 2 or None in ends or rows is None:
+            return rows
+        return max(0, min(ends[1], rows) - ends[0])
+    if isinstance(node, (mt_ast.HashInnerJoin, mt_ast.HashOuterJoin)):
+        if None in rows_of[0:2]:
+            return None
+        return max(rows_of[0:2])
+    if isinstance(node, (mt_ast.InnerJoin, mt_ast.OuterJoin)):
+        if None in rows_of[0:2]:
+            return None
+        matched = scaled(rows_of[0] * rows_of[1], FILTER_SELECTIVITY)
+        return max(rows_of[0], matched) if isinstance(node, mt_ast.OuterJoin) else matched
+    if isinstance(node, ROW_PRESERVING_TERMS):
+        return rows
+    return None
+
+def plan(node, db_data, stats_by_term=None, looked_up=False):
+    """Return the plan of an optimized query.
+
+    `stats_by_term` maps `id`s of terms to the `profiler.TermStats` of an analyzed run.
+    """
+    lookup = looked_up_child(node)
+    child_plans = [
+        plan(child, db_data, stats_by_term, looked_up=(child is lookup))
+        for child in children_of(node)
+    ]
+    out = {
+        'term': node.__class__.__name__,
+        'strategy': strategy_of(node, looked_up),
+        'estimated_rows': estimate(node, child_plans, db_data),
+        'children': child_plans
+    }
+    if isinstance(node, mt_ast.RTable):
+        out['table'] = node.find_table_scope()
+    elif type(node) in INDEXED_STRATEGIES:
+        out['index'] = index_of(node)
+    if stats_by_term is not None:
+        stats = stats_by_term.get(id(node))
+        out['actual_rows'] = None if stats is None else stats.rows_out
+    return out
+
+def describe(node):
+    """Render an optimized query as its terms' classes and arguments, e.g. `Get(RTable(...), 'joe')`."""
+    if isinstance(node, RDatum):
+        return repr(node.val)
+    if isinstance(node, RFunc):
+        return 'RFunc(%r, %s)' % (list(node.param_names), describe(node.body))
+    if isinstance(node, MakeObj):
+        parts = ['%s=%s' % (k, describe(v)) for k, v in sorted(node.vals.items())]
+    else:
+        parts = [describe(child) for child in node.children()]
+    parts.extend('%s=%r' % (k, v) for k, v in sorted(getattr(node, 'optargs', {}).items()))
+    return '%s(%s)' % (node.__class__.__name__, ', '.join(parts))
+
+def stats_by_id(stats):
+    out = {}
+    to_visit = [stats]
+    while to_visit:
+        stats = to_visit.pop()
+        out[id(stats.term)] = stats
+        to_visit.extend(stats.children)
+    return out
+
+def strategies(plan):
+    """List the strategies in a plan, root first."""
+    out = []
+    to_visit = [plan]
+    while to_visit:
+        node = to_visit.pop()
+        if node['strategy'] is not None:
+            out.append(node['strategy'])
+        to_visit.extend(reversed(node['children']))
+    return out
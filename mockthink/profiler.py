@@ -0,0 +1,105 @@
+from __future__ import absolute_import, division, print_function
+
+import copy
+from timeit import default_timer
+
+from . import util
+from .ast import Sharded
+from .ast_base import CHILD_ATTRS, RBase
+
+#   Per-term profiling, for `run(conn, profile=True)`.
+#   A profiled query runs on a copy of its term tree in which every term's `run` and `compile`
+#   are wrapped to count calls, time them, and count the rows they return.  Queries run without
+#   `profile` never touch this module.
+#
+#   The profile has the shape of RethinkDB's: a list of tasks, each with a `description`,
+#   a `duration(ms)` and its `sub_tasks`.  Each task also has the term's `calls`, `rows_out`,
+#   and `rows_in`: the rows returned by its first sub-task, which is the sequence it works on
+#   for terms that work on one.  Values other than sequences count as one row.  Times include
+#   the time spent in sub-tasks, and in pulling rows from the term's stream, if it returns one.
+
+
+class TermStats(object):
+    def __init__(self, term):
+        self.term = term
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows_out = 0
+        self.children = []
+
+    def counted(self, iterable):
+        source = util.iter_once(iterable)
+        while True:
+            start = default_timer()
+            try:
+                elem = next(source)
+            except StopIteration:
+                self.seconds += default_timer() - start
+                return
+            self.seconds += default_timer() - start
+            self.rows_out += 1
+            yield elem
+
+    def as_task(self):
+        sub_tasks = [child.as_task() for child in self.children]
+        return {
+            'description': 'Evaluating %s.' % self.term.__class__.__name__,
+            'duration(ms)': self.seconds * 1000,
+            'calls': self.calls,
+            'rows_in': self.children[0].rows_out if self.children else 0,
+            'rows_out': self.rows_out,
+            'sub_tasks': sub_tasks
+        }
+
+
+def cardinality(result):
+    if isinstance(result, (list, tuple)) or hasattr(result, 'rows_by_id'):
+        return len(result)
+    return 1
+
+def timed(stats, func):
+    def run_timed(*args):
+        start = default_timer()
+        result = func(*args)
+        stats.calls += 1
+        if util.is_stream(result) and not hasattr(result, 'rows_by_id'):
+            result = util.Stream(stats.counted(result))
+        else:
+            stats.rows_out += cardinality(result)
+        stats.seconds += default_timer() - start
+        return result
+    return run_timed
+
+def instrument(term, stats):
+    term.run = timed(stats, term.run)
+    compile_term = term.compile
+    def compile_profiled():
+        func = compile_term()
+        if func is term.run:
+            #   Terms which don't compile fall back on `run`, which is already timed.
+            return func
+        return timed(stats, func)
+    term.compile = compile_profiled
+
+def copy_child(child, parent_stats):
+    if isinstance(child, RBase):
+        child, stats = profiled_copy(child)
+        parent_stats.children.append(stats)
+    return child
+
+def profiled_copy(term):
+    """Return an instrumented copy of a term tree, and the `TermStats` of its root."""
+    term = copy.copy(term)
+    stats = TermStats(term)
+    #   Sharded chains are pickled to run in other processes, so they're timed as a whole.
+    if not isinstance(term, Sharded):
+        for attr in CHILD_ATTRS:
+            if isinstance(getattr(term, attr, None), RBase):
+                setattr(term, attr, copy_child(getattr(term, attr), stats))
+        vals = getattr(term, 'vals', None)
+        if isinstance(vals, dict):
+            term.vals = {k: copy_child(v, stats) for k, v in vals.items()}
+        elif isinstance(vals, list):
+            term.vals = [copy_child(v, stats) for v in vals]
+    instrument(term, stats)
+    return term, stats
@@ -0,0 +1,131 @@
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import copy
+import json
+import threading
+from timeit import default_timer
+
+import rethinkdb.ast as r_ast
+
+#   Query statistics, for `MockThink(..., collect_stats=True)` and `MockThink.stats`.
+#   Queries are grouped by the fingerprint the rewrite cache keys its plans on (see
+#   `rql_rewrite.fingerprint_query`): the ReQL query with its datums left out, so `get('joe')`
+#   and `get('bob')` count as the same query.  For each one, and for each table,
+#   this keeps how often it ran, how long it took, and how many rows it scanned and returned.
+#
+#   Every read of a table by `RTable` counts as a full scan of all its rows, until a term
+#   which looks rows up by key or index (`get`, `get_all`, `between`, `eq_join`) says otherwise
+#   with `record_lookup`; after that, only the rows the lookup returns count as scanned.
+
+def describe_frozen(frozen):
+    if frozen[0] is r_ast.Datum:
+        return '%s' % (frozen[1],)
+    return '%s(%s)' % (frozen[0].__name__, ', '.join(describe_frozen(arg) for arg in frozen[1]))
+
+def describe(fingerprint):
+    """Render a `rql_rewrite.fingerprint_query` fingerprint readably, e.g. `Get(Table(DB(?), ?), ?)`."""
+    if fingerprint is r_ast.Datum:
+        return '?'
+    node_type = fingerprint[0]
+    if node_type is r_ast.Func:
+        return 'Func(%s)' % describe(fingerprint[2])
+    if node_type is r_ast.Var:
+        return 'Var'
+    if node_type is r_ast.MakeObj:
+        return 'MakeObj(%s)' % ', '.join('%s=%s' % (k, describe(v)) for k, v in fingerprint[1])
+    parts = [describe(arg) for arg in fingerprint[1]]
+    parts.extend('%s=%s' % (k, describe_frozen(v)) for k, v in fingerprint[2])
+    return '%s(%s)' % (node_type.__name__, ', '.join(parts))
+
+
+class QueryStats(object):
+    """Safe to share between threads: counts are only changed under `lock`, and the query
+    being measured is kept per thread.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.queries = {}
+            self.tables = {}
+
+    def query_entry(self, key, description):
+        with self.lock:
+            entry = self.queries.get(key)
+            if entry is None:
+                entry = self.queries[key] = {
+                    'fingerprint': description,
+                    'count': 0,
+                    'seconds': 0.0,
+                    'rows_returned': 0,
+                    'rows_scanned': 0,
+                    'full_scans': 0,
+                    'lookups': 0
+                }
+            return entry
+
+    def add_to_entry(self, entry, **counts):
+        with self.lock:
+            for k, v in counts.items():
+                entry[k] += v
+
+    @contextlib.contextmanager
+    def measuring(self, entry):
+        """Charge time spent, and rows scanned, to a query's entry."""
+        outer = getattr(self.local, 'current', None)
+        if outer is entry:
+            yield
+            return
+        self.local.current = entry
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.add_to_entry(entry, seconds=default_timer() - start)
+            self.local.current = outer
+
+    def add(self, table_key, **counts):
+        current = getattr(self.local, 'current', None)
+        with self.lock:
+            table = self.tables.get(table_key)
+            if table is None:
+                table = self.tables[table_key] = {'rows_scanned': 0, 'full_scans': 0, 'lookups': 0}
+            for k, v in counts.items():
+                table[k] += v
+                if current is not None:
+                    current[k] += v
+
+    def record_read(self, table_key, table_rows):
+        self.add(table_key, full_scans=1, rows_scanned=table_rows)
+
+    def record_lookup(self, table_key, table_rows, rows=0, lookup=True):
+        """Turn the last read of a table into a lookup which returned `rows` rows,
+        or with `lookup=False`, into nothing at all (as for inserts, which don't read rows).
+        """
+        self.add(table_key, full_scans=-1, lookups=int(lookup), rows_scanned=rows - table_rows)
+
+    def record_rows(self, table_key, rows):
+        self.add(table_key, rows_scanned=rows)
+
+    def counted(self, table_key, iterable):
+        for elem in iterable:
+            self.record_rows(table_key, 1)
+            yield elem
+
+    def report(self):
+        """Return the stats as a dict: `queries`, slowest first, and `tables`."""
+        with self.lock:
+            queries = copy.deepcopy(list(self.queries.values()))
+            tables = copy.deepcopy(self.tables)
+        return {
+            'queries': sorted(queries, key=lambda q: -q['seconds']),
+            'tables': tables
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as out:
+            json.dump(self.report(), out, indent=2, sort_keys=True)
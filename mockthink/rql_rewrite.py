@@ -1,9 +1,15 @@
+import copy
+import threading
+from collections import OrderedDict
+
 import rethinkdb.ast as r_ast
+import rethinkdb.query as r_query
 from future.utils import iteritems
 from past.builtins import map
 
 from . import ast as mt_ast
-from . import util
+from . import ast_base, util
+from .ast_base import CHILD_ATTRS, RBase
 
 def rewrite_query(query):
     """Rewrite a ReQL query from `r_ast` types into corresponding `mt_ast` terms."""
@@ -129,7 +135,9 @@ def binop_splat(Mt_Constructor, node):
 #   0-ary reql terms which don't need any special handling
 NORMAL_ZEROPS = {
     r_ast.Now: mt_ast.Now,
-    r_ast.DbList: mt_ast.DbList
+    r_ast.DbList: mt_ast.DbList,
+    type(r_query.minval): mt_ast.RMinVal,
+    type(r_query.maxval): mt_ast.RMaxVal
 }
 
 
@@ -189,6 +197,9 @@ NORMAL_BINOPS = {
     r_ast.Table: mt_ast.RTable,
     r_ast.Get: mt_ast.Get,
     r_ast.Map: mt_ast.MapWithRFunc,
+    r_ast.ConcatMap: mt_ast.ConcatMap,
+    r_ast.Limit: mt_ast.Limit,
+    r_ast.Skip: mt_ast.Skip,
     r_ast.Replace: mt_ast.Replace,
     r_ast.Merge: mt_ast.MergePoly,
     r_ast.Append: mt_ast.Append,
@@ -242,7 +253,8 @@ SPLATTED_BINOPS = {
     r_ast.HasFields: mt_ast.HasFields,
     r_ast.Without: mt_ast.WithoutPoly,
     r_ast.GetAll: mt_ast.GetAll,
-    r_ast.DeleteAt: mt_ast.DeleteAt
+    r_ast.DeleteAt: mt_ast.DeleteAt,
+    r_ast.Slice: mt_ast.Slice
 }
 
 #   3-ary reql terms which don't need any special handling
@@ -372,6 +384,9 @@ def handle_func(node):
 
 @handles_type(r_ast.OrderBy)
 def handle_order_by(node):
+    index = node.optargs.get('index')
+    if index is not None:
+        return handle_order_by_index(node, index)
     optargs = process_optargs(node)
     left = type_dispatch(node.args[0])
     right = []
@@ -388,6 +403,35 @@ def handle_order_by(node):
     right = mt_ast.MakeArray(right)
     return mt_ast.OrderByKeys(left, right, optargs=optargs)
 
+def handle_order_by_index(node, index):
+    #   `index` can be `r.desc('name')` or `r.asc('name')` as well as just `'name'`.
+    direction = 'ASC'
+    if isinstance(index, (r_ast.Asc, r_ast.Desc)):
+        direction = 'DESC' if isinstance(index, r_ast.Desc) else 'ASC'
+        index = index.args[0]
+    index_name = plain_val_of_datum(index)
+    keys = []
+    for elem in node.args[1:]:
+        if isinstance(elem, r_ast.Datum):
+            keys.append(mt_ast.Asc(type_dispatch(elem)))
+        else:
+            assert(elem.__class__ in (r_ast.Desc, r_ast.Asc))
+            keys.append(type_dispatch(elem))
+
+    #   `between(...).order_by(index=...)` on the same index is just the `between`, in order.
+    sequence = node.args[0]
+    if isinstance(sequence, r_ast.Between) and not keys:
+        between = type_dispatch(sequence)
+        if between.optargs.get('index', 'id') == index_name:
+            between.optargs = util.extend(between.optargs, {'order': direction})
+            return between
+
+    optargs = util.extend(
+        {k: plain_val_of_datum(v) for k, v in iteritems(node.optargs) if k != 'index'},
+        {'index': index_name, 'direction': direction}
+    )
+    return mt_ast.OrderByIndex(type_dispatch(sequence), mt_ast.MakeArray(keys), optargs=optargs)
+
 @handles_type(r_ast.OffsetsOf)
 def handle_offsets_of(node):
     optargs = process_optargs(node)
@@ -495,3 +539,144 @@ def replace_implicit_vars(arg_symbol, node):
             node.optargs[key] = r_ast.Var(r_ast.Datum(arg_symbol))
         else:
             replace_implicit_vars(arg_symbol, node.optargs[key])
+
+
+
+#   Rewrite caching.
+#   Test suites tend to run the same query shapes over and over with different values.
+#   `RewriteCache` keys rewritten `mt_ast` trees on a structural fingerprint of the ReQL
+#   term in which `Datum` values are left out, so queries differing only in their datums
+#   share a plan.  On a hit, the datum values of the new query are written into the
+#   `RDatum` nodes of the cached plan, and the rewrite is skipped entirely.
+#
+#   Datums which the rewrite itself reads are part of the structure instead:
+#   function parameters and variables (numbered in order of appearance, since the driver
+#   gives every lambda fresh variable ids), and optargs.
+
+DEFAULT_REWRITE_CACHE_SIZE = 256
+
+class DatumSlot(object):
+    def __init__(self, index):
+        self.index = index
+
+NOT_CACHEABLE = object()
+
+def frozen_term(node):
+    if isinstance(node, r_ast.Datum):
+        return (r_ast.Datum, node.data)
+    return (
+        node.__class__,
+        tuple(frozen_term(arg) for arg in node.args),
+        tuple((k, frozen_term(v)) for k, v in util.sorted_iteritems(node.optargs))
+    )
+
+def _fingerprint(node, var_ids, datums):
+    node_type = node.__class__
+    if node_type == r_ast.Datum:
+        datums.append(node)
+        return node_type
+    elif node_type == r_ast.Func:
+        params = []
+        for param in node.args[0].args:
+            var_ids[param.data] = len(var_ids)
+            params.append(var_ids[param.data])
+        return (node_type, tuple(params), _fingerprint(node.args[1], var_ids, datums))
+    elif node_type == r_ast.Var:
+        var_id = node.args[0].data
+        return (node_type, var_ids.get(var_id, ('free', var_id)))
+    elif node_type == r_ast.MakeObj:
+        return (node_type, tuple(
+            (k, _fingerprint(v, var_ids, datums)) for k, v in util.sorted_iteritems(node.optargs)
+        ))
+    return (
+        node_type,
+        tuple(_fingerprint(arg, var_ids, datums) for arg in node.args),
+        tuple((k, frozen_term(v)) for k, v in util.sorted_iteritems(node.optargs))
+    )
+
+def fingerprint_query(query):
+    """Return `(fingerprint, datums)` for a ReQL query.
+
+    `fingerprint` is hashable and equal for queries which differ only in the values of
+    their parameter `Datum`s; `datums` lists those `Datum` nodes in a fixed order.
+    """
+    datums = []
+    fingerprint = _fingerprint(query, {}, datums)
+    hash(fingerprint)
+    return fingerprint, datums
+
+def find_datum_slots(plan, slot_count):
+    slots = [None] * slot_count
+    to_visit = [plan]
+    while to_visit:
+        node = to_visit.pop()
+        if isinstance(node, mt_ast.RDatum) and isinstance(node.val, DatumSlot):
+            slots[node.val.index] = node
+        to_visit.extend(node.children())
+    return slots
+
+def fill_slots(node, values):
+    """Return a copy of a cached plan, with `values` in place of its `DatumSlot`s.
+
+    Each query gets its own copy, since terms get things set on them as they run
+    (see `ast_base.bind_mock_ref`), and cached plans may be in use by other threads.
+    """
+    node = ast_base.shallow_copy(node)
+    if isinstance(node, mt_ast.RDatum) and isinstance(node.val, DatumSlot):
+        node.val = values[node.val.index]
+        return node
+    for attr in CHILD_ATTRS:
+        child = getattr(node, attr, None)
+        if isinstance(child, RBase):
+            setattr(node, attr, fill_slots(child, values))
+    vals = getattr(node, 'vals', None)
+    if isinstance(vals, dict):
+        node.vals = {k: fill_slots(v, values) if isinstance(v, RBase) else v for k, v in iteritems(vals)}
+    elif isinstance(vals, list):
+        node.vals = [fill_slots(v, values) if isinstance(v, RBase) else v for v in vals]
+    return node
+
+class RewriteCache(object):
+    """An LRU cache of rewritten queries, keyed by `fingerprint_query`.  Safe to share between threads."""
+    def __init__(self, max_size=DEFAULT_REWRITE_CACHE_SIZE):
+        self.max_size = max_size
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+
+    def rewrite(self, query):
+        return self.rewrite_with_fingerprint(query)[0]
+
+    def rewrite_with_fingerprint(self, query):
+        """Return the rewritten query and its fingerprint, or None for queries without one."""
+        try:
+            fingerprint, datums = fingerprint_query(query)
+        except TypeError:
+            return rewrite_query(query), None
+        if not self.max_size:
+            return rewrite_query(query), fingerprint
+        values = [datum.data for datum in datums]
+
+        with self.lock:
+            plan = self.plans.pop(fingerprint, None)
+            if plan is None:
+                plan = self.build_plan(query)
+                if len(self.plans) >= self.max_size:
+                    self.plans.popitem(last=False)
+            self.plans[fingerprint] = plan
+
+        if plan is NOT_CACHEABLE:
+            return rewrite_query(query), fingerprint
+        return fill_slots(plan, values), fingerprint
+
+    def build_plan(self, query):
+        # Rewrite a copy of the query with placeholders in place of the datum values, then
+        # check that each placeholder ended up as the value of an `RDatum`.  If one didn't,
+        # the rewrite used it some other way and this query shape can't be cached.
+        template = copy.deepcopy(query)
+        _, datums = fingerprint_query(template)
+        for index, datum in enumerate(datums):
+            datum.data = DatumSlot(index)
+        plan = rewrite_query(template)
+        if None in find_datum_slots(plan, len(datums)):
+            return NOT_CACHEABLE
+        return plan
@@ -0,0 +1,252 @@
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import io
+import json
+import mmap
+import numbers
+import os
+import struct
+
+import rethinkdb
+from future.utils import iteritems
+from past.builtins import basestring
+
+from . import ast as mt_ast
+from . import indexes, util
+from .ast_base import LITERAL_LIST, LITERAL_OBJECT, RBase, RFunc
+
+#   Fixture files.
+#   `MockThink.dump` writes the data of a `MockThink` to a file, and `MockThink.from_file`
+#   makes a `MockThink` from one.  The file is memory-mapped when it's loaded, and nothing but
+#   its header is read up front: a table's rows are only decoded once a query uses the table.
+#
+#   Layout:
+#       MAGIC
+#       for each table:
+#           one JSON blob per row, each followed by a newline
+#           offsets of the row blobs, and of the end of the last one (little-endian uint64s)
+#           JSON array of the rows' primary keys
+#       header (JSON)
+#       offset of the header (little-endian uint64)
+#
+#   The header has the same shape as the data passed to `MockThink`, except that each table
+#   has `rows`, `offsets` and `ids` entries locating its parts of the file.  Times are stored
+#   as RethinkDB's TIME pseudo-type.
+#
+#   Indexes on a field are stored as the field.  Indexes on a function are stored as the
+#   function's term tree (see `encode_term`), which is plain JSON: loading a file makes terms
+#   of the classes in `ast`, and never runs code from the file.
+
+MAGIC = b'MOCKTHINK-FIXTURE-1\n'
+
+OFFSET = struct.Struct('<Q')
+
+
+class MappedRows(object):
+    """The rows of one table in a fixture file, decoded on demand."""
+    def __init__(self, buf, offsets_pos, count, ids_span):
+        self.buf = buf
+        self.offsets_pos = offsets_pos
+        self.count = count
+        self.ids_span = ids_span
+        self.positions_by_id = None
+
+    def __len__(self):
+        return self.count
+
+    def row(self, n):
+        start, end = struct.unpack_from('<2Q', self.buf, self.offsets_pos + (OFFSET.size * n))
+        return decode(self.buf[start:end])
+
+    def __iter__(self):
+        if not self.count:
+            return iter([])
+        #   Row blobs end in newlines, which JSON never has outside of whitespace,
+        #   so all of them can be decoded in one go as an array.
+        start, = OFFSET.unpack_from(self.buf, self.offsets_pos)
+        end, = OFFSET.unpack_from(self.buf, self.offsets_pos + (OFFSET.size * self.count))
+        blobs = self.buf[start:end - 1]
+        return iter(decode(b'[' + blobs.replace(b'\n', b',') + b']'))
+
+    def get(self, id):
+        if self.positions_by_id is None:
+            start, end = self.ids_span
+            ids = decode(self.buf[start:end])
+            self.positions_by_id = {util.index_key(one_id): n for n, one_id in enumerate(ids)}
+        n = self.positions_by_id.get(util.index_key(id))
+        if n is None:
+            return None
+        return self.row(n)
+
+
+def encode_value(val):
+    if isinstance(val, datetime.datetime):
+        offset = val.utcoffset()
+        if offset is None:
+            timezone, offset = '+00:00', datetime.timedelta(0)
+        else:
+            minutes = int(offset.total_seconds()) // 60
+            sign = '-' if minutes < 0 else '+'
+            timezone = '%s%02d:%02d' % (sign, abs(minutes) // 60, abs(minutes) % 60)
+        epoch = (val.replace(tzinfo=None) - offset) - datetime.datetime(1970, 1, 1)
+        return {'$reql_type$': 'TIME', 'epoch_time': epoch.total_seconds(), 'timezone': timezone}
+    raise TypeError('Can\'t store %r in a fixture file' % (val,))
+
+def decode_object(obj):
+    if obj.get('$reql_type$') == 'TIME':
+        tz = rethinkdb.make_timezone(obj['timezone'])
+        return datetime.datetime.fromtimestamp(obj['epoch_time'], tz)
+    return obj
+
+def encode(val):
+    return json.dumps(val, default=encode_value, separators=(',', ':')).encode('utf-8')
+
+def decode(blob):
+    if isinstance(blob, bytes):
+        blob = blob.decode('utf-8')
+    if '$reql_type$' in blob:
+        return json.loads(blob, object_hook=decode_object)
+    return json.loads(blob)
+
+#   Term trees, as `{'term': class name, 'attrs': {name: value}}`, where each value is a
+#   `[kind, payload]` pair, so that data in datums can't be mistaken for terms.
+
+def encode_attr(val):
+    if isinstance(val, RBase):
+        return ['term', encode_term(val)]
+    elif isinstance(val, LITERAL_OBJECT):
+        return ['literal_object', {k: encode_attr(v) for k, v in iteritems(val)}]
+    elif isinstance(val, LITERAL_LIST):
+        return ['literal_list', [encode_attr(v) for v in val]]
+    elif isinstance(val, dict):
+        return ['dict', {k: encode_attr(v) for k, v in iteritems(val)}]
+    elif isinstance(val, (list, tuple)):
+        return ['list' if isinstance(val, list) else 'tuple', [encode_attr(v) for v in val]]
+    elif val is None or isinstance(val, (numbers.Number, basestring, datetime.datetime)):
+        return ['value', val]
+    raise TypeError('Can\'t store %r in a fixture file' % (val,))
+
+def encode_term(term):
+    attrs = term.__getstate__()
+    return {'term': term.__class__.__name__, 'attrs': {k: encode_attr(v) for k, v in iteritems(attrs)}}
+
+def decode_attr(encoded):
+    kind, payload = encoded
+    if kind == 'term':
+        return decode_term(payload)
+    elif kind in ('dict', 'literal_object'):
+        out = {k: decode_attr(v) for k, v in iteritems(payload)}
+        return LITERAL_OBJECT.from_dict(out) if kind == 'literal_object' else out
+    elif kind in ('list', 'tuple', 'literal_list'):
+        out = [decode_attr(v) for v in payload]
+        if kind == 'tuple':
+            return tuple(out)
+        return LITERAL_LIST.from_list(out) if kind == 'literal_list' else out
+    elif kind == 'value':
+        return payload
+    raise ValueError('Unknown kind of value in a fixture file: %r' % (kind,))
+
+def decode_term(encoded):
+    cls = getattr(mt_ast, encoded['term'], None)
+    if not (isinstance(cls, type) and issubclass(cls, RBase)):
+        raise ValueError('Unknown term in a fixture file: %r' % (encoded['term'],))
+    term = object.__new__(cls)
+    term.__dict__.update((k, decode_attr(v)) for k, v in iteritems(encoded['attrs']))
+    return term
+
+def encode_index_spec(index_name, spec):
+    func = spec.get('func')
+    out = {'multi': spec.get('multi', False)}
+    if isinstance(func, indexes.FieldIndexFunc):
+        out['field'] = func.field
+    elif isinstance(func, RFunc):
+        out['func'] = encode_term(func)
+    else:
+        raise TypeError('Can\'t store the function of index `%s` in a fixture file' % index_name)
+    return out
+
+def decode_index_spec(encoded):
+    if 'field' in encoded:
+        func = indexes.FieldIndexFunc(encoded['field'])
+    else:
+        func = decode_term(encoded['func'])
+    return {'func': func, 'multi': encoded['multi']}
+
+def write_table(out, table):
+    offsets = []
+    ids = []
+    for row in table:
+        offsets.append(out.tell())
+        out.write(encode(row))
+        out.write(b'\n')
+        ids.append(row['id'])
+    offsets.append(out.tell())
+    offsets_pos = out.tell()
+    for offset in offsets:
+        out.write(OFFSET.pack(offset))
+    ids_start = out.tell()
+    out.write(encode(ids))
+    return {
+        'rows': len(ids),
+        'offsets': offsets_pos,
+        'ids': [ids_start, out.tell()]
+    }
+
+def dump(mock_db, path):
+    """Write a `MockDb` to a fixture file.
+
+    The file is written next to `path` and then moved into place, so a file that's
+    still mapped by an earlier `load` is left alone.
+    """
+    tmp_path = '%s.tmp-%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as out:
+        out.write(MAGIC)
+        header = {'dbs': {}}
+        for db_name, db_data in sorted(iteritems(mock_db.dbs_by_name)):
+            tables = {}
+            for table_name, table in sorted(iteritems(db_data.tables_by_name)):
+                spec = write_table(out, table)
+                spec['indexes'] = {
+                    index_name: encode_index_spec(index_name, index_spec)
+                    for index_name, index_spec in iteritems(table.indexes)
+                }
+                tables[table_name] = spec
+            header['dbs'][db_name] = {'tables': tables}
+        header_pos = out.tell()
+        out.write(encode(header))
+        out.write(OFFSET.pack(header_pos))
+    getattr(os, 'replace', os.rename)(tmp_path, path)
+
+def load(path):
+    """Map a fixture file, and return its data in the form `MockThink` takes, with `MappedRows` for rows."""
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buf[0:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a mockthink fixture file' % path)
+    header_pos, = OFFSET.unpack_from(buf, len(buf) - OFFSET.size)
+    header = decode(buf[header_pos:len(buf) - OFFSET.size])
+    for db_data in header['dbs'].values():
+        for table_name, spec in list(iteritems(db_data['tables'])):
+            db_data['tables'][table_name] = {
+                'rows': MappedRows(buf, spec['offsets'], spec['rows'], spec['ids']),
+                'indexes': {
+                    index_name: decode_index_spec(encoded)
+                    for index_name, encoded in iteritems(spec['indexes'])
+                }
+            }
+    return header
+
+
+#   Newline-delimited JSON, one row per line, for `MockThink.load_ndjson` and `export_ndjson`.
+
+def iter_ndjson(fileobj):
+    for line in fileobj:
+        if line.strip():
+            yield decode(line)
+
+def write_ndjson(rows, fileobj):
+    text = isinstance(fileobj, io.TextIOBase)
+    for row in rows:
+        line = encode(row) + b'\n'
+        fileobj.write(line.decode('utf-8') if text else line)
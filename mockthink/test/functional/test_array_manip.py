@@ -1,5 +1,6 @@
 import rethinkdb as r
-from mockthink.test.common import as_db_and_table, assertEqUnordered
+from rethinkdb import RqlRuntimeError
+from mockthink.test.common import as_db_and_table, assertEqUnordered, assertEqual
 from mockthink.test.functional.common import MockTest
 from pprint import pprint
 
@@ -193,3 +194,66 @@ class TestSample(MockTest):
         ids = set(['one', 'two', 'three'])
         assert(doc1['id'] in ids)
         assert(doc2['id'] in ids)
+
+
+class TestSequenceSlicing(MockTest):
+    @staticmethod
+    def get_data():
+        data = [
+            {'id': 1, 'animals': ['frog', 'cow']},
+            {'id': 2, 'animals': ['horse']},
+            {'id': 3, 'animals': []},
+            {'id': 4, 'animals': ['pig']}
+        ]
+        return as_db_and_table('x', 'farms', data)
+
+    def test_limit(self, conn):
+        result = r.db('x').table('farms').order_by('id').limit(2).map(
+            lambda d: d['id']
+        ).run(conn)
+        assertEqual([1, 2], list(result))
+
+    def test_skip(self, conn):
+        result = r.db('x').table('farms').order_by('id').skip(3).map(
+            lambda d: d['id']
+        ).run(conn)
+        assertEqual([4], list(result))
+
+    def test_slice(self, conn):
+        result = r.expr([1, 2, 3, 4, 5]).slice(1, 3).run(conn)
+        assertEqual([2, 3], list(result))
+
+    def test_slice_open_end(self, conn):
+        result = r.expr([1, 2, 3, 4, 5]).slice(3).run(conn)
+        assertEqual([4, 5], list(result))
+
+    def test_negative_limit(self, conn):
+        err = None
+        try:
+            list(r.db('x').table('farms').limit(-1).run(conn))
+        except RqlRuntimeError as e:
+            err = e
+        assert(isinstance(err, RqlRuntimeError))
+
+    def test_negative_limit_after_order_by(self, conn):
+        err = None
+        try:
+            list(r.db('x').table('farms').order_by('id').limit(-1).run(conn))
+        except RqlRuntimeError as e:
+            err = e
+        assert(isinstance(err, RqlRuntimeError))
+
+    def test_slice_bounds(self, conn):
+        farms = r.db('x').table('farms').order_by('id')
+        result = farms.slice(1, 3, right_bound='closed').map(lambda d: d['id']).run(conn)
+        assertEqual([2, 3, 4], list(result))
+        result = farms.slice(1, 3, left_bound='open').map(lambda d: d['id']).run(conn)
+        assertEqual([3], list(result))
+        result = r.expr([1, 2, 3, 4, 5]).slice(1, -1, left_bound='open', right_bound='closed').run(conn)
+        assertEqual([3, 4, 5], list(result))
+
+    def test_concat_map(self, conn):
+        result = r.db('x').table('farms').concat_map(
+            lambda d: d['animals']
+        ).run(conn)
+        assertEqUnordered(['frog', 'cow', 'horse', 'pig'], list(result))
@@ -1,5 +1,5 @@
 import rethinkdb as r
-from mockthink.test.common import as_db_and_table, assertEqUnordered
+from mockthink.test.common import as_db_and_table, assertEqUnordered, assertEqual
 from mockthink.test.functional.common import MockTest
 
 class TestBetween(MockTest):
@@ -107,3 +107,37 @@ class TestBetween(MockTest):
         ).run(conn)
         result = list(result)
         assertEqUnordered(expected, result)
+
+
+class TestBetweenMinMaxVal(MockTest):
+    @staticmethod
+    def get_data():
+        data = [
+            {'id': 'bob', 'age': 30},
+            {'id': 'joe', 'age': 25},
+            {'id': 'tom', 'age': 40},
+            {'id': 'zuul', 'age': 10000}
+        ]
+        return as_db_and_table('s', 'people', data)
+
+    def test_between_minval(self, conn):
+        expected = [
+            {'id': 'bob', 'age': 30},
+            {'id': 'joe', 'age': 25}
+        ]
+        result = r.db('s').table('people').between(r.minval, 'tom').run(conn)
+        assertEqUnordered(expected, list(result))
+
+    def test_between_maxval_on_index(self, conn):
+        expected = [
+            {'id': 'tom', 'age': 40},
+            {'id': 'zuul', 'age': 10000}
+        ]
+        r.db('s').table('people').index_create('age').run(conn)
+        r.db('s').table('people').index_wait().run(conn)
+        result = r.db('s').table('people').between(
+            30, r.maxval, index='age', left_bound='open'
+        ).run(conn)
+        result = list(result)
+        assertEqual(2, len(result))
+        assertEqUnordered(expected, result)
@@ -122,3 +122,43 @@ class TestUngroup(MockTest):
             result_group = list(filter(is_group(group), result))[0]
             expected_group = list(filter(is_group(group), expected))[0]
             assertEqUnordered(expected_group['reduction'], result_group['reduction'])
+
+
+class TestGroupedAggregation(MockTest):
+    @staticmethod
+    def get_data():
+        data = [
+            {'id': 'joe', 'type': 'bro', 'age': 26},
+            {'id': 'bill', 'type': 'hipster', 'age': 35},
+            {'id': 'todd', 'type': 'hipster', 'age': 52},
+            {'id': 'kim', 'type': 'hipster', 'age': 40}
+        ]
+        return as_db_and_table('x', 'people', data)
+
+    def test_count(self, conn):
+        result = r.db('x').table('people').group('type').count().run(conn)
+        assertEqual({'bro': 1, 'hipster': 3}, result)
+
+    def test_count_by_func(self, conn):
+        result = r.db('x').table('people').group('type').count(lambda p: p['age'] > 30).run(conn)
+        assertEqual({'bro': 0, 'hipster': 3}, result)
+
+    def test_sum_by_field(self, conn):
+        result = r.db('x').table('people').group(lambda p: p['type']).sum('age').run(conn)
+        assertEqual({'bro': 26, 'hipster': 127}, result)
+
+    def test_avg_by_func(self, conn):
+        result = r.db('x').table('people').group('type').avg(lambda p: p['age'] * 2).run(conn)
+        assertEqual({'bro': 52, 'hipster': 84.66666666666667}, result)
+
+    def test_max_by_field(self, conn):
+        result = r.db('x').table('people').group('type').max('age').run(conn)
+        assertEqual({'bro': 'joe', 'hipster': 'todd'}, {k: v['id'] for k, v in result.items()})
+
+    def test_min_by_func(self, conn):
+        result = r.db('x').table('people').group('type').min(lambda p: p['age']).run(conn)
+        assertEqual({'bro': 'joe', 'hipster': 'bill'}, {k: v['id'] for k, v in result.items()})
+
+    def test_ungroup(self, conn):
+        result = r.db('x').table('people').group('type').count().ungroup().run(conn)
+        assertEqUnordered([{'group': 'bro', 'reduction': 1}, {'group': 'hipster', 'reduction': 3}], list(result))
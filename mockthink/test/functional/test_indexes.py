@@ -197,3 +197,37 @@ class TestMoreIndices(MockTest):
     #         #                            .order_by(lambda doc: doc['parents'].count())
     #         #                            .map(lambda doc: doc['id'])
     #         #                            .run(Model.connection.local())):
+
+
+class TestIndexMaintenance(MockTest):
+    @staticmethod
+    def get_data():
+        data = [
+            {'id': 'bob', 'first_name': 'Bob', 'last_name': 'Builder'},
+            {'id': 'joe', 'first_name': 'Joseph', 'last_name': 'Smith'},
+            {'id': 'tom', 'first_name': 'Tom', 'last_name': 'Generic'}
+        ]
+        return as_db_and_table('s', 'people', data)
+
+    def test_index_follows_update_and_delete(self, conn):
+        people = r.db('s').table('people')
+        people.index_create('last_name').run(conn)
+        people.index_wait().run(conn)
+        people.get('bob').update({'last_name': 'Smith'}).run(conn)
+        people.get('joe').delete().run(conn)
+        result = list(people.get_all('Smith', index='last_name').run(conn))
+        assertEqual(['bob'], [doc['id'] for doc in result])
+        result = list(people.get_all('Builder', index='last_name').run(conn))
+        assertEqual([], result)
+
+    def test_func_index_between(self, conn):
+        people = r.db('s').table('people')
+        people.index_create(
+            'first_and_last',
+            lambda doc: doc['first_name'] + doc['last_name']
+        ).run(conn)
+        people.index_wait().run(conn)
+        result = people.between(
+            'Joseph', 'Tom', index='first_and_last'
+        ).run(conn)
+        assertEqual(['joe'], [doc['id'] for doc in result])
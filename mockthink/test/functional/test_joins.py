@@ -65,6 +65,28 @@ class TestEqJoin(MockTest):
         result = r.db('jezebel').table('employees').eq_join('person', r.db('jezebel').table('people')).run(conn)
         assertEqUnordered(expected, list(result))
 
+    def test_eq_join_secondary_index(self, conn):
+        r.db('jezebel').table('employees').index_create('person').run(conn)
+        r.db('jezebel').table('employees').index_wait().run(conn)
+        result = r.db('jezebel').table('people').eq_join(
+            'id', r.db('jezebel').table('employees'), index='person'
+        ).map(lambda pair: [pair['left']['name'], pair['right']['job']]).run(conn)
+        assertEqUnordered([['Joe', 'lawyer-id'], ['Arnold', 'nurse-id']], list(result))
+
+    def test_eq_join_multi_index(self, conn):
+        r.db('jezebel').table('people').update({'jobs': ['lawyer-id', 'nurse-id']}).run(conn)
+        r.db('jezebel').table('people').index_create('jobs', multi=True).run(conn)
+        r.db('jezebel').table('people').index_wait().run(conn)
+        result = r.db('jezebel').table('employees').eq_join(
+            'job', r.db('jezebel').table('people'), index='jobs'
+        ).map(lambda pair: [pair['left']['id'], pair['right']['id']]).run(conn)
+        expected = [
+            [emp, person]
+            for emp in ('joe-emp-id', 'arnold-emp-id')
+            for person in ('joe-id', 'tom-id', 'arnold-id')
+        ]
+        assertEqUnordered(expected, list(result))
+
 
 class TestInnerJoin(MockTest):
     @staticmethod
@@ -174,6 +196,16 @@ class TestOuterJoin(MockTest):
         ).run(conn)
         assertEqUnordered(expected, list(result))
 
+    def test_outer_join_with_extra_condition(self, conn):
+        result = r.db('awesomesauce').table('people').outer_join(
+            r.db('awesomesauce').table('pets'),
+            lambda person, pet: (person['id'] == pet['owner']) & (pet['name'] != 'Pet1')
+        ).run(conn)
+        expected = [['miguel-id', 'pet3-id'], ['mark-id', 'pet2-id'], ['sam-id', None]]
+        assertEqUnordered(expected, [
+            [pair['left']['id'], pair.get('right', {}).get('id')] for pair in result
+        ])
+
 
 class TestZip(MockTest):
     @staticmethod
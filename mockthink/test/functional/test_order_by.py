@@ -135,3 +135,92 @@ class TestOrderByMulti(MockTest):
         ]
         result = r.db('y').table('scores').order_by('score', 'age').run(conn)
         assertEqual(expected, list(result))
+
+
+class TestOrderByLimit(MockTest):
+    @staticmethod
+    def get_data():
+        data = [
+            {'id': 'bill', 'age': 35, 'score': 78},
+            {'id': 'glen', 'age': 26, 'score': 15},
+            {'id': 'todd', 'age': 52, 'score': 15},
+            {'id': 'joe', 'age': 26, 'score': 60},
+            {'id': 'pale', 'age': 52, 'score': 30}
+        ]
+        return as_db_and_table('y', 'scores', data)
+
+    def test_limit_desc(self, conn):
+        result = r.db('y').table('scores').order_by(r.desc('score')).limit(2).run(conn)
+        assertEqual(['bill', 'joe'], [doc['id'] for doc in result])
+
+    def test_limit_multi_mixed_directions(self, conn):
+        result = r.db('y').table('scores').order_by(r.desc('age'), 'score').limit(3).run(conn)
+        assertEqual(['todd', 'pale', 'bill'], [doc['id'] for doc in result])
+
+    def test_slice(self, conn):
+        result = r.db('y').table('scores').order_by('score', 'id').slice(1, 3).run(conn)
+        assertEqual(['todd', 'pale'], [doc['id'] for doc in result])
+
+    def test_limit_by_func(self, conn):
+        result = r.db('y').table('scores').order_by(
+            lambda doc: doc['age'].add(doc['score'])
+        ).limit(2).run(conn)
+        assertEqual(['glen', 'todd'], [doc['id'] for doc in result])
+
+
+class TestOrderByLimitMixedTypes(MockTest):
+    @staticmethod
+    def get_data():
+        values = [3, 'b', None, True, [1], -1, 'a', False, {'a': 1}, 2.5]
+        data = [{'id': i, 'val': val} for i, val in enumerate(values)]
+        data.append({'id': len(values)})
+        return as_db_and_table('y', 'things', data)
+
+    def test_limit_matches_full_sort(self, conn):
+        things = r.db('y').table('things')
+        for order_by in (things.order_by('val'), things.order_by(r.desc('val')), things.order_by(lambda doc: doc['id'].mod(3))):
+            full = list(order_by.run(conn))
+            for n in (1, 4, 11):
+                assertEqual(full[0:n], list(order_by.limit(n).run(conn)))
+                assertEqual(full[2:n], list(order_by.slice(2, n).run(conn)))
+
+
+class TestOrderByIndex(MockTest):
+    @staticmethod
+    def get_data():
+        data = [
+            {'id': 'bill', 'age': 35, 'score': 78},
+            {'id': 'glen', 'age': 26, 'score': 15},
+            {'id': 'todd', 'age': 52, 'score': 15},
+            {'id': 'joe', 'age': 26, 'score': 60},
+            {'id': 'pale', 'age': 52, 'score': 30}
+        ]
+        return as_db_and_table('y', 'scores', data)
+
+    def test_primary_index(self, conn):
+        result = r.db('y').table('scores').order_by(index='id').run(conn)
+        assertEqual(['bill', 'glen', 'joe', 'pale', 'todd'], [doc['id'] for doc in result])
+
+    def test_primary_index_desc(self, conn):
+        result = r.db('y').table('scores').order_by(index=r.desc('id')).run(conn)
+        assertEqual(['todd', 'pale', 'joe', 'glen', 'bill'], [doc['id'] for doc in result])
+
+    def test_secondary_index_with_tiebreak(self, conn):
+        r.db('y').table('scores').index_create('score').run(conn)
+        r.db('y').table('scores').index_wait().run(conn)
+        result = r.db('y').table('scores').order_by(r.desc('id'), index='score').run(conn)
+        assertEqual(['todd', 'glen', 'pale', 'joe', 'bill'], [doc['id'] for doc in result])
+
+    def test_secondary_index_desc_limit(self, conn):
+        r.db('y').table('scores').index_create('age').run(conn)
+        r.db('y').table('scores').index_wait().run(conn)
+        result = r.db('y').table('scores').order_by(index=r.desc('age')).limit(3).run(conn)
+        assertEqual([52, 52, 35], [doc['age'] for doc in result])
+
+    def test_between_in_index_order(self, conn):
+        r.db('y').table('scores').index_create('score').run(conn)
+        r.db('y').table('scores').index_wait().run(conn)
+        result = r.db('y').table('scores').between(
+            20, 70, index='score'
+        ).order_by(index=r.desc('score')).run(conn)
+        assertEqual(['joe', 'pale'], [doc['id'] for doc in result])
@@ -0,0 +1,108 @@
+import unittest
+
+import rethinkdb as r
+
+from mockthink import ast as mt_ast
+from mockthink import util
+from mockthink.ast_base import RBase
+from mockthink.db import MockThink
+from mockthink.scope import Scope
+from mockthink.test.common import as_db_and_table, assertEqual
+
+
+class TestLazySequences(unittest.TestCase):
+    # Every row after the first is missing `age`, so evaluating the filter
+    # on any of them raises; these queries only pass if evaluation stops early.
+    def setUp(self):
+        rows = [{'id': 0, 'age': 30}] + [{'id': i} for i in range(1, 100)]
+        self.conn = MockThink(as_db_and_table('x', 'people', rows)).get_conn()
+        self.adults = r.db('x').table('people').filter(lambda p: p['age'] > 18)
+
+    def test_limit(self):
+        assertEqual([{'id': 0, 'age': 30}], list(self.adults.limit(1).run(self.conn)))
+
+    def test_nth(self):
+        assertEqual({'id': 0, 'age': 30}, self.adults.nth(0).run(self.conn))
+
+    def test_is_empty(self):
+        assertEqual(False, self.adults.is_empty().run(self.conn))
+
+    def test_contains(self):
+        assertEqual(True, self.adults.map(lambda p: p['id']).contains(0).run(self.conn))
+
+    def test_errors_still_raise_when_consumed(self):
+        self.assertRaises(Exception, lambda: self.adults.count().run(self.conn))
+
+    def test_order_by_index_limit(self):
+        adults = r.db('x').table('people').order_by(index='id').filter(lambda p: p['age'] > 18)
+        assertEqual([{'id': 0, 'age': 30}], list(adults.limit(1).run(self.conn)))
+
+    def test_order_by_index_desc_limit(self):
+        result = r.db('x').table('people').order_by(index=r.desc('id')).limit(2).run(self.conn)
+        assertEqual([99, 98], [doc['id'] for doc in result])
+
+
+class CompiledOnly(RBase):
+    def __init__(self, func):
+        self.func = func
+        self.compiles = 0
+
+    def run(self, arg, scope):
+        raise AssertionError('run when it should have been compiled')
+
+    def compile(self):
+        self.compiles += 1
+        return self.func
+
+
+class TestGroupedAggregation(unittest.TestCase):
+    def test_compiles_its_functions_once(self):
+        terms = [
+            CompiledOnly(lambda arg, scope: [1, 2, 3, 4, 5]),
+            CompiledOnly(lambda elem, scope: elem % 2),
+            CompiledOnly(lambda elem, scope: elem * 10)
+        ]
+        term = mt_ast.GroupedAggregation(*terms, optargs={'aggregate': 'sum', 'group_by': 'func', 'by': 'func'})
+        assertEqual({0: 60, 1: 90}, term.compile()(None, Scope({})))
+        assertEqual([1, 1, 1], [t.compiles for t in terms])
+
+
+class TestHashJoin(unittest.TestCase):
+    def test_compiles_children_and_predicate_once(self):
+        terms = [
+            CompiledOnly(lambda arg, scope: [{'id': 1, 'n': 1}, {'id': 2, 'n': 2}, {'id': 3, 'n': 3}]),
+            CompiledOnly(lambda arg, scope: [{'id': 1, 'n': 1}, {'id': 2, 'n': 5}]),
+            CompiledOnly(lambda pair, scope: pair[0]['n'] == pair[1]['n'])
+        ]
+        term = mt_ast.HashOuterJoin(*terms, optargs={'fields': ('id', 'id')})
+        assertEqual(
+            [
+                {'left': {'id': 1, 'n': 1}, 'right': {'id': 1, 'n': 1}},
+                {'left': {'id': 2, 'n': 2}},
+                {'left': {'id': 3, 'n': 3}}
+            ],
+            util.materialize(term.compile()(None, Scope({})))
+        )
+        assertEqual([1, 1, 1], [t.compiles for t in terms])
+
+
+class TestCount(unittest.TestCase):
+    def stream(self):
+        return util.Stream(iter([0, 1, 2, 1]))
+
+    def test_counts_streams_without_remembering_them(self):
+        stream = self.stream()
+        assertEqual(4, mt_ast.Count1(None).do_run(stream, None, Scope({})))
+        assertEqual(None, stream.seen)
+
+    def test_count_by_eq_and_func(self):
+        stream = self.stream()
+        assertEqual(2, mt_ast.CountByEq(None, None).do_run(stream, 1, None, Scope({})))
+        assertEqual(None, stream.seen)
+        stream = self.stream()
+        assertEqual(3, mt_ast.CountByFunc(None, None).do_run(stream, lambda n: n or None, None, Scope({})))
+        assertEqual(None, stream.seen)
+
+    def test_count_of_a_map_through_a_query(self):
+        conn = MockThink(as_db_and_table('x', 'people', [{'id': i} for i in range(0, 5)])).get_conn()
+        assertEqual(5, r.db('x').table('people').map(lambda p: p['id']).count().run(conn))
@@ -109,3 +109,41 @@ class TestAst(unittest.TestCase):
             }
         ])
         self.assertTrue(ast_base.has_nested_literal(thing))
+
+
+class TestCompile(unittest.TestCase):
+    def make_func(self):
+        from mockthink import ast as mt_ast
+        doc_var = lambda: mt_ast.RVar(ast_base.RDatum('doc'))
+        body = ast_base.MakeObj({
+            'doubled': mt_ast.Mul(
+                mt_ast.Bracket(doc_var(), ast_base.RDatum('x')),
+                ast_base.RDatum(2)
+            ),
+            'both': ast_base.MakeArray([
+                mt_ast.Bracket(doc_var(), ast_base.RDatum('x')),
+                mt_ast.Bracket(doc_var(), ast_base.RDatum('y'))
+            ])
+        })
+        return ast_base.RFunc(['doc'], body)
+
+    def test_compiled_matches_run(self):
+        from mockthink.scope import Scope
+        func = self.make_func()
+        doc = {'x': 5, 'y': 'why'}
+        expected = {'doubled': 10, 'both': [5, 'why']}
+        assertEqual(expected, func.run([doc], Scope({})))
+        assertEqual(expected, func.compile()([doc], Scope({})))
+
+    def test_falls_back_to_run(self):
+        class CustomRun(ast_base.MonExp):
+            def run(self, arg, scope):
+                return 'custom'
+        node = CustomRun(ast_base.RDatum(1))
+        assertEqual(node.run, node.compile())
+        assertEqual('custom', node.compile()(None, None))
+
+    def test_bind_mock_ref(self):
+        func = self.make_func()
+        ast_base.bind_mock_ref(func, 'some-db')
+        assertEqual('some-db', func.body.vals['both'].vals[1].left.mockdb_ref)
@@ -0,0 +1,37 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mockthink import bench
+from mockthink.bench import __main__ as bench_main
+from mockthink.test.common import assertEqual
+
+
+class TestBench(unittest.TestCase):
+    def test_run(self):
+        logged = []
+        results = bench.run(sizes=[10], repeat=1, log=logged.append)
+        assertEqual(
+            set(['mockthink_version', 'python', 'implementation', 'seed', 'results']),
+            set(results)
+        )
+        assertEqual([c.name for c in bench.CASES], [result['name'] for result in results['results']])
+        assertEqual(results['results'], logged)
+        for result in results['results']:
+            assertEqual(set(['name', 'rows', 'repeat', 'min', 'median', 'mean']), set(result))
+            assertEqual((10, 1), (result['rows'], result['repeat']))
+            self.assertTrue(0 <= result['min'] <= result['median'])
+        json.dumps(results)
+
+    def test_main(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'results.json')
+            bench_main.main(['--rows', '5', '--repeat', '1', '--only', 'get', 'insert', '-o', path])
+            with open(path) as f:
+                results = json.load(f)
+        finally:
+            shutil.rmtree(tmp_dir)
+        assertEqual(['get', 'insert'], [result['name'] for result in results['results']])
@@ -1,5 +1,16 @@
-from ..common import TestCase, assertEqual
-from ... import db
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import rethinkdb as r
+from rethinkdb import RqlCursorEmpty, RqlRuntimeError
+
+from ..common import TestCase, as_db_and_table, assertEqual
+from ... import db, indexes, rql_rewrite, util
 
 
 def db_insert_starting_data():
@@ -10,7 +21,7 @@ def db_insert_starting_data():
     ]
 
 
-class TestDbInsertWithConflictSettings(TestCase):
+class TestMockTableDataInsertWithConflictSettings(TestCase):
     def test_error(self):
         expected_result = [
             {'id': 'a', 'name': 'a-name', 'age': 'a-age'},
@@ -34,12 +45,9 @@ class TestDbInsertWithConflictSettings(TestCase):
             {'id': 'c', 'something': 'someval'},
             {'id': 'd', 'name': 'deshawn'}
         ]
-        result, report = db.insert_into_table_with_conflict_setting(
-            db_insert_starting_data(),
-            to_insert,
-            conflict='error'
-        )
-        assertEqual(expected_result, result)
+        table = db.MockTableData('people', db_insert_starting_data(), {})
+        table, report = table.insert(to_insert, conflict='error')
+        assertEqual(expected_result, table.rows)
         keys = ('replaced', 'inserted', 'errors', 'changes')
         self.assert_key_equality(keys, expected_report, report)
 
@@ -69,12 +77,9 @@ class TestDbInsertWithConflictSettings(TestCase):
             {'id': 'c', 'name': 'new c name', 'new_c_key': 'new_c_val'},
             {'id': 'd', 'name': 'deshawn'}
         ]
-        result, report = db.insert_into_table_with_conflict_setting(
-            db_insert_starting_data(),
-            to_insert,
-            conflict='update'
-        )
-        assertEqual(expected_result, result)
+        table = db.MockTableData('people', db_insert_starting_data(), {})
+        table, report = table.insert(to_insert, conflict='update')
+        assertEqual(expected_result, table.rows)
         keys = ('replaced', 'inserted', 'errors', 'changes')
         self.assert_key_equality(keys, expected_report, report)
 
@@ -104,12 +109,446 @@ class TestDbInsertWithConflictSettings(TestCase):
             {'id': 'c', 'name': 'new c name', 'new_c_key': 'new_c_val'},
             {'id': 'd', 'name': 'deshawn'}
         ]
-        result, report = db.insert_into_table_with_conflict_setting(
-            db_insert_starting_data(),
-            to_insert,
-            conflict='replace'
-        )
-        assertEqual(expected_result, result)
+        table = db.MockTableData('people', db_insert_starting_data(), {})
+        table, report = table.insert(to_insert, conflict='replace')
+        assertEqual(expected_result, table.rows)
         keys = ('replaced', 'inserted', 'errors', 'changes')
         self.assert_key_equality(keys, expected_report, report)
 
+
+
+class TestMockTableDataById(TestCase):
+    def make_table(self):
+        return db.MockTableData('people', db_insert_starting_data(), {})
+
+    def test_get_by_id(self):
+        table = self.make_table()
+        assertEqual({'id': 'b', 'name': 'b-name', 'age': 'b-age'}, table.get_by_id('b'))
+        assertEqual(None, table.get_by_id('missing'))
+
+    def test_get_all_by_id(self):
+        table = self.make_table()
+        expected = [
+            {'id': 'c', 'name': 'c-name', 'age': 'c-age'},
+            {'id': 'a', 'name': 'a-name', 'age': 'a-age'}
+        ]
+        assertEqual(expected, table.get_all_by_id(['c', 'missing', 'a', 'c']))
+
+    def test_update_by_id_keeps_order_and_original(self):
+        table = self.make_table()
+        updated, report = table.update_by_id({'id': 'b', 'name': 'new-b'})
+        assertEqual(['a', 'b', 'c'], [row['id'] for row in updated])
+        assertEqual({'id': 'b', 'name': 'new-b'}, updated.get_by_id('b'))
+        assertEqual('b-name', table.get_by_id('b')['name'])
+        assertEqual(1, report['replaced'])
+
+    def test_remove_by_id(self):
+        table = self.make_table()
+        removed, report = table.remove_by_id([{'id': 'a'}, {'id': 'missing'}])
+        assertEqual(['b', 'c'], [row['id'] for row in removed])
+        assertEqual(None, removed.get_by_id('a'))
+        assertEqual(3, len(table))
+        assertEqual(1, report['deleted'])
+
+
+class TestMockTableDataSecondaryIndexes(TestCase):
+    def make_table(self):
+        rows = [
+            {'id': 'a', 'kind': 'x', 'tags': ['red', 'blue']},
+            {'id': 'b', 'kind': 'y', 'tags': ['red']},
+            {'id': 'c', 'kind': 'x'}
+        ]
+        table = db.MockTableData('things', rows, {})
+        table = table.create_index('kind', util.getter('kind'))
+        return table.create_index('tags', util.getter('tags'), multi=True)
+
+    def ids(self, rows):
+        return sorted(row['id'] for row in rows)
+
+    def test_index_is_materialized_on_create(self):
+        table = self.make_table()
+        assertEqual(set(['kind', 'tags']), set(table.index_maps.keys()))
+        assertEqual(['a', 'c'], self.ids(table.get_all_by_index('kind', ['x'])))
+        assertEqual(['a', 'b'], self.ids(table.get_all_by_index('tags', ['red', 'blue'])))
+
+    def test_index_follows_writes(self):
+        table = self.make_table()
+        table, _ = table.insert({'id': 'd', 'kind': 'y', 'tags': ['blue']}, 'error')
+        table, _ = table.update_by_id({'id': 'a', 'kind': 'y', 'tags': []})
+        table, _ = table.remove_by_id({'id': 'b'})
+        assertEqual(['c'], self.ids(table.get_all_by_index('kind', ['x'])))
+        assertEqual(['a', 'd'], self.ids(table.get_all_by_index('kind', ['y'])))
+        assertEqual([], self.ids(table.get_all_by_index('tags', ['red'])))
+        assertEqual(['d'], self.ids(table.get_all_by_index('tags', ['blue'])))
+        assertEqual(['x', 'y'], sorted(table.index_values('kind')))
+
+    def test_earlier_snapshot_index_unchanged(self):
+        table = self.make_table()
+        table.insert({'id': 'd', 'kind': 'x'}, 'error')
+        assertEqual(['a', 'c'], self.ids(table.get_all_by_index('kind', ['x'])))
+
+    def test_rows_without_value_are_left_out(self):
+        table = self.make_table()
+        assertEqual(['blue', 'red'], sorted(table.index_values('tags')))
+        assertEqual([], table.get_all_by_index('tags', [None]))
+
+    def test_index_from_initial_data_built_lazily(self):
+        indexes = {'kind': {'func': util.getter('kind'), 'multi': False}}
+        table = db.MockTableData('things', [{'id': 'a', 'kind': 'x'}], indexes)
+        assertEqual({}, table.index_maps)
+        assertEqual(['a'], self.ids(table.get_all_by_index('kind', ['x'])))
+        assertEqual(['kind'], list(table.index_maps.keys()))
+
+
+class TestMockTableDataIndexRanges(TestCase):
+    def make_table(self):
+        rows = [{'id': i, 'score': i % 5} for i in range(0, 20)]
+        table = db.MockTableData('things', rows, {})
+        return table.create_index('score', util.getter('score'))
+
+    def ids(self, rows):
+        return [row['id'] for row in rows]
+
+    def test_primary_range(self):
+        table = self.make_table()
+        assertEqual([3, 4, 5], self.ids(table.get_in_index_range('id', 3, 6)))
+        assertEqual([4, 5, 6], self.ids(table.get_in_index_range('id', 3, 6, 'open', 'closed')))
+        assertEqual([17, 18, 19], self.ids(table.get_in_index_range('id', 17, util.MAXVAL)))
+
+    def test_secondary_range(self):
+        table = self.make_table()
+        result = self.ids(table.get_in_index_range('score', util.MINVAL, 1, right_bound='closed'))
+        assertEqual([0, 5, 10, 15, 1, 6, 11, 16], result)
+
+    def test_ordered_index_follows_writes(self):
+        table = self.make_table()
+        assertEqual([4, 9, 14, 19], self.ids(table.get_in_index_range('score', 4, 5)))
+        table, _ = table.insert({'id': 'new', 'score': 4}, 'error')
+        table, _ = table.update_by_id({'id': 9, 'score': 0})
+        table, _ = table.remove_by_id({'id': 14})
+        assertEqual([4, 19, 'new'], self.ids(table.get_in_index_range('score', 4, 5)))
+        assertEqual(['new'], self.ids(table.get_in_index_range('id', 'a', 'z')))
+
+
+class TestMockThinkCursor(TestCase):
+    def setUp(self):
+        rows = [{'id': i, 'age': i} for i in range(0, 10)] + [{'id': 10}]
+        self.conn = db.MockThink(as_db_and_table('x', 'people', rows)).get_conn()
+        self.people = r.db('x').table('people')
+
+    def test_batches(self):
+        cursor = self.people.run(self.conn, max_batch_rows=4)
+        assertEqual(4, len(cursor.items))
+        assertEqual(0, cursor.next()['id'])
+        assertEqual(list(range(1, 11)), [doc['id'] for doc in cursor])
+        self.assertRaises(RqlCursorEmpty, cursor.next)
+
+    def test_batches_by_bytes(self):
+        cursor = self.people.run(self.conn, max_batch_bytes=1)
+        assertEqual(1, len(cursor.items))
+        assertEqual(11, len(list(cursor)))
+
+    def test_close(self):
+        cursor = self.people.run(self.conn, max_batch_rows=4)
+        cursor.close()
+        assertEqual([], list(cursor))
+
+    def test_does_not_keep_rows_it_has_returned(self):
+        stream = util.Stream({'id': i} for i in range(0, 10))
+        cursor = db.MockThinkCursor(db.MockThink({'dbs': {}}), stream, None, max_batch_rows=2)
+        assertEqual([0, 1, 2], [cursor.next()['id'] for _ in range(0, 3)])
+        assertEqual(None, stream.seen)
+
+    def test_streams_bound_to_variables_can_be_read_twice(self):
+        query = self.people.map(lambda p: p['id']).do(lambda ids: ids.count().add(ids.sum()))
+        assertEqual(11 + 55, query.run(self.conn))
+
+    def test_open_cursors_of_the_same_shape(self):
+        older = self.people.map(lambda p: p['id'].add(100)).run(self.conn, max_batch_rows=1)
+        newer = self.people.map(lambda p: p['id'].add(200)).run(self.conn, max_batch_rows=1)
+        assertEqual(100, older.next())
+        assertEqual(list(range(200, 211)), list(newer))
+        assertEqual(list(range(101, 111)), list(older))
+
+    def test_arrays_are_not_cursors(self):
+        assertEqual([1, 2], r.expr([1, 2]).run(self.conn))
+
+    def test_errors_in_first_batch_raise_from_run(self):
+        query = self.people.map(lambda p: p['age'].add(1))
+        self.assertRaises(RqlRuntimeError, lambda: query.run(self.conn))
+
+    def test_errors_in_later_batches_raise_when_reached(self):
+        query = self.people.map(lambda p: p['age'].add(1))
+        cursor = query.run(self.conn, max_batch_rows=5)
+        assertEqual(list(range(1, 6)), [cursor.next() for _ in range(0, 5)])
+        self.assertRaises(RqlRuntimeError, lambda: list(cursor))
+
+
+class TestMockThinkReset(TestCase):
+    def setUp(self):
+        self.initial = as_db_and_table('x', 'people', db_insert_starting_data())
+        self.mock = db.MockThink(self.initial)
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+
+    def test_reset_goes_back_to_initial_snapshot(self):
+        initial_db = self.mock.data
+        self.people.insert({'id': 'd'}).run(self.conn)
+        self.mock.reset()
+        self.assertIs(initial_db, self.mock.data)
+        assertEqual(3, self.people.count().run(self.conn))
+
+    def test_reloading_same_data_keeps_snapshot(self):
+        initial_db = self.mock.data
+        self.conn.reset_data(as_db_and_table('x', 'people', db_insert_starting_data()))
+        self.assertIs(initial_db, self.mock.data)
+        self.conn.reset_data(as_db_and_table('x', 'people', []))
+        assertEqual(0, self.people.count().run(self.conn))
+
+    def test_returned_rows_are_copies(self):
+        self.people.get('a').run(self.conn)['name'] = 'changed'
+        list(self.people.run(self.conn))[1]['name'] = 'changed'
+        assertEqual(db_insert_starting_data(), list(self.people.run(self.conn)))
+
+    def test_initial_data_is_copied(self):
+        self.initial['dbs']['x']['tables']['people'][0]['name'] = 'changed'
+        self.mock.reset()
+        assertEqual('a-name', self.people.get('a')['name'].run(self.conn))
+
+    def test_snapshot_and_restore(self):
+        self.people.insert({'id': 'd'}).run(self.conn)
+        snapshot = self.mock.snapshot()
+        self.people.get('a').delete().run(self.conn)
+        self.people.insert({'id': 'e'}).run(self.conn)
+        self.mock.restore(snapshot)
+        assertEqual(['a', 'b', 'c', 'd'], sorted(self.people.map(lambda p: p['id']).run(self.conn)))
+
+    def test_nested_savepoints(self):
+        with self.mock.savepoint():
+            self.people.insert({'id': 'd'}).run(self.conn)
+            with self.mock.savepoint():
+                self.people.delete().run(self.conn)
+                assertEqual(0, self.people.count().run(self.conn))
+            assertEqual(4, self.people.count().run(self.conn))
+        assertEqual(3, self.people.count().run(self.conn))
+
+    def test_savepoint_rolls_back_on_error(self):
+        try:
+            with self.mock.savepoint():
+                r.db('x').table_create('other').run(self.conn)
+                raise ValueError()
+        except ValueError:
+            pass
+        assertEqual(['people'], list(r.db('x').table_list().run(self.conn)))
+
+
+class TestMockThinkProfile(TestCase):
+    def setUp(self):
+        rows = [{'id': i, 'age': i} for i in range(0, 10)]
+        self.conn = db.MockThink(as_db_and_table('x', 'people', rows)).get_conn()
+        self.people = r.db('x').table('people')
+
+    def test_unprofiled_results_are_unchanged(self):
+        assertEqual(3, self.people.filter(lambda p: p['age'] < 3).count().run(self.conn))
+
+    def test_profile_of_value(self):
+        result = self.people.filter(lambda p: p['age'] < 3).count().run(self.conn, profile=True)
+        assertEqual(3, result['value'])
+        count, = result['profile']
+        assertEqual('Evaluating Count1.', count['description'])
+        assertEqual(1, count['calls'])
+        assertEqual(3, count['rows_in'])
+        assertEqual(1, count['rows_out'])
+        filtered, = count['sub_tasks']
+        assertEqual(10, filtered['rows_in'])
+        assertEqual(3, filtered['rows_out'])
+        self.assertTrue(count['duration(ms)'] >= filtered['duration(ms)'] >= 0)
+
+    def test_profile_of_stream(self):
+        result = self.people.map(lambda p: p['age'] * 2).run(self.conn, profile=True, max_batch_rows=2)
+        assertEqual([i * 2 for i in range(0, 10)], sorted(result['value']))
+        mapped, = result['profile']
+        assertEqual(10, mapped['rows_out'])
+        func = [task for task in mapped['sub_tasks'] if task['description'] == 'Evaluating RFunc.']
+        assertEqual(10, func[0]['calls'])
+
+    def test_profile_of_write(self):
+        result = self.people.insert({'id': 'new'}).run(self.conn, profile=True)
+        assertEqual(1, result['value']['inserted'])
+        assertEqual(11, self.people.count().run(self.conn))
+
+
+class TestMockThinkStats(TestCase):
+    def setUp(self):
+        rows = [{'id': i, 'age': i, 'group': i % 3} for i in range(0, 10)]
+        self.mock = db.MockThink(as_db_and_table('x', 'people', rows), collect_stats=True)
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+        self.people.index_create('group').run(self.conn)
+        self.mock.reset_stats()
+
+    def queries(self):
+        return {q['fingerprint'].split('(')[0]: q for q in self.mock.stats()['queries']}
+
+    def test_off_by_default(self):
+        mock = db.MockThink(as_db_and_table('x', 'people', []))
+        self.assertIsNone(mock.stats())
+        self.assertIsNone(mock.data.query_stats)
+
+    def test_stats_go_on_every_snapshot(self):
+        self.people.insert({'id': 'new'}).run(self.conn)
+        self.assertIs(self.mock.query_stats, self.mock.data.query_stats)
+        self.mock.reset()
+        self.assertIs(self.mock.query_stats, self.mock.data.query_stats)
+
+    def test_queries_are_grouped_by_fingerprint(self):
+        self.people.get(1).run(self.conn)
+        self.people.get(2).run(self.conn)
+        get = self.queries()['Get']
+        assertEqual(2, get['count'])
+        assertEqual(2, get['lookups'])
+        assertEqual(0, get['full_scans'])
+        assertEqual(2, get['rows_scanned'])
+
+    def test_fingerprints_are_the_rewrite_cache_keys(self):
+        self.people.get(1).run(self.conn)
+        fingerprint, _ = rql_rewrite.fingerprint_query(self.people.get(1))
+        assertEqual([fingerprint], list(self.mock.query_stats.queries))
+        assertEqual('Get(Table(DB(?), ?), ?)', self.mock.stats()['queries'][0]['fingerprint'])
+
+    def test_full_scans(self):
+        list(self.people.filter(lambda p: p['age'] > 6).run(self.conn, max_batch_rows=1))
+        filtered = self.queries()['Filter']
+        assertEqual(1, filtered['full_scans'])
+        assertEqual(10, filtered['rows_scanned'])
+        assertEqual(3, filtered['rows_returned'])
+        assertEqual({'full_scans': 1, 'lookups': 0, 'rows_scanned': 10}, self.mock.stats()['tables']['x.people'])
+
+    def test_index_lookups(self):
+        assertEqual(4, self.people.get_all(0, index='group').count().run(self.conn))
+        list(self.people.between(2, 5).run(self.conn))
+        self.people.insert({'id': 'new'}).run(self.conn)
+        assertEqual({'full_scans': 0, 'lookups': 2, 'rows_scanned': 7}, self.mock.stats()['tables']['x.people'])
+
+    def test_dump(self):
+        self.people.get(1).run(self.conn)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.mock.query_stats.dump(path)
+            with open(path) as f:
+                assertEqual(self.mock.stats(), json.load(f))
+        finally:
+            os.remove(path)
+
+
+def run_in_threads(count, func):
+    errors = []
+    def target(n):
+        try:
+            func(n)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=target, args=(n,)) for n in range(0, count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class SlowRows(object):
+    """Stands in for `storage.MappedRows`, taking its time to decode."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.decodes = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        self.decodes += 1
+        time.sleep(0.01)
+        return iter(self.rows)
+
+    def get(self, id):
+        return util.find_first(lambda row: row['id'] == id, self.rows)
+
+class SlowFieldIndexFunc(indexes.FieldIndexFunc):
+    def __init__(self, field):
+        super(SlowFieldIndexFunc, self).__init__(field)
+        self.calls = 0
+
+    def __call__(self, row):
+        self.calls += 1
+        time.sleep(0.001)
+        return super(SlowFieldIndexFunc, self).__call__(row)
+
+
+class TestMockThinkThreads(TestCase):
+    def setUp(self):
+        rows = [{'id': i, 'age': i} for i in range(0, 50)]
+        self.mock = db.MockThink(as_db_and_table('x', 'people', rows))
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+
+    def test_concurrent_writes_are_not_lost(self):
+        def insert(n):
+            for i in range(0, 20):
+                self.people.insert({'id': 'thread-%d-%d' % (n, i)}).run(self.conn)
+        run_in_threads(8, insert)
+        assertEqual(50 + 8 * 20, self.people.count().run(self.conn))
+
+    def test_concurrent_updates_are_not_lost(self):
+        self.people.insert({'id': 'counter', 'n': 0}).run(self.conn)
+        def bump(n):
+            for _ in range(0, 25):
+                self.people.get('counter').update({'n': r.row['n'] + 1}).run(self.conn)
+        run_in_threads(8, bump)
+        assertEqual(200, self.people.get('counter')['n'].run(self.conn))
+
+    def test_readers_get_their_own_values(self):
+        def read(n):
+            for _ in range(0, 50):
+                cursor = self.people.filter(lambda p: p['age'] < n).run(self.conn, max_batch_rows=2)
+                assertEqual(n, len(list(cursor)))
+        run_in_threads(8, read)
+
+    def test_tables_loaded_from_a_file(self):
+        self.people.index_create('age').run(self.conn)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'fixture.bin')
+            self.mock.dump(path)
+            for _ in range(0, 3):
+                conn = db.MockThink.from_file(path).get_conn()
+                def read(n):
+                    assertEqual(n, self.people.get(n)['age'].run(conn))
+                    assertEqual(50, self.people.count().run(conn))
+                    assertEqual([n], [p['id'] for p in self.people.get_all(n, index='age').run(conn)])
+                    assertEqual(n, len(list(self.people.between(0, n, index='age').run(conn))))
+                run_in_threads(8, read)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_lazy_rows_and_indexes_are_built_once(self):
+        rows = SlowRows([{'id': i, 'age': i % 5} for i in range(0, 20)])
+        age = SlowFieldIndexFunc('age')
+        table = db.MockTableData('people', None, {'age': {'func': age, 'multi': False}}, mapped_rows=rows)
+        def read(n):
+            assertEqual(20, len(table))
+            assertEqual({'id': n, 'age': n % 5}, table.get_by_id(n))
+            assertEqual(4, len(table.get_all_by_index('age', [n % 5])))
+            assertEqual(4, len(list(table.get_in_index_range('age', 0, 1))))
+        run_in_threads(8, read)
+        assertEqual(1, rows.decodes)
+        assertEqual(20, age.calls)
+
+    def test_query_now_time_is_per_thread(self):
+        then = datetime.datetime(2001, 1, 1, tzinfo=self.mock.tzinfo)
+        seen = []
+        with self.mock.query_now_time(then):
+            run_in_threads(1, lambda n: seen.append(self.mock.get_now_time()))
+            assertEqual(then, self.mock.get_now_time())
+        self.assertNotEqual(then, seen[0])
@@ -1,7 +1,12 @@
 import unittest
 
 from mockthink.test.common import assertEqual
-from ... import joins
+from ... import joins, util
+
+def eq_join(left_field, left, right_field, right):
+    # the way `EqJoin` joins sequences which aren't tables
+    by_val = joins.hash_by_field(right_field, right)
+    return list(joins.iter_eq_join(left_field, left, lambda val: by_val.get(util.index_key(val), [])))
 
 class TestJoins(unittest.TestCase):
     def test_eq_join(self):
@@ -57,9 +62,22 @@ class TestJoins(unittest.TestCase):
         ]
         assertEqual(
             expected,
-            joins.do_eq_join('rel_field', left, 'name', right)
+            eq_join('rel_field', left, 'name', right)
         )
 
+    def test_eq_join_all_matches(self):
+        left = [{'id': 1, 'tag': 'a'}, {'id': 2, 'tag': 'b'}, {'id': 3}]
+        right = [{'id': 'x', 'tag': 'a'}, {'id': 'y', 'tag': 'c'}, {'id': 'z', 'tag': 'a'}]
+        expected = [
+            {'left': {'id': 1, 'tag': 'a'}, 'right': {'id': 'x', 'tag': 'a'}},
+            {'left': {'id': 1, 'tag': 'a'}, 'right': {'id': 'z', 'tag': 'a'}}
+        ]
+        assertEqual(expected, eq_join('tag', left, 'tag', right))
+
+    def test_hash_by_field_skips_nulls(self):
+        right = [{'id': 'x', 'tag': 'a'}, {'id': 'y', 'tag': None}, {'id': 'z'}, {'id': 'w', 'tag': 'a'}]
+        assertEqual({util.index_key('a'): [right[0], right[3]]}, joins.hash_by_field('tag', right))
+
     def test_inner_join(self):
         left = range(1, 5)
         right = range(1, 5)
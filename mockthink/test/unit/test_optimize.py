@@ -0,0 +1,247 @@
+import unittest
+
+import rethinkdb as r
+
+from mockthink.db import MockThink
+from mockthink.test.common import assertEqUnordered, assertEqual
+
+
+def people_data():
+    return {
+        'dbs': {
+            'x': {
+                'tables': {
+                    'people': [
+                        {'id': 'joe', 'email': 'joe@x', 'age': 26, 'owner': 'a'},
+                        {'id': 'bob', 'email': 'bob@x', 'age': 52, 'owner': 'b'},
+                        {'id': 'sam', 'email': None, 'age': 40, 'owner': 'a'},
+                        {'id': 'kim', 'age': 33, 'owner': 'b'}
+                    ]
+                }
+            }
+        }
+    }
+
+
+class TestFilterPushdown(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockThink(people_data())
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+        self.people.index_create('email').run(self.conn)
+        self.people.index_create('age_idx', lambda p: p['age']).run(self.conn)
+
+    def rewrites(self, query):
+        return self.mock.explain(query)['rewrites']
+
+    def ids(self, query):
+        return [doc['id'] for doc in query.run(self.conn)]
+
+    def test_obj_filter_uses_secondary_index(self):
+        query = self.people.filter({'email': 'bob@x'})
+        assertEqual([{'rewrite': 'filter_to_get_all', 'table': 'people', 'index': 'email'}], self.rewrites(query))
+        assertEqual(['bob'], self.ids(query))
+
+    def test_func_filter_uses_primary_key(self):
+        query = self.people.filter(lambda p: 'joe' == p['id'])
+        assertEqual([{'rewrite': 'filter_to_get_all', 'table': 'people', 'index': 'id'}], self.rewrites(query))
+        assertEqual(['joe'], self.ids(query))
+
+    def test_rest_of_predicate_still_applies(self):
+        query = self.people.filter({'email': 'bob@x', 'owner': 'a'})
+        assertEqual(1, len(self.rewrites(query)))
+        assertEqual([], self.ids(query))
+
+    def test_range_on_index_created_by_func(self):
+        query = self.people.filter(lambda p: (p['age'] > 30) & (p['age'] <= 52) & (p['owner'] == 'b'))
+        assertEqual([{'rewrite': 'filter_to_between', 'table': 'people', 'index': 'age_idx'}], self.rewrites(query))
+        assertEqUnordered(['bob', 'kim'], self.ids(query))
+
+    def test_null_falls_back_to_scan(self):
+        query = self.people.filter({'email': None})
+        assertEqual(1, len(self.rewrites(query)))
+        assertEqUnordered(['sam', 'kim'], self.ids(query))
+
+    def test_unindexed_field_is_not_rewritten(self):
+        query = self.people.filter(lambda p: p['owner'] == 'a')
+        assertEqual([], self.rewrites(query))
+        assertEqUnordered(['joe', 'sam'], self.ids(query))
+
+    def test_row_dependent_value_is_not_rewritten(self):
+        query = self.people.filter(lambda p: p['email'] == p['id'])
+        assertEqual([], self.rewrites(query))
+
+    def test_update_through_pushed_down_filter(self):
+        self.people.filter({'email': 'joe@x'}).update({'age': 27}).run(self.conn)
+        assertEqual(27, self.people.get('joe')['age'].run(self.conn))
+
+    def test_cached_plan_is_left_alone(self):
+        query = self.people.filter({'owner': 'a'})
+        assertEqUnordered(['joe', 'sam'], self.ids(query))
+        self.people.index_create('owner').run(self.conn)
+        assertEqual(1, len(self.rewrites(query)))
+        assertEqUnordered(['joe', 'sam'], self.ids(query))
+        self.people.index_drop('owner').run(self.conn)
+        assertEqUnordered(['joe', 'sam'], self.ids(query))
+
+
+class TestTopK(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockThink(people_data())
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+
+    def test_order_by_limit(self):
+        query = self.people.order_by(r.desc('age')).limit(2)
+        assertEqual([{'rewrite': 'order_by_limit_to_top_k'}], self.mock.explain(query)['rewrites'])
+        assertEqual(['bob', 'sam'], [doc['id'] for doc in query.run(self.conn)])
+
+    def test_order_by_func_slice(self):
+        query = self.people.order_by(lambda p: p['age']).slice(1, 3)
+        assertEqual([{'rewrite': 'order_by_limit_to_top_k'}], self.mock.explain(query)['rewrites'])
+        assertEqual(['kim', 'sam'], [doc['id'] for doc in query.run(self.conn)])
+
+    def test_open_ended_slice(self):
+        query = self.people.order_by('age').slice(2)
+        assertEqual(['sam', 'bob'], [doc['id'] for doc in query.run(self.conn)])
+
+
+class TestEquiJoin(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockThink(people_data())
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+
+    def pairs(self, query):
+        return [[pair['left']['id'], pair['right']['id']] for pair in query.run(self.conn)]
+
+    def test_inner_join_on_field(self):
+        query = self.people.inner_join(self.people, lambda a, b: a['owner'] == b['owner'])
+        assertEqual(
+            [{'rewrite': 'equi_join_to_hash_join', 'fields': ['owner', 'owner']}],
+            self.mock.explain(query)['rewrites']
+        )
+        expected = [
+            ['joe', 'joe'], ['joe', 'sam'], ['bob', 'bob'], ['bob', 'kim'],
+            ['sam', 'joe'], ['sam', 'sam'], ['kim', 'bob'], ['kim', 'kim']
+        ]
+        assertEqual(expected, self.pairs(query))
+
+    def test_inner_join_with_residual(self):
+        query = self.people.inner_join(
+            self.people,
+            lambda a, b: (a['age'] < b['age']) & (b['owner'] == a['owner'])
+        )
+        assertEqual(
+            [{'rewrite': 'equi_join_to_hash_join', 'fields': ['owner', 'owner']}],
+            self.mock.explain(query)['rewrites']
+        )
+        assertEqual([['joe', 'sam'], ['kim', 'bob']], self.pairs(query))
+
+    def test_outer_join(self):
+        query = self.people.outer_join(
+            self.people,
+            lambda a, b: (a['owner'] == b['owner']) & (a['age'] > b['age'])
+        )
+        result = [[pair['left']['id'], pair.get('right', {}).get('id')] for pair in query.run(self.conn)]
+        assertEqual([['joe', None], ['bob', 'kim'], ['sam', 'joe'], ['kim', None]], result)
+
+    def test_non_equi_join_is_left_alone(self):
+        query = self.people.inner_join(self.people, lambda a, b: a['age'] > b['age'] + 20)
+        assertEqual([], self.mock.explain(query)['rewrites'])
+        assertEqual([['bob', 'joe']], self.pairs(query))
+
+
+class TestGroupedAggregation(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockThink(people_data())
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+
+    def test_group_count(self):
+        query = self.people.group('owner').count()
+        assertEqual(
+            [{'rewrite': 'group_to_grouped_aggregation', 'aggregate': 'count'}],
+            self.mock.explain(query)['rewrites']
+        )
+        assertEqual({'a': 2, 'b': 2}, query.run(self.conn))
+
+    def falsy_values(self):
+        values = [0, '', False, None, 1]
+        mock = MockThink({'dbs': {'x': {'tables': {'vals': [{'id': i, 'val': v} for i, v in enumerate(values)]}}}})
+        return r.db('x').table('vals'), mock.get_conn()
+
+    def test_group_count_counts_falsy_members(self):
+        query = r.expr([0, '', False, None, 1]).group(lambda val: 'all').count()
+        assertEqual({'all': 5}, query.run(self.conn))
+
+    def test_group_count_by_func_is_reql_truthy(self):
+        vals, conn = self.falsy_values()
+        query = vals.group(lambda doc: 'all').count(lambda doc: doc['val'])
+        assertEqual(
+            [{'rewrite': 'group_to_grouped_aggregation', 'aggregate': 'count_if'}],
+            self.mock.explain(query)['rewrites']
+        )
+        assertEqual({'all': 3}, query.run(conn))
+        assertEqual(3, vals.count(lambda doc: doc['val']).run(conn))
+
+    def test_group_min_of_values(self):
+        query = r.expr([7, 2, 9, 4, 1]).group(lambda n: n > 3).min()
+        assertEqual({True: 4, False: 1}, query.run(self.conn))
+
+
+class TestExplain(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockThink(people_data())
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+        self.people.index_create('email').run(self.conn)
+
+    def test_full_scan(self):
+        explained = self.mock.explain(self.people.filter({'age': 26}))
+        assertEqual(['filter', 'full_scan'], explained['strategies'])
+        filtered = explained['plan']
+        assertEqual('FilterWithObj', filtered['term'])
+        table = filtered['children'][0]
+        assertEqual({'strategy': 'full_scan', 'table': 'people', 'estimated_rows': 4},
+                    {k: table[k] for k in ('strategy', 'table', 'estimated_rows')})
+
+    def test_index_lookup(self):
+        explained = self.mock.explain(self.people.filter({'email': 'joe@x'}))
+        assertEqual(['filter_on_lookup', 'filter', 'index_lookup'], explained['strategies'])
+        self.assertNotIn('full_scan', explained['strategies'])
+
+    def test_primary_lookups(self):
+        assertEqual(['primary_lookup'], self.mock.explain(self.people.get('joe'))['strategies'])
+        assertEqual(
+            ['primary_lookup_join', 'full_scan'],
+            self.mock.explain(self.people.eq_join('owner', self.people))['strategies']
+        )
+
+    def test_top_k_and_hash_join(self):
+        query = self.people.order_by('age').limit(2)
+        assertEqual(['top_k', 'full_scan'], self.mock.explain(query)['strategies'])
+        assertEqual(2, self.mock.explain(query)['plan']['estimated_rows'])
+        query = self.people.inner_join(self.people, lambda a, b: a['owner'] == b['id'])
+        assertEqual(['hash_join', 'full_scan', 'full_scan'], self.mock.explain(query)['strategies'])
+
+    def test_query(self):
+        assertEqual(
+            "GetAll(RTable(RDb('x'), 'people'), MakeArray('joe@x'), index='email')",
+            self.mock.explain(self.people.get_all('joe@x', index='email'))['query']
+        )
+        assertEqual(
+            "OrderByKeysTopK(RTable(RDb('x'), 'people'), MakeArray(Asc('age')), MakeArray(0, 2))",
+            self.mock.explain(self.people.order_by('age').limit(2))['query']
+        )
+
+    def test_analyze(self):
+        explained = self.mock.explain(self.people.filter(lambda p: p['age'] > 30), analyze=True)
+        filtered = explained['plan']
+        assertEqual(3, filtered['actual_rows'])
+        assertEqual(4, filtered['children'][0]['actual_rows'])
+        self.assertNotIn('actual_rows', self.mock.explain(self.people)['plan'])
+
+    def test_analyze_throws_writes_away(self):
+        self.mock.explain(self.people.get('joe').delete(), analyze=True)
+        assertEqual(4, self.people.count().run(self.conn))
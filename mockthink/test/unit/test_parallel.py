@@ -0,0 +1,44 @@
+import unittest
+
+import rethinkdb as r
+from rethinkdb import RqlRuntimeError
+
+from mockthink.db import MockThink
+from mockthink.test.common import as_db_and_table, assertEqual
+
+
+class TestSharded(unittest.TestCase):
+    def setUp(self):
+        rows = [{'id': i, 'n': i % 7, 'tags': ['t%d' % (i % 3)]} for i in range(0, 200)]
+        self.mock = MockThink(as_db_and_table('x', 'things', rows), workers=2, parallel_min_rows=50)
+        self.conn = self.mock.get_conn()
+        self.plain_conn = MockThink(as_db_and_table('x', 'things', rows)).get_conn()
+        self.things = r.db('x').table('things')
+
+    def tearDown(self):
+        self.mock.close()
+
+    def assert_same(self, query):
+        assertEqual(list(query.run(self.plain_conn)), list(query.run(self.conn)))
+
+    def test_map_filter_chain(self):
+        query = self.things.map(lambda t: t['n'] * 10 + t['id']).filter(lambda v: v % 3 == 0)
+        assertEqual(
+            [{'rewrite': 'shard_over_workers', 'workers': 2}],
+            self.mock.explain(query)['rewrites']
+        )
+        self.assert_same(query)
+
+    def test_concat_map(self):
+        self.assert_same(self.things.concat_map(lambda t: t['tags']))
+
+    def test_with_outer_scope(self):
+        self.assert_same(r.expr(5).do(lambda k: self.things.map(lambda t: t['n'] + k)))
+
+    def test_funcs_using_the_db_are_not_sharded(self):
+        query = self.things.map(lambda t: self.things.get(t['id'])['n'])
+        assertEqual([], self.mock.explain(query)['rewrites'])
+
+    def test_errors_come_back(self):
+        query = self.things.map(lambda t: t['missing'])
+        self.assertRaises(RqlRuntimeError, lambda: list(query.run(self.conn)))
@@ -0,0 +1,134 @@
+import random
+import unittest
+from collections import OrderedDict
+
+from mockthink.test.common import assertEqual
+from ...persistent import PVector, PHashMap, OrderedPMap, PSortedList
+
+
+class TestPVector(unittest.TestCase):
+    def test_from_iterable(self):
+        items = list(range(0, 5000))
+        vec = PVector.from_iterable(items)
+        assertEqual(5000, len(vec))
+        assertEqual(items, list(vec))
+        assertEqual(1234, vec[1234])
+        assertEqual(4999, vec[-1])
+
+    def test_set_many_leaves_original_alone(self):
+        vec = PVector.from_iterable(range(0, 100))
+        updated = vec.set_many({3: 'three', 99: 'ninety-nine', 100: 'hundred'})
+        assertEqual(3, vec[3])
+        assertEqual(100, len(vec))
+        assertEqual('three', updated[3])
+        assertEqual('ninety-nine', updated[99])
+        assertEqual('hundred', updated[100])
+        assertEqual(101, len(updated))
+
+    def test_append_grows_trie(self):
+        vec = PVector()
+        expected = []
+        for i in range(0, 2000):
+            vec = vec.append(i)
+            expected.append(i)
+        assertEqual(expected, list(vec))
+        assertEqual(1500, vec[1500])
+
+    def test_index_error(self):
+        vec = PVector.from_iterable([1, 2])
+        self.assertRaises(IndexError, lambda: vec[2])
+
+
+class TestPHashMap(unittest.TestCase):
+    def test_update(self):
+        pmap = PHashMap.from_items([('a', 1), ('b', 2)])
+        updated = pmap.update([('c', 3), ('a', 10)], removed=['b'])
+        assertEqual(2, len(pmap))
+        assertEqual(2, pmap.get('b'))
+        assertEqual(2, len(updated))
+        assertEqual(10, updated.get('a'))
+        assertEqual(3, updated.get('c'))
+        assertEqual(False, 'b' in updated)
+        assertEqual({'a': 10, 'c': 3}, dict(updated.iteritems()))
+
+    def test_grows(self):
+        pmap = PHashMap()
+        for i in range(0, 1000):
+            pmap = pmap.update([(i, str(i))])
+        assertEqual(1000, len(pmap))
+        assertEqual('777', pmap.get(777))
+        assertEqual(None, pmap.get(1000))
+
+
+class TestOrderedPMap(unittest.TestCase):
+    def test_keeps_insertion_order(self):
+        pmap = OrderedPMap.from_items([('a', 1), ('b', 2), ('c', 3)])
+        updated = pmap.update([('b', 20), ('d', 4)], removed=['a'])
+        assertEqual([('a', 1), ('b', 2), ('c', 3)], list(pmap.iteritems()))
+        assertEqual([('b', 20), ('c', 3), ('d', 4)], list(updated.iteritems()))
+        assertEqual(3, len(updated))
+        assertEqual(4, updated.nth_value(2))
+        assertEqual(4, updated.nth_value(-1))
+
+    def test_remove_then_add_in_one_update(self):
+        pmap = OrderedPMap.from_items([('a', 1), ('b', 2)])
+        updated = pmap.update([('a', 10)], removed=['a'])
+        assertEqual([('b', 2), ('a', 10)], list(updated.iteritems()))
+
+    def test_matches_ordered_dict(self):
+        rand = random.Random(1234)
+        expected = OrderedDict()
+        pmap = OrderedPMap()
+        snapshots = []
+        for _ in range(0, 300):
+            items = [(rand.randint(0, 400), rand.random()) for _ in range(0, rand.randint(0, 10))]
+            removed = set(rand.randint(0, 400) for _ in range(0, rand.randint(0, 10)))
+            for key in removed:
+                expected.pop(key, None)
+            for key, val in items:
+                expected[key] = val
+            pmap = pmap.update(items, removed=removed)
+            snapshots.append((list(expected.items()), pmap))
+        for expected_items, snapshot in snapshots:
+            assertEqual(expected_items, list(snapshot.iteritems()))
+            assertEqual(len(expected_items), len(snapshot))
+            for key, val in expected_items:
+                assertEqual(val, snapshot.get(key))
+
+
+class TestPSortedList(unittest.TestCase):
+    def test_irange(self):
+        slist = PSortedList.from_iterable([5, 1, 4, 2, 3])
+        assertEqual([1, 2, 3, 4, 5], list(slist))
+        assertEqual([2, 3], list(slist.irange(2, 4)))
+        assertEqual([3, 2], list(slist.irange(2, 4, reverse=True)))
+        assertEqual([4, 5], list(slist.irange(4)))
+        assertEqual([1, 2], list(slist.irange(None, 3)))
+        assertEqual([], list(slist.irange(6)))
+
+    def test_update_leaves_original_alone(self):
+        slist = PSortedList.from_iterable([1, 3, 5])
+        updated = slist.update(added=[4, 0], removed=[3, 7])
+        assertEqual([1, 3, 5], list(slist))
+        assertEqual([0, 1, 4, 5], list(updated))
+        assertEqual(4, len(updated))
+
+    def test_matches_sorted_list(self):
+        rand = random.Random(4321)
+        expected = []
+        slist = PSortedList()
+        for _ in range(0, 200):
+            added = [rand.randint(0, 5000) for _ in range(0, rand.randint(0, 40))]
+            removed = rand.sample(expected, min(len(expected), rand.randint(0, 10)))
+            for val in removed:
+                expected.remove(val)
+            expected.extend(added)
+            expected.sort()
+            slist = slist.update(added, removed)
+        assertEqual(expected, list(slist))
+        assertEqual(len(expected), len(slist))
+        assertEqual([v for v in expected if 1000 <= v < 2000], list(slist.irange(1000, 2000)))
+        assertEqual(
+            [v for v in reversed(expected) if 1000 <= v < 2000],
+            list(slist.irange(1000, 2000, reverse=True))
+        )
@@ -0,0 +1,84 @@
+import unittest
+
+import rethinkdb as r
+
+from mockthink import rql_rewrite
+from mockthink.db import MockThink
+from mockthink.test.common import assertEqual
+
+
+class TestFingerprintQuery(unittest.TestCase):
+    def test_ignores_datum_values(self):
+        fp1, datums1 = rql_rewrite.fingerprint_query(r.db('x').table('people').get('joe'))
+        fp2, datums2 = rql_rewrite.fingerprint_query(r.db('x').table('people').get('bob'))
+        assertEqual(fp1, fp2)
+        assertEqual(['x', 'people', 'joe'], [d.data for d in datums1])
+        assertEqual(['x', 'people', 'bob'], [d.data for d in datums2])
+
+    def test_canonicalizes_var_ids(self):
+        fp1, _ = rql_rewrite.fingerprint_query(r.expr([1, 2]).map(lambda x: x.add(1)))
+        fp2, _ = rql_rewrite.fingerprint_query(r.expr([3, 4]).map(lambda y: y.add(5)))
+        assertEqual(fp1, fp2)
+
+    def test_optargs_are_structural(self):
+        fp1, _ = rql_rewrite.fingerprint_query(r.db('x').table('people').get_all(1, index='a'))
+        fp2, _ = rql_rewrite.fingerprint_query(r.db('x').table('people').get_all(1, index='b'))
+        assertEqual(False, fp1 == fp2)
+
+
+class TestRewriteCache(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockThink({
+            'dbs': {
+                'x': {
+                    'tables': {
+                        'people': [
+                            {'id': 'joe', 'age': 26},
+                            {'id': 'bob', 'age': 52}
+                        ]
+                    }
+                }
+            }
+        })
+        self.conn = self.mock.get_conn()
+
+    def test_reuses_plan_with_new_datums(self):
+        table = r.db('x').table('people')
+        assertEqual(26, table.get('joe')['age'].run(self.conn))
+        assertEqual(52, table.get('bob')['age'].run(self.conn))
+        assertEqual(1, len(self.mock.rewrite_cache.plans))
+
+    def test_reuses_plan_across_lambdas(self):
+        table = r.db('x').table('people')
+        result1 = table.filter(lambda p: p['age'] > 30).map(lambda p: p['id']).run(self.conn)
+        result2 = table.filter(lambda q: q['age'] > 10).map(lambda q: q['id']).run(self.conn)
+        assertEqual(['bob'], list(result1))
+        assertEqual(['joe', 'bob'], list(result2))
+        assertEqual(1, len(self.mock.rewrite_cache.plans))
+
+    def test_evicts_least_recently_used(self):
+        cache = rql_rewrite.RewriteCache(max_size=2)
+        cache.rewrite(r.expr(1))
+        cache.rewrite(r.expr([1]))
+        cache.rewrite(r.expr(1).add(1))
+        assertEqual(2, len(cache.plans))
+
+    def test_disabled(self):
+        cache = rql_rewrite.RewriteCache(max_size=0)
+        cache.rewrite(r.expr(1))
+        assertEqual(0, len(cache.plans))
+
+    def test_open_cursors_keep_their_own_datums(self):
+        mock = MockThink({'dbs': {'x': {'tables': {'nums': [{'id': n} for n in range(0, 10)]}}}})
+        conn = mock.get_conn()
+        table = r.db('x').table('nums')
+        older = table.map(lambda doc: doc['id'] + 100).run(conn, max_batch_rows=1)
+        newer = table.map(lambda doc: doc['id'] + 200).run(conn, max_batch_rows=1)
+        assertEqual(list(range(100, 110)), list(older))
+        assertEqual(list(range(200, 210)), list(newer))
+        assertEqual(1, len(mock.rewrite_cache.plans))
+
+    def test_leaves_the_query_alone(self):
+        query = r.db('x').table('people').get('joe')
+        self.mock.rewrite_cache.rewrite(query)
+        assertEqual('joe', query.args[1].data)
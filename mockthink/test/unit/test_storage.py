@@ -0,0 +1,146 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import rethinkdb as r
+
+from mockthink import storage
+from mockthink.db import MockThink
+from mockthink.test.common import assertEqual, assertEqUnordered
+
+
+def fixture_data():
+    return {
+        'dbs': {
+            'x': {
+                'tables': {
+                    'people': [
+                        {'id': 'joe', 'age': 26, 'pets': ['rex'], 'address': {'city': 'Paris'}},
+                        {'id': 'bob', 'age': 52, 'pets': [], 'address': None},
+                        {'id': 3, 'age': 40, 'name': u'J\xf6rg'}
+                    ],
+                    'empty': []
+                }
+            },
+            'y': {
+                'tables': {}
+            }
+        }
+    }
+
+
+class TestFixtureFiles(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'fixture.bin')
+        self.mock = MockThink(fixture_data())
+        self.conn = self.mock.get_conn()
+        self.people = r.db('x').table('people')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def load(self):
+        mock = MockThink.from_file(self.path)
+        return mock, mock.get_conn()
+
+    def test_round_trip(self):
+        self.mock.dump(self.path)
+        _, conn = self.load()
+        assertEqual(list(self.people.run(self.conn)), list(self.people.run(conn)))
+        assertEqual([], list(r.db('x').table('empty').run(conn)))
+        assertEqUnordered(['x', 'y'], list(r.db_list().run(conn)))
+
+    def test_indexes_and_times(self):
+        self.people.index_create('age').run(self.conn)
+        self.people.index_create('city', lambda p: p['address']['city']).run(self.conn)
+        self.people.get('joe').update({'born': r.time(1990, 5, 17, 'Z')}).run(self.conn)
+        self.mock.dump(self.path)
+        _, conn = self.load()
+        assertEqual(['bob'], [p['id'] for p in self.people.get_all(52, index='age').run(conn)])
+        assertEqual(['joe'], [p['id'] for p in self.people.get_all('Paris', index='city').run(conn)])
+        assertEqual(1990, self.people.get('joe')['born'].year().run(conn))
+
+    def test_function_indexes_are_stored_as_terms(self):
+        self.people.index_create('tags', lambda p: p['pets'].map(lambda pet: r.expr({'$term$': pet})), multi=True).run(self.conn)
+        spec = self.mock.data.get_db('x').get_table('people').indexes['tags']
+        encoded = storage.encode_index_spec('tags', spec)
+        assertEqual('RFunc', encoded['func']['term'])
+        self.mock.dump(self.path)
+        _, conn = self.load()
+        assertEqual(['joe'], [p['id'] for p in self.people.get_all({'$term$': 'rex'}, index='tags').run(conn)])
+
+    def test_unknown_terms_are_refused(self):
+        encoded = {'term': 'RFunc', 'attrs': {'body': ['term', {'term': 'MockThink', 'attrs': {}}]}}
+        self.assertRaises(ValueError, lambda: storage.decode_term(encoded))
+        self.assertRaises(ValueError, lambda: storage.decode_attr(['pickle', 'cos\nsystem\n']))
+
+    def test_rows_are_decoded_lazily(self):
+        self.mock.dump(self.path)
+        mock, conn = self.load()
+        table = mock.data.get_db('x').get_table('people')
+        assertEqual(26, self.people.get('joe')['age'].run(conn))
+        assertEqual(3, self.people.count().run(conn))
+        self.assertIsNone(table._rows_by_id)
+        assertEqual(2, self.people.filter(lambda p: p['age'] > 30).count().run(conn))
+        self.assertIsNotNone(table._rows_by_id)
+
+    def test_writes_and_reset(self):
+        self.mock.dump(self.path)
+        mock, conn = self.load()
+        self.people.insert({'id': 'kim'}).run(conn)
+        self.people.get(3).delete().run(conn)
+        assertEqual(3, self.people.count().run(conn))
+        mock.reset()
+        assertEqual(3, self.people.count().run(conn))
+        assertEqual(40, self.people.get(3)['age'].run(conn))
+
+    def test_dump_over_loaded_file(self):
+        self.mock.dump(self.path)
+        mock, conn = self.load()
+        self.people.insert({'id': 'kim'}).run(conn)
+        mock.dump(self.path)
+        mock.reset()
+        assertEqual(3, self.people.count().run(conn))
+        _, conn = self.load()
+        assertEqual(4, self.people.count().run(conn))
+
+    def test_not_a_fixture(self):
+        with open(self.path, 'wb') as out:
+            out.write(b'{"dbs": {}}' + b'\0' * 16)
+        self.assertRaises(ValueError, self.load)
+
+
+class TestNdjson(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockThink(fixture_data())
+        self.conn = self.mock.get_conn()
+
+    def test_load_into_new_table(self):
+        lines = u'{"id": 1, "name": "a"}\n\n{"name": "b"}\n{"id": 3, "tags": ["x"]}\n'
+        report = self.mock.load_ndjson('z', 'things', io.StringIO(lines))
+        assertEqual({'inserted': 3, 'replaced': 0, 'errors': 0}, report)
+        rows = list(r.db('z').table('things').run(self.conn))
+        assertEqual([1, 3], [row['id'] for row in rows if row['id'] in (1, 3)])
+        assertEqual(['a', 'b', None], [row.get('name') for row in rows])
+
+    def test_load_conflicts(self):
+        lines = b'{"id": "joe", "age": 27}\n{"id": "kim"}\n'
+        report = self.mock.load_ndjson('x', 'people', io.BytesIO(lines))
+        assertEqual({'inserted': 1, 'replaced': 0, 'errors': 1}, report)
+        report = self.mock.load_ndjson('x', 'people', io.BytesIO(lines), conflict='update')
+        assertEqual({'inserted': 0, 'replaced': 2, 'errors': 0}, report)
+        assertEqual(27, r.db('x').table('people').get('joe')['age'].run(self.conn))
+
+    def test_export_round_trip(self):
+        r.db('x').table('people').get('joe').update({'born': r.time(1990, 5, 17, 'Z')}).run(self.conn)
+        out = io.StringIO()
+        self.mock.export_ndjson('x', 'people', out)
+        assertEqual(3, len(out.getvalue().splitlines()))
+        self.mock.load_ndjson('copy', 'people', io.StringIO(out.getvalue()))
+        assertEqual(
+            list(r.db('x').table('people').run(self.conn)),
+            list(r.db('copy').table('people').run(self.conn))
+        )
@@ -6,6 +6,7 @@ if PY2:
     import mock
 else:
     from unittest import mock
+import random
 import unittest
 from pprint import pprint
 from ... import util
@@ -290,6 +291,22 @@ class TestUtil(unittest.TestCase):
         for index in range(0, len(expected)):
             assertEqual(expected[index], result[index])
 
+    def test_sort_by_many_4_keys_mixed(self):
+        rows = [
+            {'a': 1, 'b': 'x', 'c': 2, 'd': 0},
+            {'a': 1, 'b': 'x', 'c': 2, 'd': 1},
+            {'a': 1, 'b': 'y', 'c': 1, 'd': 0},
+            {'a': 0, 'b': 'x', 'c': 3, 'd': 5},
+            {'a': 1, 'b': 'x', 'c': 5, 'd': 9}
+        ]
+        result = util.sort_by_many([('a', 'DESC'), ('b', 'ASC'), ('c', 'DESC'), ('d', 'DESC')], rows)
+        assertEqual([rows[4], rows[1], rows[0], rows[2], rows[3]], result)
+
+    def test_sort_by_many_across_types(self):
+        rows = [{'v': 'str'}, {'v': 3}, {'v': None}, {'v': True}, {}, {'v': [0]}]
+        result = util.sort_by_many([('v', 'ASC')], rows)
+        assertEqual([{'v': [0]}, {'v': True}, {'v': None}, {}, {'v': 3}, {'v': 'str'}], result)
+
     def test_min_mapped(self):
         sequence = [
             {'val': 5},
@@ -369,3 +386,96 @@ class TestDictableSet(unittest.TestCase):
         foo = util.DictableSet([get_doc()])
         self.assertTrue(foo.has(get_doc()))
         self.assertTrue(foo.has({'x': [10, 5]}))
+
+
+class TestRqlSortKey(unittest.TestCase):
+    def test_orders_across_types(self):
+        values = ['a', 5, None, {'x': 1}, [1], True, 2.5, util.MAXVAL, util.MINVAL]
+        expected = [util.MINVAL, [1], True, None, 2.5, 5, {'x': 1}, 'a', util.MAXVAL]
+        assertEqual(expected, sorted(values, key=util.rql_sort_key))
+
+    def test_arrays_compare_elementwise(self):
+        values = [[2], [1, 'b'], [1, 5], []]
+        expected = [[], [1, 5], [1, 'b'], [2]]
+        assertEqual(expected, sorted(values, key=util.rql_sort_key))
+
+
+class TestStream(unittest.TestCase):
+    def counting(self, n, pulled):
+        for i in range(0, n):
+            pulled.append(i)
+            yield i
+
+    def test_pulls_only_what_it_needs(self):
+        pulled = []
+        stream = util.Stream(self.counting(100, pulled))
+        assertEqual(3, stream[3])
+        assertEqual(4, len(pulled))
+        assertEqual([0, 1], stream[0:2])
+        assertEqual(4, len(pulled))
+
+    def test_iterates_more_than_once(self):
+        stream = util.Stream(self.counting(5, []))
+        assertEqual([0, 1, 2, 3, 4], list(stream))
+        assertEqual([0, 1, 2, 3, 4], list(stream))
+        assertEqual(5, len(stream))
+        assertEqual(4, stream[-1])
+
+    def test_take_and_drop_are_lazy(self):
+        pulled = []
+        stream = util.Stream(self.counting(100, pulled))
+        taken = util.take(3, util.drop(2, stream))
+        assertEqual(0, len(pulled))
+        assertEqual([2, 3, 4], list(taken))
+        assertEqual(5, len(pulled))
+
+    def test_iter_once_remembers_nothing(self):
+        stream = util.Stream(self.counting(5, []))
+        assertEqual(0, stream[0])
+        source = util.iter_once(stream)
+        assertEqual([0, 1, 2, 3, 4], list(source))
+        self.assertRaises(RuntimeError, lambda: list(stream))
+
+    def test_chains_remember_nothing(self):
+        stream = util.Stream(self.counting(5, []))
+        mapped = util.maybe_map(lambda x: x * 2, util.drop(1, stream))
+        assertEqual([2, 4, 6, 8], list(util.iter_once(mapped)))
+        assertEqual(None, stream.seen)
+
+    def test_shared_streams_are_remembered(self):
+        stream = util.Stream(self.counting(5, []))
+        stream.shared = True
+        assertEqual([0, 1, 2, 3, 4], list(util.iter_once(stream)))
+        assertEqual([0, 1, 2, 3, 4], list(stream))
+
+    def test_arrays_stay_arrays(self):
+        assertEqual([2, 3], util.take(2, [2, 3, 4]))
+        assertEqual('bc', util.slice_with(1, 3, 'abcd'))
+        assertEqual([4], util.maybe_filter(lambda x: x > 3, [2, 3, 4]))
+
+
+class TestTopK(unittest.TestCase):
+    def test_matches_full_sort(self):
+        rand = random.Random(99)
+        docs = [{'id': i, 'a': rand.randint(0, 5), 'b': rand.randint(0, 5)} for i in range(0, 300)]
+        for keys in ([('a', 'ASC')], [('a', 'DESC')], [('a', 'ASC'), ('b', 'DESC')], [('a', 'DESC'), ('b', 'DESC')]):
+            key, reverse = util.order_by_key(keys)
+            assertEqual(util.sort_by_many(keys, docs)[0:25], util.top_k(25, key, reverse, docs))
+
+    def test_matches_full_sort_across_types(self):
+        rand = random.Random(7)
+        values = [0, 1, 2.5, -1, True, False, None, 'a', '', [1], [0, 'x'], {'a': 1}]
+        docs = [
+            dict({'id': i, 'b': rand.choice(values)}, **({'a': rand.choice(values)} if i % 5 else {}))
+            for i in range(0, 200)
+        ]
+        for keys in ([('a', 'ASC')], [('a', 'DESC')], [('a', 'ASC'), ('b', 'DESC')], [('b', 'DESC'), ('a', 'DESC')]):
+            key, reverse = util.order_by_key(keys)
+            assertEqual(util.sort_by_many(keys, docs)[0:25], util.top_k(25, key, reverse, docs))
+        func = lambda doc: doc['b']
+        assertEqual(util.sort_by_func(func, docs)[0:25], util.top_k(25, util.func_sort_key(func), False, docs))
+
+    def test_orders_across_types(self):
+        docs = [{'x': 'a'}, {'x': 2}, {'x': None}, {'x': [1]}]
+        key, reverse = util.order_by_key([('x', 'ASC')])
+        assertEqual([{'x': [1]}, {'x': None}], util.top_k(2, key, reverse, docs))
@@ -1,8 +1,13 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import datetime
+import heapq
+import itertools
+import numbers
 from collections import defaultdict
 
-from future.utils import iteritems, old_div
+from future.utils import iteritems, old_div, text_type
+from past.builtins import basestring
 
 
 def curry2(func):
@@ -38,6 +43,16 @@ def clone(x):
     else:
         return x
 
+def deep_clone(x):
+    # this runs on every row handed back to a caller, hence the inlined checks for leaf values.
+    if isinstance(x, dict):
+        return {k: v if type(v) not in CLONED_TYPES else deep_clone(v) for k, v in x.items()}
+    elif isinstance(x, list):
+        return [v if type(v) not in CLONED_TYPES else deep_clone(v) for v in x]
+    return x
+
+CLONED_TYPES = frozenset([dict, list])
+
 def deep_extend_pair(dict1, dict2):
     out = {}
     out.update(dict1)
@@ -100,7 +115,7 @@ def maybe_map(fn, thing):
     if isinstance(thing, dict):
         return fn(thing)
     elif is_iterable(thing):
-        return list(map(fn, thing))
+        return stream_or_list(thing, (fn(elem) for elem in iter_once(thing)))
     else:
         return fn(thing)
 
@@ -109,7 +124,7 @@ def maybe_filter(fn, thing):
     if isinstance(thing, dict):
         return fn(thing)
     elif is_iterable(thing):
-        return list(filter(fn, thing))
+        return stream_or_list(thing, (elem for elem in iter_once(thing) if fn(elem)))
     else:
         return fn(thing)
 
@@ -152,7 +167,9 @@ def match_attr_multi(key, good_vals, thing):
 
 
 def ensure_list(x):
-    if not isinstance(x, list):
+    if isinstance(x, Stream):
+        x = list(x)
+    elif not isinstance(x, list):
         x = [x]
     return x
 
@@ -210,16 +227,131 @@ def obj_clone(a_dict):
 def is_iterable(x):
     return hasattr(x, '__iter__')
 
+class Stream(object):
+    """A lazily evaluated sequence.
+
+    Elements are pulled from `iterable` only as they're needed, and remembered,
+    so a stream can be iterated more than once and indexed like a list.  Callers
+    which read a stream just once, to the end, use `iter_once` instead, which
+    doesn't remember anything.
+    """
+    def __init__(self, iterable):
+        self.source = iter(iterable)
+        self.seen = []
+        #   Set for streams which are bound to a variable, and so may be read more than once.
+        self.shared = False
+
+    def iter_once(self):
+        """Iterate over the stream for the last time, without remembering elements."""
+        if self.shared:
+            return iter(self)
+        self.check_unspent()
+        seen, source = self.seen, self.source
+        self.seen, self.source = None, None
+        if source is None:
+            return iter(seen)
+        return itertools.chain(seen, source)
+
+    def check_unspent(self):
+        if self.seen is None:
+            raise RuntimeError('Stream has already been read by `iter_once`.')
+
+    def fill(self, count=None):
+        self.check_unspent()
+        seen = self.seen
+        if self.source is None or (count is not None and len(seen) >= count):
+            return
+        if count is None:
+            seen.extend(self.source)
+        else:
+            seen.extend(itertools.islice(self.source, count - len(seen)))
+            if len(seen) >= count:
+                return
+        self.source = None
+
+    def __iter__(self):
+        self.check_unspent()
+        seen = self.seen
+        index = 0
+        while True:
+            while index < len(seen):
+                yield seen[index]
+                index += 1
+            if self.source is None:
+                return
+            for elem in self.source:
+                seen.append(elem)
+                index += 1
+                yield elem
+                if index != len(seen):
+                    # someone else pulled from the source in the meantime
+                    break
+            else:
+                self.source = None
+
+    def __len__(self):
+        self.fill()
+        return len(self.seen)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.start, index.stop, index.step
+            if stop is not None and stop >= 0 and (start is None or start >= 0) and (step is None or step > 0):
+                self.fill(stop)
+            else:
+                self.fill()
+        elif index >= 0:
+            self.fill(index + 1)
+        else:
+            self.fill()
+        return self.seen[index]
+
+    def __repr__(self):
+        if self.seen is None:
+            return '<Stream spent>'
+        return '<Stream seen=%d done=%s>' % (len(self.seen), self.source is None)
+
+def is_stream(x):
+    # tables, `Stream`s and other iterators, as opposed to arrays and strings
+    return is_iterable(x) and not isinstance(x, (list, tuple, dict, basestring))
+
+def iter_once(sequence):
+    """Iterate over a sequence which the caller reads only once, to the end."""
+    if isinstance(sequence, Stream):
+        return sequence.iter_once()
+    return iter(sequence)
+
+def stream_or_list(sequence, iterable):
+    if is_stream(sequence):
+        return Stream(iterable)
+    return list(iterable)
+
+def materialize(x):
+    if isinstance(x, Stream):
+        return list(x)
+    return x
+
+def is_empty(sequence):
+    for _ in sequence:
+        return False
+    return True
+
 @curry2
 def drop(n, a_list):
+    if is_stream(a_list) and n >= 0:
+        return Stream(itertools.islice(iter_once(a_list), n, None))
     return a_list[n:]
 
 @curry2
 def take(n, a_list):
+    if is_stream(a_list) and n >= 0:
+        return Stream(itertools.islice(iter_once(a_list), 0, n))
     return a_list[0:n]
 
 @curry3
 def slice_with(start, end, a_list):
+    if is_stream(a_list) and start >= 0 and (end is None or end >= 0):
+        return Stream(itertools.islice(iter_once(a_list), start, end))
     return a_list[start:end]
 
 @curry2
@@ -250,6 +382,10 @@ def group_by_func(func, sequence):
 def is_num(x):
     return isinstance(x, int) or isinstance(x, float)
 
+def is_truthy(x):
+    # in ReQL, everything but `false` and `null` is true
+    return x is not None and x is not False
+
 def safe_sum(nums):
     return sum(filter(is_num, nums))
 
@@ -287,33 +423,96 @@ def sort_by_one(sort_key, sequence, reverse=False):
     out.sort(**kwargs)
     return out
 
+def field_values(field, docs):
+    return [doc.get(field) if isinstance(doc, dict) else getter(field, doc) for doc in docs]
+
+def sort_column(values, descending):
+    # Sort keys for one field's values.  If they're all numbers or all strings, they
+    # sort the same as their `rql_sort_key`s, and can be used as they are.
+    types = set(map(type, values))
+    if types <= set([int, float]):
+        return [-val for val in values] if descending else values
+    elif types != set([text_type]):
+        values = [rql_sort_key(val) for val in values]
+    return [Descending(val) for val in values] if descending else values
+
 def sort_by_many(keys_and_dirs, sequence):
     # keys_and_dirs is a list of tuples and orders:
     # [('name', 'ASC'), ('weight', 'DESC')]
-
-    # this probably isn't all that efficient, but
-    # we can figure that out later.
-    key_for_pass = keys_and_dirs[0]
-    current_pass = sort_by_one(key_for_pass[0], sequence, reverse=(key_for_pass[1] == 'DESC'))
-    if len(keys_and_dirs) == 1:
-        return current_pass
-    else:
-        result = []
-        chunk = []
-        current_key = None
-        def handle_chunk():
-            result.extend(sort_by_many(keys_and_dirs[1:], chunk))
-        for elem in current_pass:
-            next_key = getter(key_for_pass[0], elem)
-            if next_key != current_key:
-                if chunk:
-                    handle_chunk()
-                chunk = [elem]
-            else:
-                chunk.append(elem)
-            current_key = next_key
-        handle_chunk()
-        return result
+    #
+    # Every doc's sort key is worked out up front, a field at a time, then the docs
+    # are sorted once.  Mixed directions are handled by negating or wrapping the sort
+    # keys of descending fields; otherwise the sort is just reversed if they're all descending.
+    docs = list(sequence)
+    if not keys_and_dirs:
+        return docs
+    descending = [direction == 'DESC' for _, direction in keys_and_dirs]
+    reverse = all(descending)
+    mixed = any(descending) and not reverse
+    columns = [
+        sort_column(field_values(field, docs), mixed and desc)
+        for (field, _), desc in zip(keys_and_dirs, descending)
+    ]
+    keys = columns[0] if len(columns) == 1 else list(zip(*columns))
+    order = sorted(range(0, len(docs)), key=keys.__getitem__, reverse=reverse)
+    return [docs[index] for index in order]
+
+def func_sort_key(func):
+    return lambda doc: rql_sort_key(func(doc))
+
+def sort_by_func(func, sequence):
+    return sorted(sequence, key=func_sort_key(func))
+
+class Descending(object):
+    # wraps a sort key to reverse its order within a composite key
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return self.key != other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __gt__(self, other):
+        return other.key > self.key
+
+def order_by_key(keys_and_dirs):
+    """Return `(key, reverse)` for sorting docs by `keys_and_dirs` in RethinkDB's order.
+
+    `keys_and_dirs` is as for `sort_by_many`, and docs sort the same way as they do there.
+    """
+    fields = [field for field, _ in keys_and_dirs]
+    descending = [direction == 'DESC' for _, direction in keys_and_dirs]
+    if len(fields) == 1:
+        field = fields[0]
+        def key(doc):
+            if isinstance(doc, dict):
+                return rql_sort_key(doc.get(field))
+            return rql_sort_key(getter(field, doc))
+        return key, descending[0]
+    elif all(descending) or not any(descending):
+        return (lambda doc: tuple(rql_sort_key(getter(f, doc)) for f in fields)), descending[0]
+    fields_and_desc = list(zip(fields, descending))
+    def key(doc):
+        return tuple(
+            Descending(rql_sort_key(getter(f, doc))) if desc else rql_sort_key(getter(f, doc))
+            for f, desc in fields_and_desc
+        )
+    return key, False
+
+def top_k(count, key, reverse, sequence):
+    # same as `sorted(sequence, key=key, reverse=reverse)[0:count]`, ties included,
+    # but only keeps `count` elements around; with a key from `order_by_key` or
+    # `func_sort_key`, that's the same as the start of `sort_by_many` or `sort_by_func`
+    if reverse:
+        return heapq.nlargest(count, sequence, key=key)
+    return heapq.nsmallest(count, sequence, key=key)
 
 def indices_of_passing(pred, sequence):
     out = []
@@ -353,6 +552,55 @@ def make_hashable(x):
             out.append((k, make_hashable(v)))
         return tuple(elem for elem in out)
 
+def index_key(x):
+    # like `make_hashable`, but keeps array order, since
+    # `[1, 2]` and `[2, 1]` are different keys in an index.
+    if isinstance(x, list):
+        return tuple(index_key(elem) for elem in x)
+    elif isinstance(x, dict):
+        return tuple((k, index_key(v)) for k, v in sorted_iteritems(x))
+    return x
+
+class RqlBound(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return 'r.%s' % self.name
+
+MINVAL = RqlBound('minval')
+MAXVAL = RqlBound('maxval')
+
+#   Sort key ranks of the commonest types, checked before anything else in `rql_sort_key`.
+SIMPLE_SORT_RANKS = {bool: 2, int: 4, float: 4, text_type: 8}
+
+def rql_sort_key(x):
+    # RethinkDB orders values of different types by type name:
+    # arrays < booleans < null < numbers < objects < binary < times < strings,
+    # with r.minval and r.maxval below and above everything else.
+    rank = SIMPLE_SORT_RANKS.get(type(x))
+    if rank is not None:
+        return (rank, x)
+    elif x is MINVAL:
+        return (0,)
+    elif x is MAXVAL:
+        return (10,)
+    elif isinstance(x, (list, tuple)):
+        return (1, tuple(rql_sort_key(elem) for elem in x))
+    elif isinstance(x, bool):
+        return (2, x)
+    elif x is None:
+        return (3,)
+    elif isinstance(x, numbers.Number):
+        return (4, x)
+    elif isinstance(x, dict):
+        return (5, tuple((k, rql_sort_key(v)) for k, v in sorted_iteritems(x)))
+    elif isinstance(x, datetime.datetime):
+        return (7, x)
+    elif isinstance(x, basestring):
+        return (8, x)
+    return (6, x)
+
 class DictableSet(set):
     def __init__(self, elems):
         elems = map(make_hashable, elems)
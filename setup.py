@@ -12,7 +12,7 @@ setup(
     url="http://github.com/scivey/mockthink",
     maintainer="Scott Ivey",
     maintainer_email="scott.ivey@gmail.com",
-    packages=['mockthink'],
+    packages=['mockthink', 'mockthink.bench'],
     package_dir={'mockthink': 'mockthink'},
     install_requires=['rethinkdb>=2.2.0,<2.3.0', 'dateutils', 'future']
 )